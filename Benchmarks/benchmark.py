@@ -0,0 +1,498 @@
+"""
+Benchmarks of the IC chain on synthetic data.
+
+Generates synthetic MCRD files (see Benchmarks.synthetic) and a stub
+conditions database (see Benchmarks.stubdb) in a scratch directory, runs
+DIOMIRA, ISIDORA, ANASTASIA and DOROTHEA over them and times the kernels
+of the chain for several event window lengths. The results are written to
+a JSON file named after the current commit, so that two commits can be
+compared:
+
+    python Benchmarks/benchmark.py run -s 100 400 -n 5
+    python Benchmarks/benchmark.py compare old.json new.json --tolerance 0.1
+
+The cold start of the cities (see Benchmarks.startup) is part of the run
+and can also be checked on its own, failing on a regression:
+
+    python Benchmarks/benchmark.py startup --against old.json
+
+The compression settings of the data nodes can be tuned on a sample of a
+real file (see Benchmarks.compression):
+
+    python Benchmarks/benchmark.py compression file.h5 -n 10
+
+and the peak search of the SiPM calibration compared with the wavelet one
+on simulated histograms (see Benchmarks.calibration):
+
+    python Benchmarks/benchmark.py calibration -n 300 --dx 1
+
+All timings are stored in seconds per event (cities and stages) or per call
+(kernels). Steps that cannot run (e.g. the cython modules are not compiled)
+are reported as skipped, except a city that fails to import for another
+reason, which stops the benchmark.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import timeit
+import shutil
+import argparse
+import platform
+import tempfile
+import traceback
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+import tables as tb
+
+import Core.system_of_units as units
+from Core.Configure import read_config_file
+from Benchmarks.stubdb import use_stub_db
+from Benchmarks.synthetic import write_mcrd, TOPOLOGIES
+from Benchmarks.startup import (CITY_MODULES, import_time, missing_optional,
+                                print_packages)
+import Benchmarks.compression as compression
+import Benchmarks.calibration as calibration
+
+ICDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS = os.path.join(ICDIR, "Benchmarks", "results")
+
+
+def git_commit():
+    """
+    Describe the checked out commit (with a -dirty suffix if modified).
+    """
+    try:
+        return subprocess.check_output(["git", "describe", "--always",
+                                        "--dirty"], cwd=ICDIR).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def best_time(function, repeat=3, number=1):
+    """
+    Best time per call of function over repeat rounds of number calls.
+    """
+    return min(timeit.Timer(function).repeat(repeat, number)) / number
+
+
+def city_options(city, **options):
+    """
+    Default configuration of a city with some parameters overriden.
+    """
+    CFP = read_config_file(os.path.join(ICDIR, "Config",
+                                        "{}_default.conf".format(city)))
+    CFP.update(SKIP=0, RUN_ALL=True, VERBOSITY=30)
+    CFP.update(options)
+    return CFP
+
+
+def city_class(city):
+    """
+    Import the City subclass of a city (Diomira for DIOMIRA, etc.).
+    """
+    module = __import__("Cities." + city, fromlist=[city])
+    return getattr(module, city.capitalize())
+
+
+class Benchmark(object):
+    """
+    Collects the timings of one benchmark session.
+
+    Parameters
+    ----------
+    workdir : string
+        Scratch directory for the stub database and the data files.
+    nevt : int
+        Number of events per file.
+    repeat : int
+        Number of rounds for the kernel timings.
+    """
+    def __init__(self, workdir, nevt, repeat):
+        self.workdir = workdir
+        self.nevt = nevt
+        self.repeat = repeat
+        self.timings = OrderedDict()
+        self.details = OrderedDict()
+        self.skipped = OrderedDict()
+
+    def path(self, *parts):
+        return os.path.join(self.workdir, "_".join(map(str, parts)) + ".h5")
+
+    def measure(self, key, function):
+        """
+        Run function, which returns a timing or a dictionary of timings
+        keyed by suffix, and store the result. Errors mark the key as
+        skipped.
+        """
+        print("Running {}".format(key))
+        try:
+            result = function()
+        except Exception as error:
+            traceback.print_exc()
+            self.skipped[key] = "{}: {}".format(type(error).__name__, error)
+            return False
+        if not isinstance(result, dict):
+            result = {"": result}
+        for suffix, seconds in result.items():
+            self.timings[key + suffix] = seconds
+        return True
+
+    def run_city(self, city, tag, **options):
+        timing = os.path.join(self.workdir,
+                              "{}_{}.timing.json".format(
+                              city, tag.replace("/", "_")))
+        CFP = city_options(city, NEVENTS=self.nevt, TIMING=timing, **options)
+        city_class(city)(CFP).run()
+
+        with open(timing) as sidecar:
+            report = json.load(sidecar)
+        self.details["{}/{}".format(tag, city)] = report
+        events = max(report["events"], 1)
+        timings = {"": report["wall"] / events}
+        for stage, times in report["stages"].items():
+            timings["/" + stage] = times["wall"] / events
+        return timings
+
+    def cities(self, topology, size):
+        """
+        Run the chain over a synthetic file. Each city runs only if the
+        previous one succeeded.
+        """
+        tag = "{}/{}us".format(topology, size)
+        mcrd = self.path("mcrd", topology, size)
+        rwf = self.path("rwf", topology, size)
+        pmaps = self.path("pmaps", topology, size)
+        pmtwl = int(size * units.mus / (25 * units.ns))
+
+        steps = (("DIOMIRA", {"FILE_IN": mcrd, "FILE_OUT": rwf}),
+                 ("ISIDORA", {"FILE_IN": rwf,
+                              "N_BASELINE": min(28000, pmtwl // 10)}),
+                 ("ANASTASIA", {"FILE_IN": rwf}),
+                 ("DOROTHEA", {"FILE_IN": rwf, "FILE_OUT": pmaps}))
+        for i, (city, options) in enumerate(steps):
+            key = "{}/{}".format(tag, city)
+            if not self.measure(key, lambda: self.run_city(city, tag,
+                                                           **options)):
+                for later, _ in steps[i + 1:]:
+                    self.skipped["{}/{}".format(tag, later)] = \
+                        "{} failed".format(city)
+                break
+
+    def kernels(self, topology, size):
+        """
+        Time the key kernels of the chain on the first event of the file.
+        """
+        tag = "{}/{}us/kernel".format(topology, size)
+        with tb.open_file(self.path("mcrd", topology, size)) as h5in:
+            pmtrd = h5in.root.pmtrd[0]
+            sipmrd = h5in.root.sipmrd[0]
+
+        def deconvolve_signal_acum():
+            import ICython.Sierpe.cBLR as cblr
+            import Database.loadDB as DB
+            from Cities.DIOMIRA import simulate_pmt_response
+            rwf, blr = simulate_pmt_response(pmtrd)
+            signal = rwf[0].astype(np.int16)
+            pmtdf = DB.DataPMT()
+            return best_time(lambda: cblr.deconvolve_signal_acum(
+                signal, n_baseline=min(28000, len(signal) // 10),
+                coef_clean=pmtdf.coeff_c[0], coef_blr=pmtdf.coeff_blr[0],
+                thr_trigger=5, acum_discharge_length=5000), self.repeat)
+
+        def build_pmap():
+            from Cities.DOROTHEA import build_pmap
+            pmtwf = pmtrd.sum(axis=0).reshape(-1, 25).sum(axis=1)
+            sipmwfs = sipmrd.astype(float)
+            return best_time(lambda: build_pmap(pmtwf, sipmwfs), self.repeat)
+
+        def sample():
+            from Core.RandomSampling import NoiseSampler
+            sampler = NoiseSampler(sipmrd.shape[1], True)
+            return best_time(sampler.Sample, self.repeat)
+
+        def store_wf_table():
+            import Core.wfmFunctions as wfm
+            import Core.tblFunctions as tbl
+            from Core.Nh5 import SENSOR_WF
+            wfdic = wfm.zero_suppression(sipmrd, 0.)
+            with tb.open_file(self.path("twf", topology, size), "w") as h5f:
+                table = h5f.create_table(h5f.root, "SiPM", SENSOR_WF)
+                return best_time(lambda: tbl.store_wf_table(0, table, wfdic),
+                                 self.repeat)
+
+        for kernel in (deconvolve_signal_acum, build_pmap, sample,
+                       store_wf_table):
+            name = ("NoiseSampler.Sample" if kernel is sample
+                    else kernel.__name__)
+            self.measure("{}/{}".format(tag, name), kernel)
+
+    def startup(self, modules=CITY_MODULES):
+        """
+        Time the cold start (import in a new interpreter) of the cities.
+        Cities needing a compiled module that is not built are skipped;
+        any other import error is raised.
+        """
+        for module in modules:
+            key = "startup/" + module
+            print("Running {}".format(key))
+            try:
+                seconds, packages = import_time(module, self.repeat)
+            except ImportError as error:
+                if not missing_optional(error):
+                    raise
+                self.skipped[key] = "ImportError: {}".format(error)
+                continue
+            self.details[key] = packages
+            print_packages(packages)
+            self.timings[key] = seconds
+
+    def run(self, topologies, sizes, cities=True):
+        self.startup()
+        for topology in topologies:
+            for size in sizes:
+                print("Generating {} events of type {} with a {} mus window"
+                      .format(self.nevt, topology, size))
+                write_mcrd(self.path("mcrd", topology, size), self.nevt,
+                           topology, size * units.mus)
+                self.kernels(topology, size)
+                if cities:
+                    self.cities(topology, size)
+
+    def results(self, **config):
+        return OrderedDict((("commit", git_commit()),
+                            ("date", time.strftime("%Y-%m-%d %H:%M:%S")),
+                            ("host", platform.node()),
+                            ("python", platform.python_version()),
+                            ("numpy", np.__version__),
+                            ("tables", tb.__version__),
+                            ("config", config),
+                            ("timings", self.timings),
+                            ("skipped", self.skipped),
+                            ("details", self.details)))
+
+
+def compare(old, new, tolerance=0.1, prefix=""):
+    """
+    Compare the timings of two result sets.
+
+    Parameters
+    ----------
+    old, new : dictionaries
+        Results as written by run.
+    tolerance : float, optional
+        Relative slowdown above which a timing is flagged. Default is 0.1.
+    prefix : string, optional
+        Compare only the timings whose key starts with prefix.
+
+    Returns
+    -------
+    regressions : list of strings
+        Keys of the flagged timings.
+    """
+    print("{:<45} {:>12} {:>12} {:>8}".format(
+          "", old["commit"], new["commit"], "change"))
+    regressions = []
+    for key in sorted(set(old["timings"]) | set(new["timings"])):
+        if not key.startswith(prefix):
+            continue
+        if key not in old["timings"] or key not in new["timings"]:
+            print("{:<45} {:>12} {:>12}".format(
+                  key, *("{:.4g}".format(r["timings"][key])
+                         if key in r["timings"] else "-" for r in (old, new))))
+            continue
+        t0, t1 = old["timings"][key], new["timings"][key]
+        change = t1 / t0 - 1 if t0 > 0 else 0.
+        flag = ""
+        if change > tolerance:
+            regressions.append(key)
+            flag = "  <-- SLOWER"
+        print("{:<45} {:>12.4g} {:>12.4g} {:>+7.1%}{}".format(
+              key, t0, t1, change, flag))
+    return regressions
+
+
+def load(filename):
+    with open(filename) as jfile:
+        return json.load(jfile)
+
+
+def save(results, ofile=None):
+    """
+    Write the results to ofile or to results/<date>_<commit>.json.
+    """
+    if ofile is None:
+        if not os.path.isdir(RESULTS):
+            os.makedirs(RESULTS)
+        ofile = os.path.join(RESULTS, "{}_{}.json".format(
+                time.strftime("%Y%m%d_%H%M%S"), results["commit"]))
+    with open(ofile, "w") as jfile:
+        json.dump(results, jfile, indent=2)
+    print("Results written to {}".format(ofile))
+
+
+def tune_compression(flags):
+    """
+    Run the compression autotuner over the files given in the command line.
+    """
+    results = OrderedDict((("commit", git_commit()),
+                           ("date", time.strftime("%Y-%m-%d %H:%M:%S")),
+                           ("host", platform.node()),
+                           ("tables", tb.__version__),
+                           ("blosc", tb.blosc_compressor_list()),
+                           ("config", dict(nevt=flags.n, repeat=flags.r,
+                                           tolerance=flags.tolerance)),
+                           ("compression", OrderedDict()),
+                           ("recommended", OrderedDict())))
+    workdir = tempfile.mkdtemp(prefix="icbench_")
+    try:
+        for filename in flags.files:
+            samples = compression.sample_nodes(filename, flags.nodes, flags.n)
+            if not samples:
+                print("No nodes matching {} in {}".format(flags.nodes,
+                                                           filename))
+                continue
+            tuned = compression.tune(samples, workdir, flags.r)
+            best = compression.recommend(tuned, flags.tolerance)
+            compression.print_results(tuned, best)
+            results["compression"][filename] = tuned
+            results["recommended"][filename] = best
+    finally:
+        shutil.rmtree(workdir)
+    save(results, flags.o)
+    return 0
+
+
+def bench_calibration(flags):
+    """
+    Compare the peak searches of the calibration on simulated histograms.
+    """
+    timings, summary = calibration.compare_peaks(flags.n, flags.dx, flags.r)
+    calibration.print_comparison(timings, summary)
+    results = OrderedDict((("commit", git_commit()),
+                           ("date", time.strftime("%Y-%m-%d %H:%M:%S")),
+                           ("host", platform.node()),
+                           ("numpy", np.__version__),
+                           ("config", dict(nsensors=flags.n, dx=flags.dx,
+                                           repeat=flags.r)),
+                           ("timings", OrderedDict(
+                            ("calib/peaks/" + name, seconds)
+                            for name, seconds in sorted(timings.items()))),
+                           ("peaks", summary)))
+    save(results, flags.o)
+    return 0
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(argv[0])
+    subparsers = parser.add_subparsers(dest="command")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-r", metavar="repeat", type=int, default=3,
+                        help="rounds for the kernel and startup timings")
+    common.add_argument("-o", metavar="ofile",
+                        help="results file (default: results/<date>_<commit>)")
+    common.add_argument("--against", metavar="rfile",
+                        help="compare with a previous results file")
+    common.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative slowdown flagged as a regression")
+
+    run_ = subparsers.add_parser("run", parents=[common],
+                                 help="run the benchmarks")
+    run_.add_argument("-s", metavar="size", type=int, nargs="+",
+                      default=[100, 400], help="event windows in mus")
+    run_.add_argument("-n", metavar="nevt", type=int, default=5,
+                      help="number of events per file")
+    run_.add_argument("-t", metavar="topology", nargs="+",
+                      default=sorted(TOPOLOGIES), choices=sorted(TOPOLOGIES),
+                      help="event topologies")
+    run_.add_argument("-w", metavar="workdir",
+                      help="keep the data files in this directory")
+    run_.add_argument("--kernels-only", action="store_true",
+                      help="do not run the cities")
+
+    subparsers.add_parser("startup", parents=[common],
+                          help="time the cold start of the cities only")
+
+    compare_ = subparsers.add_parser("compare", help="compare two results")
+    compare_.add_argument("old")
+    compare_.add_argument("new")
+    compare_.add_argument("--tolerance", type=float, default=0.1,
+                          help="relative slowdown flagged as a regression")
+
+    tune = subparsers.add_parser("compression",
+                                 help="tune the compression of data nodes")
+    tune.add_argument("files", metavar="file", nargs="+")
+    tune.add_argument("-n", metavar="nevt", type=int, default=5,
+                      help="number of events sampled from each file")
+    tune.add_argument("-r", metavar="repeat", type=int, default=1,
+                      help="rounds for each configuration")
+    tune.add_argument("-o", metavar="ofile",
+                      help="results file (default: results/<date>_<commit>)")
+    tune.add_argument("--nodes", nargs="+", default=compression.NODES,
+                      help="node paths, wildcards allowed")
+    tune.add_argument("--tolerance", type=float, default=0.1,
+                      help="relative loss of compression ratio accepted "
+                           "for speed")
+
+    calib = subparsers.add_parser("calibration",
+                                  help="compare the calibration peak searches")
+    calib.add_argument("-n", metavar="nsensors", type=int, default=300,
+                       help="number of simulated sensors")
+    calib.add_argument("--dx", type=float, default=1.,
+                       help="bin width of the histograms in adc counts")
+    calib.add_argument("-r", metavar="repeat", type=int, default=3,
+                       help="rounds for the timings")
+    calib.add_argument("-o", metavar="ofile",
+                       help="results file (default: results/<date>_<commit>)")
+
+    flags = parser.parse_args(argv[1:])
+
+    if flags.command == "compression":
+        return tune_compression(flags)
+
+    if flags.command == "calibration":
+        return bench_calibration(flags)
+
+    if flags.command == "compare":
+        regressions = compare(load(flags.old), load(flags.new),
+                              flags.tolerance)
+        return 1 if regressions else 0
+
+    if flags.command == "startup":
+        bench = Benchmark(None, 0, flags.r)
+        bench.startup()
+        results = bench.results(repeat=flags.r)
+        prefix = "startup/"
+    else:
+        workdir = flags.w or tempfile.mkdtemp(prefix="icbench_")
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        use_stub_db(workdir)
+        try:
+            bench = Benchmark(workdir, flags.n, flags.r)
+            bench.run(flags.t, flags.s, not flags.kernels_only)
+        finally:
+            if not flags.w:
+                shutil.rmtree(workdir)
+        results = bench.results(sizes=flags.s, nevt=flags.n,
+                                topologies=flags.t, repeat=flags.r)
+        prefix = ""
+
+    save(results, flags.o)
+    for key, reason in bench.skipped.items():
+        print("Skipped {}: {}".format(key, reason))
+
+    if flags.against:
+        return 1 if compare(load(flags.against), results,
+                            flags.tolerance, prefix) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,134 @@
+"""
+Benchmark of the peak search of the SiPM calibration (Calib.calib).
+
+Simulates the calibration histograms of a set of sensors (gaussian peaks
+with poisson weights, as fitted by ffun_poissongauss) and compares the
+array-wide peak search cal_est_peaks with the per-sensor wavelet search
+cal_est_peaks_cwt: their times, how many of the first peaks found by the
+wavelet search are found by both, the differences of the positions and
+rms of those, and the error of the gain (distance of the first two peaks)
+of each with respect to the simulated one.
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import numpy as np
+
+
+def simulate_calibration(nsensors=300, dx=1., gains=(12.5, 25.),
+                         mus=(0.5, 2.5), nevt=20000, seed=1):
+    """
+    Calibration histograms with random gains and mean number of pes.
+
+    Parameters
+    ----------
+    nsensors : int, optional
+        Number of sensors. Default is 300.
+    dx : float, optional
+        Bin width in adc counts. Default is 1.
+    gains, mus : tuples, optional
+        Ranges of the gains (adc counts) and of the mean number of pes.
+    nevt : int, optional
+        Number of entries of each histogram. Default is 20000.
+    seed : int, optional
+        Seed of the random numbers.
+
+    Returns
+    -------
+    cal : Calib.calib.CalData
+    true_gains : np.ndarray
+    """
+    import Calib.calib as calib
+    rng = np.random.RandomState(seed)
+    true_gains = rng.uniform(gains[0], gains[1], nsensors)
+    true_mus = rng.uniform(mus[0], mus[1], nsensors)
+    cal = calib.CalData(nsensors=nsensors)
+    cal.xbins = np.arange(-20., 130., dx)
+    cal.nbins = len(cal.xbins)
+    cal.indexes = list(range(nsensors))
+    cal.values = np.array([rng.poisson(calib.ffun_poissongauss(
+                           [nevt * dx, 0., gain, mu, 2., 1.5], cal.xbins))
+                           for gain, mu in zip(true_gains, true_mus)])
+    return cal, true_gains
+
+
+def match_peaks(ref_peaks, peaks, npeaks=3, tolerance=1.):
+    """
+    Pair the first npeaks reference peaks of each sensor with the closest
+    peak of the other search, if closer than tolerance (adc counts).
+
+    Returns
+    -------
+    pairs : list of (sensor, reference peak, peak) index tuples
+    nref : int
+        Number of reference peaks considered.
+    """
+    pairs, nref = [], 0
+    for i, (ref, xps) in enumerate(zip(ref_peaks, peaks)):
+        for j, x in enumerate(ref[:npeaks]):
+            if not np.isfinite(x):
+                continue
+            nref += 1
+            if len(xps) == 0:
+                continue
+            k = int(np.argmin(np.abs(xps - x)))
+            if abs(xps[k] - x) < tolerance:
+                pairs.append((i, j, k))
+    return pairs, nref
+
+
+def gain_errors(peaks, true_gains):
+    """
+    Absolute difference of the distance of the first two peaks and the
+    true gain (nan for the sensors with less than two peaks).
+    """
+    return np.array([abs(xps[1] - xps[0] - gain) if len(xps) > 1 else np.nan
+                     for xps, gain in zip(peaks, true_gains)])
+
+
+def compare_peaks(nsensors=300, dx=1., repeat=3, seed=1):
+    """
+    Time and compare the two peak searches on simulated histograms.
+
+    Returns
+    -------
+    timings : dictionary
+        Time per sensor (seconds) of each search.
+    summary : dictionary
+        Agreement of the peaks and errors of the gains.
+    """
+    import Calib.calib as calib
+    cal, true_gains = simulate_calibration(nsensors, dx, seed=seed)
+    with np.errstate(all="ignore"):
+        results = {}
+        timings = {}
+        for name, search in (("cwt", calib.cal_est_peaks_cwt),
+                             ("bulk", calib.cal_est_peaks)):
+            results[name] = search(cal)
+            timings[name] = min(timeit.Timer(lambda: search(cal)).repeat(
+                                repeat, 1)) / nsensors
+        (cwt_peaks, cwt_rmss), (peaks, rmss) = results["cwt"], results["bulk"]
+        pairs, nref = match_peaks(cwt_peaks, peaks)
+        dxs = [abs(peaks[i][k] - cwt_peaks[i][j]) for i, j, k in pairs]
+        drmss = [abs(rmss[i][k] - cwt_rmss[i][j]) for i, j, k in pairs]
+        summary = dict(matched=len(pairs) / float(max(nref, 1)),
+                       position=float(np.mean(dxs)) if dxs else np.nan,
+                       rms=float(np.nanmean(drmss)) if drmss else np.nan,
+                       gain_cwt=float(np.nanmean(gain_errors(cwt_peaks,
+                                                             true_gains))),
+                       gain_bulk=float(np.nanmean(gain_errors(peaks,
+                                                              true_gains))))
+    return timings, summary
+
+
+def print_comparison(timings, summary):
+    print("cal_est_peaks_cwt {:.3g} s/sensor, cal_est_peaks {:.3g} s/sensor "
+          "(x{:.0f})".format(timings["cwt"], timings["bulk"],
+                             timings["cwt"] / timings["bulk"]))
+    print("first 3 wavelet peaks also found: {:.1%}, mean difference of "
+          "their positions {:.3f} and rms {:.3f} adc".format(
+           summary["matched"], summary["position"], summary["rms"]))
+    print("mean gain error: wavelet {:.3f} adc, bulk {:.3f} adc".format(
+          summary["gain_cwt"], summary["gain_bulk"]))
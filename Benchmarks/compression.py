@@ -0,0 +1,253 @@
+"""
+Compression and chunking autotuner for the IC datasets.
+
+Takes a sample of the nodes of a file (by default the raw waveforms, the
+zero suppressed waveforms and the PMaps), rewrites it with every
+combination of codec, compression level, shuffle filter and chunkshape,
+and measures the write throughput, the read throughput and the
+compression ratio of each. A configuration is then recommended for each
+node: the fastest one (write plus read time) among those whose ratio is
+within a tolerance of the best.
+
+Throughputs are given in MB/s of uncompressed data. The read timings use
+a file which has just been written, so they mostly measure decompression
+(the file is likely in the page cache).
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import fnmatch
+from collections import OrderedDict
+
+import tables as tb
+
+import Core.tblFunctions as tbl
+
+NODES = ("/RD/pmtrwf", "/RD/sipmrwf", "/ZS/*", "/PMAPS/*")
+CODECS = (("zlib", (1, 4, 9)),
+          ("blosc:blosclz", (5,)),
+          ("blosc:lz4", (1, 5, 9)),
+          ("blosc:lz4hc", (5,)),
+          ("blosc:zstd", (1, 5)))
+SHUFFLES = ("none", "shuffle", "bitshuffle")
+# target bytes per chunk for the tables
+TABLE_CHUNKS = (16 * 1024, 256 * 1024, 1024 * 1024)
+
+
+def filter_options():
+    """
+    All the combinations of codec, level and shuffle. bitshuffle is only
+    available for the blosc codecs.
+
+    Returns
+    -------
+    options : list of dictionaries
+        Keyword arguments of tb.Filters.
+    """
+    options = [dict(complevel=0)]
+    for complib, levels in CODECS:
+        for level in levels:
+            for shuffle in SHUFFLES:
+                if shuffle == "bitshuffle" and not complib.startswith("blosc"):
+                    continue
+                options.append(dict(complib=complib, complevel=level,
+                                    shuffle=shuffle == "shuffle",
+                                    bitshuffle=shuffle == "bitshuffle"))
+    return options
+
+
+def filter_label(options):
+    """
+    Short description of a filter configuration, with the name of the
+    tblFunctions.filters preset if there is one.
+    """
+    for name, preset in tbl.FILTERS.items():
+        if tb.Filters(**preset) == tb.Filters(**options):
+            return name
+    if not options["complevel"]:
+        return "NOCOMPR"
+    shuffle = ("bitshuffle" if options["bitshuffle"] else
+               "shuffle" if options["shuffle"] else "noshuffle")
+    return "{}/{}/{}".format(options["complib"], options["complevel"],
+                             shuffle)
+
+
+def chunkshapes(node_sample):
+    """
+    Candidate chunkshapes for a sample: the PyTables default, one event
+    and one sensor of one event for the arrays; the PyTables default and
+    some fixed sizes in bytes for the tables.
+
+    Returns
+    -------
+    chunkshapes : OrderedDict
+        label: chunkshape (None for the PyTables default).
+    """
+    shapes = OrderedDict((("auto", None),))
+    if node_sample.dtype.names is None:
+        shapes["event"] = (1,) + node_sample.shape[1:]
+        if node_sample.ndim > 2:
+            shapes["sensor"] = (1, 1) + node_sample.shape[2:]
+    else:
+        for size in TABLE_CHUNKS:
+            rows = max(1, size // node_sample.dtype.itemsize)
+            shapes["{}kB".format(size // 1024)] = (rows,)
+    return shapes
+
+
+def sample_nodes(filename, patterns=NODES, nevt=10):
+    """
+    Read the first events of the nodes of a file matching some patterns.
+
+    Parameters
+    ----------
+    filename : string
+        Input file.
+    patterns : sequence of strings, optional
+        Node paths, shell-style wildcards allowed. Default is NODES.
+    nevt : int, optional
+        Number of events to sample. Default is 10.
+
+    Returns
+    -------
+    samples : OrderedDict
+        node path: np.ndarray (structured for the tables).
+    """
+    samples = OrderedDict()
+    with tb.open_file(filename) as h5in:
+        for node in h5in.walk_nodes("/", "Leaf"):
+            if not any(fnmatch.fnmatch(node._v_pathname, pattern)
+                       for pattern in patterns):
+                continue
+            if isinstance(node, tb.Table):
+                nrows = node.nrows
+                if "event" in node.colnames and node.nrows:
+                    events = node.col("event")
+                    first = events[0]
+                    nrows = (events < first + nevt).sum()
+                samples[node._v_pathname] = node[:nrows]
+            elif isinstance(node, tb.EArray):
+                samples[node._v_pathname] = node[:nevt]
+    return samples
+
+
+def measure(node_sample, filters, chunkshape, filename, repeat=3):
+    """
+    Write and read a sample with a given configuration.
+
+    Parameters
+    ----------
+    node_sample : np.ndarray
+        Data to write (a structured array is written as a table).
+    filters : dictionary
+        Keyword arguments of tb.Filters.
+    chunkshape : tuple or None
+        Chunkshape of the node.
+    filename : string
+        Scratch file.
+    repeat : int, optional
+        Number of rounds; the best time is kept. Default is 3.
+
+    Returns
+    -------
+    result : dictionary
+        write and read throughputs (MB/s) and compression ratio.
+    """
+    mbytes = node_sample.nbytes / 1e6
+    write, read = float("inf"), float("inf")
+    for _ in range(repeat):
+        t0 = time.time()
+        with tb.open_file(filename, "w") as h5out:
+            if node_sample.dtype.names is None:
+                node = h5out.create_earray(h5out.root, "sample",
+                                           atom=tb.Atom.from_dtype(
+                                                node_sample.dtype),
+                                           shape=(0,) + node_sample.shape[1:],
+                                           filters=tb.Filters(**filters),
+                                           chunkshape=chunkshape)
+            else:
+                node = h5out.create_table(h5out.root, "sample",
+                                          node_sample.dtype,
+                                          filters=tb.Filters(**filters),
+                                          chunkshape=chunkshape)
+            node.append(node_sample)
+            node.flush()
+            size = node.size_on_disk
+        write = min(write, time.time() - t0)
+
+        t0 = time.time()
+        with tb.open_file(filename) as h5in:
+            h5in.root.sample.read()
+        read = min(read, time.time() - t0)
+    os.remove(filename)
+    return dict(write=mbytes / write, read=mbytes / read,
+                ratio=node_sample.nbytes / float(max(size, 1)))
+
+
+def tune(samples, workdir, repeat=3, verbose=True):
+    """
+    Measure all the configurations for each sample.
+
+    Returns
+    -------
+    results : OrderedDict
+        node path: list of dictionaries with the filters, the chunkshape
+        (label and shape) and the measurements.
+    """
+    results = OrderedDict()
+    scratch = os.path.join(workdir, "compression.h5")
+    for path, node_sample in samples.items():
+        if verbose:
+            print("Tuning {} ({:.1f} MB)".format(path, node_sample.nbytes / 1e6))
+        results[path] = []
+        for label, chunkshape in chunkshapes(node_sample).items():
+            for filters in filter_options():
+                result = measure(node_sample, filters, chunkshape, scratch,
+                                 repeat)
+                result.update(filters=filters, filter=filter_label(filters),
+                              chunks=label, chunkshape=chunkshape)
+                results[path].append(result)
+    return results
+
+
+def recommend(results, tolerance=0.1):
+    """
+    Choose a configuration for each node: the one with the shortest write
+    plus read time among those whose compression ratio is at least
+    (1 - tolerance) times the best.
+
+    Returns
+    -------
+    best : OrderedDict
+        node path: result of the chosen configuration.
+    """
+    best = OrderedDict()
+    for path, configurations in results.items():
+        max_ratio = max(c["ratio"] for c in configurations)
+        good = [c for c in configurations
+                if c["ratio"] >= (1 - tolerance) * max_ratio]
+        best[path] = min(good, key=lambda c: 1. / c["write"] + 1. / c["read"])
+    return best
+
+
+def print_results(results, best, n=10):
+    """
+    Print the n configurations with the highest ratio of each node and the
+    recommended one.
+    """
+    line = "    {:<28} {:>8} {:>8} {:>10} {:>10}"
+    for path, configurations in results.items():
+        print(path)
+        print(line.format("filter", "chunks", "ratio", "write MB/s",
+                          "read MB/s"))
+        for c in sorted(configurations, key=lambda c: -c["ratio"])[:n]:
+            print(line.format(c["filter"], c["chunks"],
+                              "{:.2f}".format(c["ratio"]),
+                              "{:.0f}".format(c["write"]),
+                              "{:.0f}".format(c["read"])))
+        c = best[path]
+        print("  recommended: {} with {} chunks (ratio {:.2f}, "
+              "write {:.0f} MB/s, read {:.0f} MB/s)".format(
+              c["filter"], c["chunks"], c["ratio"], c["write"], c["read"]))
@@ -0,0 +1,106 @@
+"""
+Cold start time of the cities.
+
+Each city module is imported in a fresh interpreter with
+`python -X importtime` and the cumulative import time of the module is
+recorded (the wall time of the interpreter is used instead where
+-X importtime is not available, i.e. before python 3.7).
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import subprocess
+from collections import defaultdict
+
+ICDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CITY_MODULES = ("Cities.DIOMIRA", "Cities.ISIDORA", "Cities.ANASTASIA",
+                "Cities.DOROTHEA")
+HAS_IMPORTTIME = sys.version_info >= (3, 7)
+
+# Compiled (cython) modules that may not be built
+OPTIONAL_MODULES = ("ICython.Sierpe.cBLR",)
+
+
+def parse_importtime(output):
+    """
+    Parse the output of -X importtime.
+
+    Returns
+    -------
+    times : dictionary
+        module: (self, cumulative) import times in seconds.
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            own, cumulative = int(fields[0]), int(fields[1])
+        except ValueError:  # header
+            continue
+        times[fields[2].strip()] = (own * 1e-6, cumulative * 1e-6)
+    return times
+
+
+def import_time(module, repeat=5):
+    """
+    Import a module in a fresh interpreter *repeat* times.
+
+    Returns
+    -------
+    seconds : float
+        Best import time of the module.
+    packages : dictionary
+        Import time (self time of all their modules) of each top level
+        package in the best run. Empty without -X importtime.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+                        filter(None, (ICDIR, env.get("PYTHONPATH"))))
+    command = [sys.executable, "-c", "import " + module]
+    if HAS_IMPORTTIME:
+        command[1:1] = ["-X", "importtime"]
+
+    best, packages = float("inf"), {}
+    for _ in range(repeat):
+        t0 = time.time()
+        process = subprocess.Popen(command, cwd=ICDIR, env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        _, err = process.communicate()
+        wall = time.time() - t0
+        err = err.decode()
+        if process.returncode:
+            raise ImportError(err.strip().splitlines()[-1])
+
+        times = parse_importtime(err)
+        seconds = times[module][1] if module in times else wall
+        if seconds < best:
+            best = seconds
+            packages = defaultdict(float)
+            for name, (own, _) in times.items():
+                packages[name.split(".")[0]] += own
+    return best, dict(packages)
+
+
+def missing_optional(error):
+    """
+    Whether an ImportError raised by import_time is due to one of the
+    OPTIONAL_MODULES not being built (python 2 only names the last part
+    of the module).
+    """
+    message = str(error)
+    return "No module named" in message and any(
+        name.split(".")[-1] in message for name in OPTIONAL_MODULES)
+
+
+def print_packages(packages, n=8):
+    """
+    Print the n top level packages which take longest to import.
+    """
+    for name, seconds in sorted(packages.items(), key=lambda p: -p[1])[:n]:
+        print("    {0: <20} {1:8.3f} s".format(name, seconds))
@@ -0,0 +1,175 @@
+"""
+Stub conditions database for the benchmarks.
+
+Writes a sqlite file with the same tables as the one downloaded by
+Database/download.py, filled with plausible constants for 12 PMTs and
+1792 SiPMs, so that Database.loadDB can be used without network access.
+"""
+
+from __future__ import print_function
+
+import os
+import sqlite3
+
+import numpy as np
+
+NPMT = 12
+NSIPM = 1792
+NNOISEBINS = 300
+MINRUN = 0
+
+# name: list of (column, sqlite type)
+TABLES = {"DetectorGeo": [("XMIN", "float"), ("XMAX", "float"),
+                          ("YMIN", "float"), ("YMAX", "float"),
+                          ("ZMIN", "float"), ("ZMAX", "float"),
+                          ("RMAX", "float")],
+          "PmtBlr": [("coeff_c", "double"), ("coeff_blr", "double")],
+          "PmtGain": [("adc_to_pes", "float")],
+          "PmtSigma": [("sigma", "float")],
+          "PmtMapping": [("ChannelID", "integer")],
+          "PmtMask": [("Active", "integer")],
+          "PmtNoiseRms": [("noise_rms", "double")],
+          "PmtPosition": [("PmtID", "varchar(5)"), ("X", "float"),
+                          ("Y", "float")],
+          "SipmBaseline": [("Energy", "float")],
+          "SipmGain": [("adc_to_pes", "float")],
+          "SipmMapping": [("ChannelID", "integer")],
+          "SipmMask": [("Active", "integer")],
+          "SipmNoise": [(str(i), "float") for i in range(NNOISEBINS)],
+          "SipmNoiseBins": [("Bin", "integer"), ("Energy", "float")],
+          "SipmPosition": [("X", "float"), ("Y", "float")]}
+
+
+def create_table(cursor, name):
+    """
+    Create an empty table with the layout of the real database.
+    """
+    columns = [(col, type_ + " NOT NULL") for col, type_ in TABLES[name]]
+    if name != "DetectorGeo":
+        keys = [] if name == "SipmNoiseBins" else [("SensorID",
+                                                    "integer NOT NULL")]
+        columns = ([("MinRun", "integer NOT NULL"),
+                    ("MaxRun", "integer DEFAULT NULL")] + keys + columns)
+    cursor.execute("CREATE TABLE `{}` ({});".format(name, ", ".join(
+                   "`{}` {}".format(col, type_) for col, type_ in columns)))
+
+
+def insert(cursor, name, rows, run_range=True):
+    """
+    Insert rows (sequences of values, without the run range) in a table.
+    """
+    rows = [list(row) for row in rows]
+    if run_range:
+        rows = [[MINRUN, None] + row for row in rows]
+    marks = ", ".join("?" * len(rows[0]))
+    cursor.executemany("INSERT INTO `{}` VALUES ({});".format(name, marks),
+                       rows)
+
+
+def pmt_positions():
+    """
+    Positions of the energy plane PMTs: inner ring of 3 and outer ring of 9.
+    """
+    inner = np.radians(90. + 120. * np.arange(3))
+    outer = np.radians(90. + 40. * np.arange(9))
+    phi = np.concatenate((inner, outer))
+    r = np.concatenate((np.full(3, 55.), np.full(9, 165.)))
+    return r * np.cos(phi), r * np.sin(phi)
+
+
+def sipm_positions(pitch=10.):
+    """
+    Positions of the tracking plane SiPMs: the NSIPM points of a square grid
+    closest to the axis, sorted by board-like (y, x) order.
+    """
+    grid = (np.arange(48) - 23.5) * pitch
+    x, y = [c.flatten() for c in np.meshgrid(grid, grid)]
+    closest = np.argsort(x**2 + y**2, kind="mergesort")[:NSIPM]
+    closest.sort()
+    return x[closest], y[closest]
+
+
+def sipm_noise_pdfs(rng, bins, sigma=0.15, dark_rate=0.02):
+    """
+    Noise distributions of the SiPMs in pes: a gaussian pedestal plus a
+    small dark-count peak at 1 pes.
+    """
+    sigmas = sigma * rng.uniform(0.8, 1.2, size=(NSIPM, 1))
+    pdfs = (np.exp(-0.5 * (bins / sigmas)**2) +
+            dark_rate * np.exp(-0.5 * ((bins - 1.) / sigmas)**2))
+    return pdfs / pdfs.sum(axis=1, keepdims=True)
+
+
+def make_stub_db(icdir, seed=0):
+    """
+    Create (or overwrite) $ICDIR/Database/localdb.sqlite3 in icdir.
+
+    Parameters
+    ----------
+    icdir : string
+        Directory playing the role of $ICDIR.
+    seed : int, optional
+        Seed for the random smearing of the constants. Default is 0.
+
+    Returns
+    -------
+    dbfile : string
+        Path of the sqlite file.
+    """
+    rng = np.random.RandomState(seed)
+    dbdir = os.path.join(icdir, "Database")
+    if not os.path.isdir(dbdir):
+        os.makedirs(dbdir)
+    dbfile = os.path.join(dbdir, "localdb.sqlite3")
+    if os.path.exists(dbfile):
+        os.remove(dbfile)
+
+    conn = sqlite3.connect(dbfile)
+    cursor = conn.cursor()
+    for name in TABLES:
+        create_table(cursor, name)
+
+    insert(cursor, "DetectorGeo",
+           [(-198., 198., -198., 198., 0., 532., 198.)], run_range=False)
+
+    pmts = range(NPMT)
+    px, py = pmt_positions()
+    insert(cursor, "PmtMapping", [(i, i) for i in pmts])
+    insert(cursor, "PmtMask", [(i, 1) for i in pmts])
+    insert(cursor, "PmtPosition", [(i, "PMT{}".format(i + 1), px[i], py[i])
+                                   for i in pmts])
+    insert(cursor, "PmtBlr", [(i, c, b) for i, c, b in
+                              zip(pmts,
+                                  rng.normal(2.905e-6, 1e-8, NPMT),
+                                  rng.normal(1.632e-3, 1e-5, NPMT))])
+    insert(cursor, "PmtGain", [(i, g) for i, g in
+                               zip(pmts, rng.normal(23.1, 0.5, NPMT))])
+    insert(cursor, "PmtNoiseRms", [(i, 0.7) for i in pmts])
+    insert(cursor, "PmtSigma", [(i, 10.) for i in pmts])
+
+    sipms = range(NSIPM)
+    sx, sy = sipm_positions()
+    bins = np.linspace(-2., 10., NNOISEBINS)
+    insert(cursor, "SipmMapping", [(i, i) for i in sipms])
+    insert(cursor, "SipmMask", [(i, 1) for i in sipms])
+    insert(cursor, "SipmPosition", zip(sipms, sx, sy))
+    insert(cursor, "SipmGain", [(i, g) for i, g in
+                                zip(sipms, rng.normal(16., 0.5, NSIPM))])
+    insert(cursor, "SipmBaseline", [(i, 0.) for i in sipms])
+    insert(cursor, "SipmNoiseBins", enumerate(bins))
+    insert(cursor, "SipmNoise", [[i] + list(pdf) for i, pdf in
+                                 zip(sipms, sipm_noise_pdfs(rng, bins))])
+
+    conn.commit()
+    conn.close()
+    return dbfile
+
+
+def use_stub_db(icdir, seed=0):
+    """
+    Create the stub database in icdir and point $ICDIR to it for the rest
+    of the process (tests should set $ICDIR with monkeypatch instead).
+    """
+    dbfile = make_stub_db(icdir, seed)
+    os.environ["ICDIR"] = icdir
+    return dbfile
@@ -0,0 +1,241 @@
+"""
+Synthetic MCRD files for the benchmarks.
+
+Produces files with the layout read by DIOMIRA: /pmtrd holds the number of
+photo-electrons of each PMT in 1 ns bins (the PE trains that DIOMIRA
+convolves with the single photo-electron response of Sierpe.FEE.SPE),
+/sipmrd holds the pes of each SiPM in 1 mus bins and /MC/MCTracks stores
+the true hits.
+
+Two topologies are available:
+- "kr": point-like 41.5 keV depositions with a faint S1 and a short S2.
+- "tl": extended ~1.6 MeV tracks (Tl-208 double escape peak) with a bright
+  S1 and a long S2 carrying a blob at each end.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+import tables as tb
+
+import Core.system_of_units as units
+from Core.Nh5 import MCTrack
+import Core.tblFunctions as tbl
+import Sierpe.FEE as FE
+
+from Benchmarks.stubdb import NPMT, NSIPM, pmt_positions, sipm_positions
+
+DRIFT_VELOCITY = 1. * units.mm / units.mus
+EL_GAP_TIME = 2. * units.mus
+S1_TAU = 40. * units.ns
+RMAX = 180. * units.mm
+
+TOPOLOGIES = {"kr": {"energy": 41.5 * units.keV, "s1_pes": 10.,
+                     "s2_pes": 1e4, "sipm_pes": 500., "nhits": 1,
+                     "length": 0.},
+              "tl": {"energy": 1.593 * units.MeV, "s1_pes": 300.,
+                     "s2_pes": 4e5, "sipm_pes": 2e4, "nhits": 60,
+                     "length": 150. * units.mm}}
+
+
+def pe_train(times, nbins, bin_width):
+    """
+    Histogram photo-electron arrival times into a PE train.
+
+    Parameters
+    ----------
+    times : 1-dim np.ndarray
+        Arrival time of each photo-electron.
+    nbins : int
+        Length of the train.
+    bin_width : float
+        Time width of each bin.
+
+    Returns
+    -------
+    train : 1-dim np.ndarray
+        Number of photo-electrons in each bin.
+    """
+    bins = (times / bin_width).astype(int)
+    bins = bins[(bins >= 0) & (bins < nbins)]
+    return np.bincount(bins, minlength=nbins)
+
+
+def split_pes(rng, npe, weights):
+    """
+    Share npe photo-electrons among sensors with the given weights.
+    """
+    return rng.multinomial(npe, weights / weights.sum())
+
+
+def track_hits(rng, topology):
+    """
+    Generate the true hits of one event.
+
+    Returns
+    -------
+    hits : np.ndarray
+        (nhits, 4) array with the x, y, z position and energy of each hit.
+    """
+    pars = TOPOLOGIES[topology]
+    nhits = pars["nhits"]
+    r = RMAX * np.sqrt(rng.uniform())
+    phi = rng.uniform(0, 2 * np.pi)
+    origin = np.array([r * np.cos(phi), r * np.sin(phi), 0.])
+
+    if nhits == 1:
+        steps = np.zeros((1, 3))
+    else:
+        # multiple scattering: the direction wanders along the track
+        directions = rng.normal(size=3) + np.cumsum(
+                     rng.normal(scale=0.2, size=(nhits, 3)), axis=0)
+        directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+        steps = np.cumsum(directions * pars["length"] / nhits, axis=0)
+        steps[:, :2] = np.clip(steps[:, :2] + origin[:2], -RMAX, RMAX)
+        steps[:, :2] -= origin[:2]
+    xyz = origin + steps
+    xyz[:, 2] -= xyz[:, 2].min()
+
+    # Bragg-like blobs: the first and last tenth of the track get more energy
+    weights = np.ones(nhits)
+    nblob = max(1, nhits // 10)
+    weights[:nblob] = weights[-nblob:] = 4.
+    energy = pars["energy"] * weights / weights.sum()
+    return np.column_stack((xyz, energy))
+
+
+def simulate_event(rng, topology, pmt_window, sipm_window):
+    """
+    Generate the PMT and SiPM signals of one event.
+
+    Parameters
+    ----------
+    rng : np.random.RandomState
+        Random generator.
+    topology : string
+        One of TOPOLOGIES.
+    pmt_window : int
+        Number of 1 ns bins of the PMT waveforms.
+    sipm_window : int
+        Number of 1 mus bins of the SiPM waveforms.
+
+    Returns
+    -------
+    pmtrd : np.ndarray
+        (NPMT, pmt_window) PE trains.
+    sipmrd : np.ndarray
+        (NSIPM, sipm_window) SiPM pes.
+    hits : np.ndarray
+        (nhits, 5) array of x, y, z, energy and time of the hits.
+    """
+    pars = TOPOLOGIES[topology]
+    window = pmt_window * units.ns
+    hits = track_hits(rng, topology)
+    nhits = hits.shape[0]
+
+    # S1 in the first fifth of the window, S2 afterwards within the window
+    t_s1 = rng.uniform(0.15, 0.2) * window
+    max_z = max(0.6 * window * DRIFT_VELOCITY - hits[:, 2].max(), 0.)
+    hits[:, 2] += rng.uniform(0, max_z)
+    t_hits = t_s1 + hits[:, 2] / DRIFT_VELOCITY
+
+    px, py = pmt_positions()
+    pmt_weights = 1. / (1. + ((px - hits[0, 0])**2 + (py - hits[0, 1])**2) /
+                        (300. * units.mm)**2)
+
+    s1_pes = split_pes(rng, rng.poisson(pars["s1_pes"]), pmt_weights)
+    s2_frac = hits[:, 3] / hits[:, 3].sum()
+    s2_pes = rng.poisson(pars["s2_pes"] * s2_frac)
+
+    pmtrd = np.zeros((NPMT, pmt_window), dtype=np.int32)
+    for pmt in range(NPMT):
+        t1 = t_s1 + rng.exponential(S1_TAU, size=s1_pes[pmt])
+        # each hit contributes a box of electroluminescence light
+        nhit_pes = rng.binomial(s2_pes, pmt_weights[pmt] / pmt_weights.sum())
+        t2 = (np.repeat(t_hits, nhit_pes) +
+              rng.uniform(0, EL_GAP_TIME, size=nhit_pes.sum()))
+        pmtrd[pmt] = pe_train(np.concatenate((t1, t2)), pmt_window,
+                              1. * units.ns)
+
+    sx, sy = sipm_positions()
+    sipmrd = np.zeros((NSIPM, sipm_window), dtype=np.int32)
+    sipm_hit_pes = rng.poisson(pars["sipm_pes"] * s2_frac)
+    for (x, y, z, e), t, npes in zip(hits, t_hits, sipm_hit_pes):
+        d2 = (sx - x)**2 + (sy - y)**2
+        near = np.nonzero(d2 < (30. * units.mm)**2)[0]
+        shares = split_pes(rng, npes, np.exp(-0.5 * d2[near] /
+                                             (8. * units.mm)**2))
+        times = t + rng.uniform(0, EL_GAP_TIME, size=shares.sum())
+        bins = (times / units.mus).astype(int)
+        ok = bins < sipm_window
+        np.add.at(sipmrd, (np.repeat(near, shares)[ok], bins[ok]), 1)
+
+    return pmtrd, sipmrd, np.column_stack((hits, t_hits))
+
+
+def store_mctracks(table, evt, hits, topology):
+    """
+    Store the true hits of an event as a single MC track.
+    """
+    row = table.row
+    energy = TOPOLOGIES[topology]["energy"]
+    for i, (x, y, z, e, t) in enumerate(hits):
+        row["event_indx"] = evt
+        row["mctrk_indx"] = 0
+        row["particle_name"] = "e-"
+        row["pdg_code"] = 11
+        row["initial_vertex"] = hits[0, :3]
+        row["final_vertex"] = hits[-1, :3]
+        row["momentum"] = hits[-1, :3] - hits[0, :3]
+        row["energy"] = energy / units.MeV
+        row["nof_hits"] = len(hits)
+        row["hit_indx"] = i
+        row["hit_position"] = (x, y, z)
+        row["hit_time"] = t / units.ns
+        row["hit_energy"] = e / units.MeV
+        row.append()
+
+
+def write_mcrd(filename, nevt, topology="kr", window=100*units.mus, seed=0,
+               compression="ZLIB4"):
+    """
+    Write a synthetic MCRD file.
+
+    Parameters
+    ----------
+    filename : string
+        Output file name.
+    nevt : int
+        Number of events.
+    topology : string, optional
+        One of TOPOLOGIES. Default is "kr".
+    window : float, optional
+        Length of the event window. Default is 100 mus.
+    seed : int, optional
+        Seed of the random generator. Default is 0.
+    compression : string, optional
+        Compression preset (see tblFunctions.filters). Default is "ZLIB4".
+    """
+    rng = np.random.RandomState(seed)
+    pmt_window = int(window / units.ns)
+    # DIOMIRA decimates the PMTs to the DAQ sampling
+    pmt_window -= pmt_window % int(FE.t_sample / units.ns)
+    sipm_window = int(window / units.mus)
+
+    with tb.open_file(filename, "w",
+                      filters=tbl.filters(compression)) as h5out:
+        pmtrd = h5out.create_earray(h5out.root, "pmtrd", tb.Int32Atom(),
+                                    (0, NPMT, pmt_window), expectedrows=nevt)
+        sipmrd = h5out.create_earray(h5out.root, "sipmrd", tb.Int32Atom(),
+                                     (0, NSIPM, sipm_window),
+                                     expectedrows=nevt)
+        mcgroup = h5out.create_group(h5out.root, "MC")
+        mctracks = h5out.create_table(mcgroup, "MCTracks", MCTrack,
+                                      "MC tracks")
+        for evt in range(nevt):
+            pmt, sipm, hits = simulate_event(rng, topology,
+                                             pmt_window, sipm_window)
+            pmtrd.append(pmt[np.newaxis])
+            sipmrd.append(sipm[np.newaxis])
+            store_mctracks(mctracks, evt, hits, topology)
+        mctracks.flush()
@@ -8,11 +8,16 @@
 #       revisit interface for estimation and fitting
 #
 
+import os
 import math
+import time
+import traceback
+import multiprocessing
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize_scalar, least_squares
+from scipy.optimize import least_squares
 from scipy.signal import find_peaks_cwt
+from scipy.ndimage import uniform_filter1d, gaussian_filter1d
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 
@@ -32,7 +37,7 @@ def index_of_sensorid(sensorID):
     """
     if (sensorID < SENSORID_UNIT):
         return sensorID
-    iboard = sensorID / SENSORID_UNIT
+    iboard = sensorID // SENSORID_UNIT
     isensor = sensorID % SENSORID_UNIT
     index = (iboard-1) * NSENSORS_PER_BOARD + isensor
     return index
@@ -115,29 +120,41 @@ class CalData:
         return self.xbins[i0:i1], self.values[index, i0:i1]
 
 
-def cal_load_txtfile(cal, fname):
+def cal_load_txtfile(cal, fname, cache=True):
         """ load the calibration data from a file
         The file contains as first row the xbins (discarting the first item)
         The following rows are the contents of each SiPM.
         The first item in the row is sensorID.
+        cache: if True the data is read from fname.npy, a binary copy of the
+        file written on its first read (and again when fname is newer).
         """
-        data = np.loadtxt(fname)
+        npyname = fname + '.npy'
+        if (cache and os.path.exists(npyname) and
+                os.path.getmtime(npyname) >= os.path.getmtime(fname)):
+            data = np.load(npyname)
+        else:
+            data = np.loadtxt(fname, ndmin=2)
+            if (cache):
+                try:
+                    np.save(npyname, data)
+                except (IOError, OSError):
+                    print('could not write the cache {}'.format(npyname))
         cal.xbins = data[0, 1:]
         cal.nbins = len(cal.xbins)
-        senids = map(int, data[1:, 0])
-        cal.indexes = []
-        cal.values = np.array([[0]*cal.nbins, ]*cal.nsensors)
-        for i, senid in enumerate(senids):
-            index = index_of_sensorid(senid)
-            cal.indexes.append(index)
-            # print('sensor ID {} index {} i {}'.format(senid,index,i))
-            cal.values[index] = data[i+1, 1:]
+        senids = data[1:, 0].astype(int)
+        indexes = np.where(senids < SENSORID_UNIT, senids,
+                           (senids//SENSORID_UNIT - 1)*NSENSORS_PER_BOARD +
+                           senids % SENSORID_UNIT)
+        cal.indexes = [int(index) for index in indexes]
+        cal.values = np.zeros((cal.nsensors, cal.nbins), dtype=int)
+        cal.values[indexes] = data[1:, 1:]
         print('loaded calibration data from file {}'.format(fname))
         print('number of sensors with data {}'.format(len(cal.indexes)))
         return
 
 
 # ---- Simple estimation of the main calibration parameters
+#      They work on the (sensors, bins) matrix of values of all the sensors
 
 
 def cal_est_noise(cal, indexes=None):
@@ -147,13 +164,9 @@ def cal_est_noise(cal, indexes=None):
     xs = cal.xbins
     if (not indexes):
         indexes = cal.indexes
-
-    def noise_(index):
-        i0 = np.where(xs > 0.)[0][0]
-        xxs, yys = cal.xbins[:i0], cal.values[index, :i0]
-        return math.sqrt(np.sum(xxs*xxs*yys)/np.sum(yys))
-    nois = np.array(map(noise_, indexes))
-    return nois
+    i0 = np.where(xs > 0.)[0][0]
+    xxs, yys = xs[:i0], cal.values[indexes, :i0]
+    return np.sqrt(np.sum(xxs*xxs*yys, axis=1)/np.sum(yys, axis=1))
 
 
 def cal_est_pes(cal, indexes=None):
@@ -164,61 +177,46 @@ def cal_est_pes(cal, indexes=None):
     xs = cal.xbins
     if (not indexes):
         indexes = cal.indexes
-
-    def mu_(index):
-        # ibin1 = np.where(xs<0)[-1][0]
-        ibin0 = np.where(xs >= 0.)[0][0]
-        if (ibin0 < 0):
-            return -1
-        ys = cal.values[index]
-        n = 2*np.sum(ys[:ibin0])
-        if (abs(xs[ibin0]) < 1e-6):
-            n += ys[ibin0]
-        else:
-            n += 2*ys[ibin0]
-        p0 = (1.*n)/(1.*np.sum(ys))
-        # print(' i0 {} n {} ntot {} p0 {} '.format(ibin0,sum(ys),n,p0))
-        if (p0 > 1.):
-            return -0.1
-        return -1*math.log(p0)
-
-    mus = np.array(map(mu_, indexes))
-    return mus
+    ibin0 = np.where(xs >= 0.)[0][0]
+    ys = cal.values[indexes]
+    n = 2.*np.sum(ys[:, :ibin0], axis=1)
+    n += ys[:, ibin0] if abs(xs[ibin0]) < 1e-6 else 2.*ys[:, ibin0]
+    p0 = n/np.sum(ys, axis=1)
+    with np.errstate(divide='ignore'):
+        return np.where(p0 > 1., -0.1, -np.log(np.minimum(p0, 1.)))
 
 
 def cal_est_gain(cal, indexes=None, bounds=(12., 30.)):
     """ Estimate the gain looking for a period in the histogram.
+    The period is the lag in bounds with the largest autocorrelation of the
+    histograms, computed with FFTs for all the sensors at once, after
+    removing their slow variations (a running mean as wide as the lower
+    bound). The lag is refined with a parabola through the neighbour bins.
+    Returns 0 for the sensors without any periodicity.
     """
     xs = cal.xbins
     if (not indexes):
         indexes = cal.indexes
-
-    def fun_period(ys):
-        """ returns a function which minimum is the adcs/count
-        of a histogram with xs-array with adcs counts and ys-contnets
-        """
-        def fun(pe):
-            # set the bins to the corresponding int period
-            x0s = np.array(map(int, xs/pe+0.5))*pe
-            # first bin non zero
-            bin0 = np.where(x0s > 0)[0][0]
-            # remove the zero and negative periods, keep only the positive ones
-            x0s, x1s, y1s = x0s[bin0:], xs[bin0:], ys[bin0:]
-            # compute the chi2
-            chi2 = math.sqrt(np.sum((x0s-x1s)*(x0s-x1s)*y1s)/np.sum(y1s))
-            return chi2
-        return fun
-
-    def fit_(index):
-        if (index % 500 == 0):
-            print('fitting...')
-        fun = fun_period(cal.values[index])
-        result = minimize_scalar(fun, bounds=bounds, method='Bounded')
-        if (result.success):
-            return result.x
-        return 0.
-
-    gains = np.array(map(fit_, indexes))
+    dx = xs[1] - xs[0]
+    ys = cal.values[indexes].astype(float)
+    nbins = ys.shape[1]
+    width = max(2, int(bounds[0]/dx))
+    ys -= uniform_filter1d(ys, width, axis=1, mode='nearest')
+
+    spectra = np.fft.rfft(ys, 2*nbins, axis=1)
+    acorr = np.fft.irfft(spectra*spectra.conj(), 2*nbins, axis=1)[:, :nbins]
+    acorr /= nbins - np.arange(nbins)
+
+    lag0 = max(1, int(math.ceil(bounds[0]/dx)))
+    lag1 = min(int(bounds[1]/dx), nbins - 2)
+    lags = lag0 + np.argmax(acorr[:, lag0:lag1+1], axis=1)
+    rows = np.arange(len(lags))
+    a0, a1, a2 = acorr[rows, lags-1], acorr[rows, lags], acorr[rows, lags+1]
+    curv = a0 - 2.*a1 + a2
+    shift = np.where(curv < 0., 0.5*(a0-a2)/np.where(curv < 0., curv, 1.),
+                     0.)
+    gains = (lags + shift)*dx
+    gains[a1 <= 0.] = 0.
     return gains
 
 
@@ -228,40 +226,22 @@ def cal_est_led_signal(caldark, called, indexes=None):
     xs = called.xbins
     if (not indexes):
         indexes = called.indexes
-
-    def signal_(index):
-        ibin0 = np.where(xs > 0.)[0][0]
-        yled, ydark = called.values[index], caldark.values[index]
-        frat = 1.*np.sum(yled[:ibin0])/(1.*np.sum(ydark[:ibin0]))
-        # print(' f rat ',frat)
-        # print(' yled ',len(yled))
-        # print(' ydark ',len(ydark))
-        ydark2 = frat*ydark
-        # print(' ydark2 ',len(ydark2))
-        xsig = (yled-ydark2)
-        # print(' sig ',len(xsig))
-        return xsig
-
-    sigs = np.array(map(signal_, indexes))
-    return sigs
+    ibin0 = np.where(xs > 0.)[0][0]
+    yled, ydark = called.values[indexes], caldark.values[indexes]
+    frat = (1.*np.sum(yled[:, :ibin0], axis=1) /
+            np.sum(ydark[:, :ibin0], axis=1))
+    return yled - frat[:, np.newaxis]*ydark
 
 
 def cal_est_led_pes(caldark, called, indexes=None):
-    """  Estimate the
-
+    """  Estimate the mean number of pes of the led signal of the SiPMs
     """
-    def mu_(sig, yled):
-        fvis = (1.*sum(sig))/(1.*sum(yled))
-        if (fvis >= 1.):
-            return -1.
-        muhat = -1.*(math.log(1.-fvis))
-        return muhat
     if (not indexes):
         indexes = called.indexes
     sigs = cal_est_led_signal(caldark, called, indexes=indexes)
-    mus = map(lambda i, index: mu_(sigs[i], called.values[index]),
-              range(len(sigs)), indexes)
-    return np.array(mus)
+    fvis = np.sum(sigs, axis=1)/np.sum(called.values[indexes], axis=1)
+    with np.errstate(invalid='ignore'):
+        return np.where(fvis >= 1., -1., -np.log(1.-np.minimum(fvis, 1.)))
 
 
 # --- Polos - plotting functions
@@ -378,6 +358,28 @@ def polo_cal_fit(cal, indexes, pss, fun, xrange=None, norma=True, title=''):
 # --- Fits to estimate the calibration paramters
 
 
+def gauss_peaks_(xs, x0, pe, s0, s1, npeaks):
+    """ normalized gaussian peaks at x0+i*pe with variance s0^2+i*s1^2
+    for i in range(npeaks), evaluated in xs.
+    Returns the (npeaks, len(xs)) array of peaks, the distances of xs to the
+    peak centers and the variances (npeaks, 1).
+    """
+    ii = np.arange(npeaks)[:, np.newaxis]
+    s2 = s0*s0 + ii*s1*s1
+    dx = xs - (x0 + ii*pe)
+    gs = np.exp(-dx*dx/(2.*s2))/np.sqrt(2.*math.pi*s2)
+    return gs, dx, s2
+
+
+def gauss_peaks_derivatives_(gs, dx, s2, s0, s1):
+    """ derivatives of gauss_peaks_ with respect to x0, pe, s0 and s1
+    """
+    ii = np.arange(len(gs))[:, np.newaxis]
+    dgdx0 = gs*dx/s2
+    dgds2 = gs*(dx*dx/s2 - 1.)/(2.*s2)
+    return dgdx0, ii*dgdx0, 2.*s0*dgds2, 2.*s1*ii*dgds2
+
+
 def ffun_ngauss(ps, xs):
     """ function to fit a n-periodic gaussian peaks distribution
     ps[0] - origin (usually 0.)
@@ -386,20 +388,30 @@ def ffun_ngauss(ps, xs):
     ps[3] - noise 1st peak
     ps[4:] - number of events in each peak
     """
-    ngauss = int(len(ps)-4)
-    x0, pe, s0, s1, ns = ps[0], ps[1], ps[2], ps[3], ps[4:]
-    # print(ngauss,x0,pe,ns,ss)
-    efacto = 1./math.sqrt(2.*math.pi)
+    x0, pe, s0, s1, ns = ps[0], ps[1], ps[2], ps[3], np.asarray(ps[4:])
+    gs, _, _ = gauss_peaks_(xs, x0, pe, s0, s1, len(ns))
+    return np.dot(ns, gs)
+
+
+def jfun_ngauss(ps, xs):
+    """ jacobian of ffun_ngauss: (len(xs), len(ps)) array with the
+    derivatives of the function with respect to each parameter.
+    """
+    x0, pe, s0, s1, ns = ps[0], ps[1], ps[2], ps[3], np.asarray(ps[4:])
+    gs, dx, s2 = gauss_peaks_(xs, x0, pe, s0, s1, len(ns))
+    dgs = gauss_peaks_derivatives_(gs, dx, s2, s0, s1)
+    return np.vstack([np.dot(ns, dg) for dg in dgs] + [gs]).T
 
-    def funi_(i):
-        s2 = s0*s0 + i*s1*s1
-        yfact = efacto/math.sqrt(s2)
-        y = yfact*ns[i]*np.exp(-(xs-x0-pe*i)*(xs-x0-pe*i)/(2*s2))
-        return y
 
-    ys = map(funi_, range(ngauss))
-    y = reduce(lambda x, y: x+y, ys)
-    return y
+def poisson_weights_(mu, ngauss):
+    """ poisson probabilities of 0 to ngauss-1 for mean mu and their
+    derivatives with respect to mu
+    """
+    ifacto = np.cumprod(np.concatenate(([1.], np.arange(1., ngauss))))
+    ps = np.exp(-mu)*np.power(mu, np.arange(ngauss))/ifacto
+    dps = -ps
+    dps[1:] += ps[:-1]
+    return ps, dps
 
 
 def ffun_poissongauss(ps, xs, ngauss=7):
@@ -412,35 +424,46 @@ def ffun_poissongauss(ps, xs, ngauss=7):
     ps[5] - sigma of the first gaussian
     m is the number of peak to fit
     """
-    ifacto = np.array(map(math.factorial, range(ngauss)))
-    efacto = 1./math.sqrt(2.*math.pi)
     nn, x0, pe, mu, s0, s1 = ps
+    gs, _, _ = gauss_peaks_(xs, x0, pe, s0, s1, ngauss)
+    ws, _ = poisson_weights_(mu, ngauss)
+    return nn*np.dot(ws, gs)
 
-    def ifun_(i):
-        s2 = s0*s0 + i*s1*s1
-        xref = x0+i*pe
-        fact = (efacto/math.sqrt(s2))
-        yg = fact*np.exp(-(xs-xref)*(xs-xref)/(2.*s2))
-        yp = (math.exp(i*math.log(mu))/ifacto[i])
-        return yg*yp
 
-    iys = map(ifun_, range(ngauss))
-    ys = reduce(lambda x, y: x+y, iys)
-    ys = nn*math.exp(-mu)*ys
-    return ys
+def jfun_poissongauss(ps, xs, ngauss=7):
+    """ jacobian of ffun_poissongauss: (len(xs), 6) array with the
+    derivatives of the function with respect to each parameter.
+    """
+    nn, x0, pe, mu, s0, s1 = ps
+    gs, dx, s2 = gauss_peaks_(xs, x0, pe, s0, s1, ngauss)
+    dgdx0, dgdpe, dgds0, dgds1 = gauss_peaks_derivatives_(gs, dx, s2, s0, s1)
+    ws, dws = poisson_weights_(mu, ngauss)
+    return np.vstack((np.dot(ws, gs), nn*np.dot(ws, dgdx0),
+                      nn*np.dot(ws, dgdpe), nn*np.dot(dws, gs),
+                      nn*np.dot(ws, dgds0), nn*np.dot(ws, dgds1))).T
 
 
-def cal_fit_(ps0, xs, ys, fun, bounds=None):
+def cal_fit_(ps0, xs, ys, fun, bounds=None, jac=None):
     """ Wrapper to least_squares.
     Returns result with the addition of the chi2.
     ps0: the initial guess parameters,
     xs, ys: np arrays with the x, y data,
     fun: is a function of the ps.
+    jac: function of the ps returning the jacobian of fun (i.e.
+    jfun_poissongauss), if not given it is estimated numerically.
     """
+    weights = 1./(1.+np.sqrt(ys))
+
     def func(ps):
-        return (ys-fun(ps, xs))/(1.+np.sqrt(ys))
+        return (ys-fun(ps, xs))*weights
 
-    result = least_squares(func, ps0, bounds=bounds)
+    def jfunc(ps):
+        return -jac(ps, xs)*weights[:, np.newaxis]
+
+    if (bounds is None):
+        bounds = (-np.inf, np.inf)
+    result = least_squares(func, ps0, bounds=bounds,
+                           jac=jfunc if jac else '2-point')
     chi2 = -1.
     cov = []
     if (result.success):
@@ -452,6 +475,107 @@ def cal_fit_(ps0, xs, ys, fun, bounds=None):
     return result
 
 
+def cal_fit_sensor_(task):
+    """ fits one sensor (see cal_fit_sensors), in a worker process or not.
+    task is the tuple (position in the list of sensors, index, xs, ys, fun,
+    ps0, bounds, jac, seed). If the fit from ps0 fails and seed is not None
+    it is repeated starting from seed.
+    Returns the position, the success flag, chi2, parameters, covariance,
+    the traceback of the exception raised by the fit (None if any) and
+    whether it was repeated from the seed.
+    """
+    i, index, xs, ys, fun, ps0, bounds, jac, seed = task
+    restarted = False
+    while True:
+        try:
+            result = cal_fit_(ps0, xs, ys, fun, bounds=bounds, jac=jac)
+            error = None
+        except Exception:
+            result, error = None, traceback.format_exc()
+        if (seed is None or (result is not None and result.success)):
+            break
+        ps0, seed, restarted = seed, None, True
+    if (result is None):
+        npars = len(ps0)
+        return (i, False, -1., np.full(npars, np.nan),
+                np.full((npars, npars), np.nan), error, restarted)
+    return (i, result.success, result.chi2, result.x, result.cov, None,
+            restarted)
+
+
+def cal_print_progress(ndone, ntotal, nfailed, nrestarted, t0):
+    """ prints the number of fitted sensors and the estimated time left
+    """
+    elapsed = time.time() - t0
+    left = elapsed*(ntotal-ndone)/max(ndone, 1)
+    print('fitted {}/{} sensors ({} failed, {} restarted from the seed), '
+          '{:.1f} s elapsed, {:.1f} s left'.format(ndone, ntotal, nfailed,
+                                                   nrestarted, elapsed, left))
+
+
+def cal_fit_sensors(cal, indexes, fun, ps0, bounds=None,
+                    xrange=(-20., 120.), njobs=1, nreports=10, jac=None,
+                    pss0=None):
+    """ fits the data of cal (CalData) of each sensor with indexes in xrange
+    to the function fun with jacobian jac, starting from ps0 (see cal_fit_).
+    pss0: initial parameters of each sensor (i.e. from cal_pss0_from_panda
+    or cal_pss0_from_db), one row per index. If given, ps0 is only the seed
+    of the sensors whose fit fails from their own initial parameters.
+    Initial parameters out of bounds are moved to the closest bound.
+    njobs: number of processes sharing the sensors (None for one per cpu).
+    The results are in the order of indexes whatever njobs.
+    A fit raising an exception does not stop the others: it gets chi2 -1
+    and nan parameters and covariance, and the error is printed.
+    nreports: number of progress reports printed along the fits (0 for none).
+    Returns the lists of chi2, parameters and covariance matrices.
+    """
+    if (pss0 is None):
+        starts, seed = [ps0]*len(indexes), None
+    else:
+        starts, seed = np.array(pss0, dtype=float), ps0
+        if (len(starts) != len(indexes)):
+            raise ValueError('pss0 has {} rows for {} sensors'.format(
+                             len(starts), len(indexes)))
+        if (bounds is not None):
+            starts = np.clip(starts, bounds[0], bounds[1])
+    tasks = [(i, index) + cal.values_in_range(index, xrange) +
+             (fun, start, bounds, jac, seed)
+             for i, (index, start) in enumerate(zip(indexes, starts))]
+    ntotal = len(tasks)
+    chi2, pss, covs = [None]*ntotal, [None]*ntotal, [None]*ntotal
+    step = max(1, ntotal//nreports) if nreports else ntotal + 1
+
+    pool = None
+    if (njobs == 1):
+        results = (cal_fit_sensor_(task) for task in tasks)
+    else:
+        njobs = njobs or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(njobs)
+        chunksize = max(1, min(16, ntotal//(4*njobs)))
+        results = pool.imap(cal_fit_sensor_, tasks, chunksize)
+
+    t0 = time.time()
+    nfailed, nrestarted = 0, 0
+    try:
+        for ndone, (i, success, ichi2, ps, cov, error,
+                    restarted) in enumerate(results):
+            if (error):
+                print(' fit {} failed with\n{}'.format(indexes[i], error))
+            elif (not success):
+                print(' fit {} success {}'.format(indexes[i], success))
+            nfailed += not success
+            nrestarted += restarted
+            chi2[i], pss[i], covs[i] = ichi2, ps, cov
+            if ((ndone+1) % step == 0 or ndone+1 == ntotal):
+                cal_print_progress(ndone+1, ntotal, nfailed, nrestarted, t0)
+        if (pool):
+            pool.close()
+    finally:
+        if (pool):
+            pool.terminate()
+    return chi2, pss, covs
+
+
 # initial parameters and bounds to fit SiPMs to poisson+n-gauss
 SIPMS_PGFIT_PS0 = np.array([10000., 0., 16., 1., 2., 2.])
 SIPMS_PGFIT_BOUNDS = ((0., -10., 12., 0.0, 0.5, 0.5),
@@ -465,7 +589,8 @@ PMTS_PGFIT_BOUNDS = ((0., -10., 10., 0.0, 2., 2.),
 
 def cal_fit_poissongauss(cal, indexes=None, ngauss=5,
                          xrange=(-20., 120.),
-                         ps0=SIPMS_PGFIT_PS0, bounds=SIPMS_PGFIT_BOUNDS):
+                         ps0=SIPMS_PGFIT_PS0, bounds=SIPMS_PGFIT_BOUNDS,
+                         njobs=1, pss0=None):
     """ fit the data of cal (CalData) for the sensor with indexes
     to a poisson and n-gaussian model.
     ngauss: number of gauss that enters in the fit,
@@ -475,24 +600,19 @@ def cal_fit_poissongauss(cal, indexes=None, ngauss=5,
     mean of the poisson (p.e.'s'), noise and noise of the 1st p.e. peak.
     bounds: is a 2 item tuple with the lower and upper bounds of the
     parameters.
-    Returns a list with the chi2 of the fit (-1 if the fit fails) and
-    a list of parameters for each sensor on the indexes list.
+    njobs: number of processes doing the fits (see cal_fit_sensors).
+    pss0: initial parameters of each sensor, i.e. from a previous run with
+    cal_pss0_from_panda or from the database with cal_pss0_from_db.
+    Then ps0 is used only for the sensors whose fit fails.
+    Returns a list with the chi2 of the fit (-1 if the fit fails),
+    a list of parameters and a list of covariance matrices for each sensor
+    on the indexes list.
     """
     if (not indexes):
         indexes = cal.indexes
-    fun = ffun_poissongauss
-    chi2, pss, covs = [], [], []
-    for index in indexes:
-        xs, ys = cal.values_in_range(index, xrange)
-        if (index % 200 == 0):
-            print('fitting data...')
-        result = cal_fit_(ps0, xs, ys, fun, bounds=bounds)
-        if (not result.success):
-            print(' fit {} success {}'.format(index, result.success))
-        chi2.append(result.chi2)
-        pss.append(result.x)
-        covs.append(result.cov)
-    return chi2, pss, covs
+    return cal_fit_sensors(cal, indexes, ffun_poissongauss, ps0, bounds,
+                           xrange, njobs=njobs, jac=jfun_poissongauss,
+                           pss0=pss0)
 
 
 # initial parameters and bounds to fit SiPMs to poisson+n-gauss
@@ -504,7 +624,8 @@ SIPMS_NGFIT_BOUNDS = ([-10., 12., 0.5, 0.5]+[0.]*NGAUSS,
 
 def cal_fit_ngauss(cal, indexes=None, ngauss=5,
                    xrange=(-20., 120.),
-                   ps0=SIPMS_NGFIT_PS0, bounds=SIPMS_NGFIT_BOUNDS):
+                   ps0=SIPMS_NGFIT_PS0, bounds=SIPMS_NGFIT_BOUNDS,
+                   njobs=1, pss0=None):
     """ fit the data of cal (CalData) for the sensor with indexes.
     to a n-gaussian model.
     ngauss: number of gauss that enters in the fit,
@@ -512,26 +633,18 @@ def cal_fit_ngauss(cal, indexes=None, ngauss=5,
     ps0: np.array with the initial value of the fit.
     ps0-parameters are: pedestal, gain, noise, noise of the 1st p.e peak, and
     the number of events of the n-gaussians.
-    Returns a list with the chi2 of the fit (-1 if the fit fails) and
-    a list of parameters for each sensor on the indexes list.
+    njobs: number of processes doing the fits (see cal_fit_sensors).
+    pss0: initial parameters of each sensor, i.e. from a previous run with
+    cal_pss0_from_panda or from the database with cal_pss0_from_db.
+    Then ps0 is used only for the sensors whose fit fails.
+    Returns a list with the chi2 of the fit (-1 if the fit fails),
+    a list of parameters and a list of covariance matrices for each sensor
+    on the indexes list.
     """
-    fun = ffun_ngauss
-    chi2, pss, cov = [], [], []
-    for i, index in enumerate(indexes):
-        xs, ys = cal.values_in_range(index, xrange)
-        if (index % 400 == 0):
-            print('fitting data...')
-        result = cal_fit_(ps0, xs, ys, fun, bounds=bounds)
-        if (not result.success):
-            print(' fit {} success {}'.format(index, result.success))
-        # success.append(result.success)
-        chi2.append(result.chi2)
-        pss.append(result.x)
-        cov = result.cov
-        # print(' fit success {}'.format(result.success))
-        # print(' guess values {}'.format(ps0))
-        # print(' fit results {}'.format(pshat))
-    return chi2, pss, cov
+    if (not indexes):
+        indexes = cal.indexes
+    return cal_fit_sensors(cal, indexes, ffun_ngauss, ps0, bounds, xrange,
+                           njobs=njobs, jac=jfun_ngauss, pss0=pss0)
 
 
 def cal_fit_ngauss_panda(indexes, chi2, pss):
@@ -580,12 +693,114 @@ def cal_fit_poissongauss_panda(indexes, chi2, pss, covs):
     return dpan
 
 
+# --- Initial parameters of the fits from previous calibrations
+
+
+def cal_pss0_from_panda(pan, indexes, ps0, model='poissongauss'):
+    """ initial parameters for the fits of the sensors with indexes from the
+    panda table of a previous calibration (cal_fit_poissongauss_panda or
+    cal_fit_ngauss_panda, either for any model).
+    model: 'poissongauss' or 'ngauss', the fit to initialize. For n-gauss
+    the number of events of each peak is taken poissonian.
+    Sensors missing in the table or whose fit failed (chi2<0) get ps0.
+    Returns a (len(indexes), len(ps0)) np.array.
+    """
+    pss0 = np.tile(np.array(ps0, dtype=float), (len(indexes), 1))
+    good = pan[pan['chi2'] >= 0.]
+    rows = dict(zip(good['indexes'], range(len(good))))
+    ngauss = len(ps0) - 4
+    ifacto = np.cumprod(np.concatenate(([1.], np.arange(1., ngauss))))
+    for i, index in enumerate(indexes):
+        if (index not in rows):
+            continue
+        row = good.iloc[rows[index]]
+        if (model == 'poissongauss'):
+            pss0[i] = [row['ntot'], row['pedestal'], row['gain'], row['pes'],
+                       row['noise'], row['noisepe']]
+        else:
+            pss0[i, :4] = [row['pedestal'], row['gain'], row['noise'],
+                           row['noisepe']]
+            pss0[i, 4:] = (row['ntot'] * np.exp(-row['pes']) *
+                           np.power(row['pes'], np.arange(ngauss)) / ifacto)
+    return pss0
+
+
+def cal_pss0_from_db(indexes, ps0, igain=2, pmts=False, run_number=1e5):
+    """ initial parameters for the fits of the sensors with indexes with
+    the gains (adc_to_pes) of the database (SipmGain or PmtGain if pmts)
+    for run_number and the rest of parameters from ps0.
+    igain: position of the gain in the parameters (2 for poisson+n-gauss,
+    1 for n-gauss).
+    Returns a (len(indexes), len(ps0)) np.array.
+    """
+    import Database.loadDB as DB
+    data = DB.DataPMT(run_number) if pmts else DB.DataSiPM(run_number)
+    # PMT gains are stored negative (their pulses are negative)
+    gains = dict(zip(map(index_of_sensorid, data['SensorID']),
+                     np.abs(data['adc_to_pes'])))
+    pss0 = np.tile(np.array(ps0, dtype=float), (len(indexes), 1))
+    for i, index in enumerate(indexes):
+        if (index in gains):
+            pss0[i, igain] = gains[index]
+    return pss0
+
+
 # Estimation of the sensor calibration using peack searching
 
 # ---- Estimation using peack searching
 
-def cal_est_peaks(cal, indexes=None, xrange=(-20., 120.), nwidth=3):
-    """ Estimate the peaks positions.
+def cal_est_peaks(cal, indexes=None, xrange=(-20., 120.), nwidth=3,
+                  sigma=2., nsigmas=3.):
+    """ Estimate the peaks positions of all the sensors at once.
+    The histograms are smoothed with a gaussian of width sigma (in adcs);
+    the peaks are the local maxima where the curvature (minus the smoothed
+    second derivative) is larger than nsigmas times its poisson error.
+    returns the peak positions and rms, a list of arrays (one per sensor).
+    indexes: indexes of the sensors
+    xrange: range in x to do the estimatiion (i.e (-10. 120.))
+    nwidth: with (in bins) to compute the peak-mean and peak-rms
+    """
+    if (not indexes):
+        indexes = cal.indexes
+    if (not xrange):
+        xrange = (np.min(cal.xbins), np.max(cal.xbins))
+    i0, i1 = np_index_of_xrange(cal.xbins, xrange)
+    xs, ys = cal.xbins[i0:i1], cal.values[indexes, i0:i1].astype(float)
+    nbins = len(xs)
+    sbins = sigma/(xs[1]-xs[0])
+
+    # smoothed contents and curvature, and the error of the curvature
+    # (the sum of the squares of the kernel times the contents)
+    yss = gaussian_filter1d(ys, sbins, axis=1)
+    curv = -gaussian_filter1d(ys, sbins, axis=1, order=2)
+    impulse = np.zeros(2*int(4.*sbins+0.5)+1)
+    impulse[len(impulse)//2] = 1.
+    kernel2 = np.sum(gaussian_filter1d(impulse, sbins, order=2)**2)
+    signif = curv/np.sqrt(np.maximum(yss, 1.)*kernel2)
+
+    sel = ((yss[:, 1:-1] > yss[:, :-2]) & (yss[:, 1:-1] >= yss[:, 2:]) &
+           (signif[:, 1:-1] > nsigmas))
+    rows, pids = np.nonzero(sel)
+    pids += 1
+
+    # mean and rms of the contents in [pid-nwidth, pid+nwidth] of each peak
+    cols = pids[:, np.newaxis] + np.arange(-nwidth, nwidth+1)
+    inside = (cols >= 0) & (cols < nbins)
+    cols = np.clip(cols, 0, nbins-1)
+    ws = ys[rows[:, np.newaxis], cols]*inside
+    wsum = np.sum(ws, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xpeaks = np.sum(ws*xs[cols], axis=1)/wsum
+        dxs = xs[cols] - xpeaks[:, np.newaxis]
+        xrmss = np.sqrt(np.sum(ws*dxs*dxs, axis=1)/wsum)
+
+    splits = np.cumsum(np.bincount(rows, minlength=len(indexes)))[:-1]
+    return np.split(xpeaks, splits), np.split(xrmss, splits)
+
+
+def cal_est_peaks_cwt(cal, indexes=None, xrange=(-20., 120.), nwidth=3):
+    """ Estimate the peaks positions with a continuous wavelet transform,
+    one sensor at a time (slow, kept as reference of cal_est_peaks).
     returns the peack position and its rms.
     indexes: indexes of the sensors
     xrange: range in x to do the estimatiion (i.e (-10. 120.))
@@ -601,16 +816,12 @@ def cal_est_peaks(cal, indexes=None, xrange=(-20., 120.), nwidth=3):
     def pids_(index):
         ixs, iys = cal.values_in_range(index, xrange)
         ipids = find_peaks_cwt(iys, xwidths)
-        pids = [ipids[0], ]
+        pids = list(ipids[:1])
         for i in range(1, len(ipids)):
             if (abs(ipids[i]-pids[-1]) > nwidth):
                 pids.append(ipids[i])
         return pids
 
-    def xpeaks0_(index, pids):
-        ixs, iys = cal.values_in_range(index, xrange)
-        return ixs[pids]
-
     def xpeaks_(index, pids):
         ixs, iys = cal.values_in_range(index, xrange)
 
@@ -619,7 +830,7 @@ def cal_est_peaks(cal, indexes=None, xrange=(-20., 120.), nwidth=3):
             x = np.sum(ixs[i0: i1] * iys[i0: i1])/np.sum(iys[i0: i1])
             return x
 
-        return map(xpeak_, pids)
+        return np.array([xpeak_(pid) for pid in pids])
 
     def rmss_(index, pids, xpeaks):
         ixs, iys = cal.values_in_range(index, xrange)
@@ -630,11 +841,12 @@ def cal_est_peaks(cal, indexes=None, xrange=(-20., 120.), nwidth=3):
             xrms = math.sqrt(np.sum(df * df * iys[i0: i1])/np.sum(iys[i0: i1]))
             return xrms
 
-        return map(rms_, pids, xpeaks)
+        return np.array([rms_(pid, xpeak) for pid, xpeak in zip(pids, xpeaks)])
 
-    pinds = map(pids_, indexes)
-    xpeaks = np.array(map(xpeaks_, indexes, pinds))
-    xrmss = np.array(map(rmss_, indexes, pinds, xpeaks))
+    pinds = [pids_(index) for index in indexes]
+    xpeaks = [xpeaks_(index, pids) for index, pids in zip(indexes, pinds)]
+    xrmss = [rmss_(index, pids, xps)
+             for index, pids, xps in zip(indexes, pinds, xpeaks)]
     return xpeaks, xrmss
 
 
@@ -646,8 +858,15 @@ def cal_est_peaks_panda(cal, indexes=None, xrange=None):
     returns a panda table with the main calibration parameters.
     """
     xs = cal.xbins
+    if (not indexes):
+        indexes = cal.indexes
     xpeaks, xrmss = cal_est_peaks(cal, indexes, xrange=xrange)
 
+    def first_(xps):
+        if (len(xps) > 0):
+            return xps[0]
+        return np.nan
+
     def gain_(xps):
         if (len(xps) > 1):
             return xps[1]-xps[0]
@@ -656,18 +875,15 @@ def cal_est_peaks_panda(cal, indexes=None, xrange=None):
     def noisepe_(xps):
         if (len(xps) > 1):
             return xps[1]
-        return xps[0]
-
-    pedestal = np.array(map(lambda xp: xp[0], xpeaks))
-    gain = np.array(map(gain_, xpeaks))
-    noise = np.array(map(lambda xp: xp[0], xrmss))
-    noisepe = np.array(map(noisepe_, xrmss))
-    ntot = np.array(map(lambda ind: np.sum(cal.values[ind]), indexes))
-
-    def adcpes_(index):
-        return np.sum(xs*cal.values[index])/np.sum(cal.values[index])
-
-    adcpes = np.array(map(adcpes_, indexes))
+        return first_(xps)
+
+    pedestal = np.array([first_(xps) for xps in xpeaks])
+    gain = np.array([gain_(xps) for xps in xpeaks])
+    noise = np.array([first_(xps) for xps in xrmss])
+    noisepe = np.array([noisepe_(xps) for xps in xrmss])
+    values = cal.values[indexes]
+    ntot = np.sum(values, axis=1)
+    adcpes = np.dot(values, xs)/ntot
     pes = adcpes/gain
     noise_pe = np.sqrt(np.abs(noisepe*noisepe-noise*noise))
 
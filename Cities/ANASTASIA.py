@@ -12,13 +12,13 @@ What ANASTASIA does:
 from __future__ import print_function
 
 import sys
-from time import time
 
 import numpy as np
 import tables as tb
 
 from Core.LogConfig import logger
-from Core.Configure import configure, define_event_loop, print_configuration
+from Core.Configure import configure, print_configuration
+from Core.City import City
 
 import Core.wfmFunctions as wfm
 import Core.tblFunctions as tbl
@@ -42,35 +42,36 @@ ChangeLog:
 10.11 Waveforms stay in adc counts. All PMTs are now stored.
 
 16.11 Using new database utility
+
+Driven by Core.City: per-event stages, batched I/O, optional NJOBS workers.
 """
 
 
-def ANASTASIA(argv=sys.argv):
+class Anastasia(City):
     """
-    ANASTASIA driver
+    Zero suppression of the PMT and SiPM waveforms.
     """
-    CFP = configure(argv)
-
-    if CFP["INFO"]:
-        print(__doc__)
+    name = "ANASTASIA"
+    in_place = True
+    input_nodes = {"pmtcwf": "/RD/pmtcwf",
+                   "pmtblr": "/RD/pmtblr",
+                   "sipmrwf": "/RD/sipmrwf"}
+    output_arrays = {"pmtzs": "/ZS/PMT",
+                     "blrzs": "/ZS/BLR",
+                     "sipmzs": "/ZS/SiPM"}
+    stages = ("pmt_zs", "blr_zs", "sipm_zs")
+
+    def prepare(self, h5in):
+        CFP = self.CFP
+        # Increate thresholds by 1% for safety
+        self.pmt_noise_cut_raw = CFP["PMT_NOISE_CUT_RAW"] * 1.01
+        self.pmt_noise_cut_blr = CFP["PMT_NOISE_CUT_BLR"] * 1.01
 
-    # Increate thresholds by 1% for safety
-    PMT_NOISE_CUT_RAW = CFP["PMT_NOISE_CUT_RAW"] * 1.01
-    PMT_NOISE_CUT_BLR = CFP["PMT_NOISE_CUT_BLR"] * 1.01
-    SIPM_ZS_METHOD = CFP["SIPM_ZS_METHOD"]
-    SIPM_NOISE_CUT = CFP["SIPM_NOISE_CUT"]
-    COMPRESSION = CFP["COMPRESSION"]
-
-    with tb.open_file(CFP["FILE_IN"], "r+",
-                      filters=tbl.filters(CFP["COMPRESSION"])) as h5in:
-        pmtblr = h5in.root.RD.pmtblr
-        pmtcwf = h5in.root.RD.pmtcwf
-        sipmrwf = h5in.root.RD.sipmrwf
         pmtdf = DB.DataPMT()
         sipmdf = DB.DataSiPM()
 
-        NEVT, NPMT, PMTWL = pmtcwf.shape
-        NEVT, NSIPM, SIPMWL = sipmrwf.shape
+        NEVT, NPMT, PMTWL = h5in.root.RD.pmtcwf.shape
+        NEVT, NSIPM, SIPMWL = h5in.root.RD.sipmrwf.shape
 
         print_configuration({"# PMT": NPMT, "PMT WL": PMTWL,
                              "# SiPM": NSIPM, "SIPM WL": SIPMWL,
@@ -79,66 +80,80 @@ def ANASTASIA(argv=sys.argv):
         # Create instance of the noise sampler and compute noise thresholds
         sipms_noise_sampler_ = SiPMsNoiseSampler(SIPMWL)
 
-        if SIPM_ZS_METHOD == "FRACTION":
-            sipms_thresholds_ = sipms_noise_sampler_.ComputeThresholds(
-                                SIPM_NOISE_CUT, sipmdf['adc_to_pes'])
+        if CFP["SIPM_ZS_METHOD"] == "FRACTION":
+            self.sipms_thresholds = sipms_noise_sampler_.ComputeThresholds(
+                                    CFP["SIPM_NOISE_CUT"],
+                                    sipmdf['adc_to_pes'].values)
         else:
-            sipms_thresholds_ = np.ones(NSIPM) * SIPM_NOISE_CUT
+            self.sipms_thresholds = np.ones(NSIPM) * CFP["SIPM_NOISE_CUT"]
+
+        self.adc_to_pes = abs(1.0/pmtdf["adc_to_pes"].values.reshape(NPMT, 1))
+        self.is_mc = "/MC" in h5in
 
-        if "/ZS" not in h5in:
-            h5in.create_group(h5in.root, "ZS")
-        if "/ZS/PMT" in h5in:
-            h5in.remove_node("/ZS", "PMT")
-        if "/ZS/BLR" in h5in:
-            h5in.remove_node("/ZS", "BLR")
-        if "/ZS/SiPM" in h5in:
-            h5in.remove_node("/ZS", "SiPM")
+    def create_output(self, h5in, h5out):
+        COMPRESSION = self.CFP["COMPRESSION"]
+        NEVT, NPMT, PMTWL = h5in.root.RD.pmtcwf.shape
+        NEVT, NSIPM, SIPMWL = h5in.root.RD.sipmrwf.shape
+
+        if "/ZS" not in h5out:
+            h5out.create_group(h5out.root, "ZS")
+        if "/ZS/PMT" in h5out:
+            h5out.remove_node("/ZS", "PMT")
+        if "/ZS/BLR" in h5out:
+            h5out.remove_node("/ZS", "BLR")
+        if "/ZS/SiPM" in h5out:
+            h5out.remove_node("/ZS", "SiPM")
 
         # Notice the Int16, not Float32! bad for compression
-        pmt_zs_ = h5in.create_earray(h5in.root.ZS, "PMT",
-                                     atom=tb.Int16Atom(),
-                                     shape=(0, NPMT, PMTWL),
-                                     expectedrows=NEVT,
-                                     filters=tbl.filters(COMPRESSION))
-
-        blr_zs_ = h5in.create_earray(h5in.root.ZS, "BLR",
-                                     atom=tb.Int16Atom(),
-                                     shape=(0, NPMT, PMTWL),
-                                     expectedrows=NEVT,
-                                     filters=tbl.filters(COMPRESSION))
-
-        sipm_zs_ = h5in.create_earray(h5in.root.ZS, "SiPM",
-                                      atom=tb.Int16Atom(),
-                                      shape=(0, NSIPM, SIPMWL),
-                                      expectedrows=NEVT,
-                                      filters=tbl.filters(COMPRESSION))
-
-        adc_to_pes = abs(1.0/pmtdf["adc_to_pes"].reshape(NPMT, 1))
-        t0 = time()
-        for i in define_event_loop(CFP, NEVT):
-            sumpmt = np.sum(pmtcwf[i] * adc_to_pes, axis=0)
-            selection = np.tile(sumpmt > PMT_NOISE_CUT_RAW, (NPMT, 1))
-            pmtzs = np.where(selection, pmtcwf[i], 0)
-
-            blr = wfm.subtract_baseline(FE.CEILING - pmtblr[i])
-            sumpmt = np.sum(blr * adc_to_pes, axis=0)
-            selection = np.tile(sumpmt > PMT_NOISE_CUT_BLR, (NPMT, 1))
-            blrzs = np.where(selection, blr, 0)
-
-            pmt_zs_.append(pmtzs[np.newaxis])
-            blr_zs_.append(blrzs[np.newaxis])
-
-            sipmzs = sipmrwf[i]
-            if "/MC" not in h5in:
-                sipmzs = wfm.subtract_baseline(sipmzs, 200)
-            sipmzs = wfm.noise_suppression(sipmzs, sipms_thresholds_)
-            sipm_zs_.append(sipmzs[np.newaxis])
-
-        t1 = time()
-        dt = t1-t0
-
-        print("ANASTASIA has run over {} events in {} seconds".format(i+1, dt))
-    print("Leaving ANASTASIA. Safe travels!")
+        h5out.create_earray(h5out.root.ZS, "PMT",
+                            atom=tb.Int16Atom(),
+                            shape=(0, NPMT, PMTWL),
+                            expectedrows=NEVT,
+                            filters=tbl.filters(COMPRESSION))
+
+        h5out.create_earray(h5out.root.ZS, "BLR",
+                            atom=tb.Int16Atom(),
+                            shape=(0, NPMT, PMTWL),
+                            expectedrows=NEVT,
+                            filters=tbl.filters(COMPRESSION))
+
+        h5out.create_earray(h5out.root.ZS, "SiPM",
+                            atom=tb.Int16Atom(),
+                            shape=(0, NSIPM, SIPMWL),
+                            expectedrows=NEVT,
+                            filters=tbl.filters(COMPRESSION))
+
+    def pmt_zs(self, evt, event):
+        pmtcwf = event["pmtcwf"]
+        sumpmt = np.sum(pmtcwf * self.adc_to_pes, axis=0)
+        selection = np.tile(sumpmt > self.pmt_noise_cut_raw,
+                            (pmtcwf.shape[0], 1))
+        event["pmtzs"] = np.where(selection, pmtcwf, 0)
+
+    def blr_zs(self, evt, event):
+        blr = wfm.subtract_baseline(FE.CEILING - event["pmtblr"])
+        sumpmt = np.sum(blr * self.adc_to_pes, axis=0)
+        selection = np.tile(sumpmt > self.pmt_noise_cut_blr,
+                            (blr.shape[0], 1))
+        event["blrzs"] = np.where(selection, blr, 0)
+
+    def sipm_zs(self, evt, event):
+        sipmzs = event["sipmrwf"]
+        if not self.is_mc:
+            sipmzs = wfm.subtract_baseline(sipmzs, 200)
+        event["sipmzs"] = wfm.noise_suppression(sipmzs, self.sipms_thresholds)
+
+
+def ANASTASIA(argv=sys.argv):
+    """
+    ANASTASIA driver
+    """
+    CFP = configure(argv)
+
+    if CFP["INFO"]:
+        print(__doc__)
+
+    Anastasia(CFP).run()
 
 
 if __name__ == "__main__":
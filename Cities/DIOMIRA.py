@@ -17,16 +17,16 @@ as metadata
 from __future__ import print_function
 import sys
 import numpy as np
-import tables
-from time import time
 
 import Core.system_of_units as units
 from Core.LogConfig import logger
-from Core.Configure import configure, define_event_loop, print_configuration
+from Core.Configure import configure, print_configuration
 from Core.Nh5 import FEE, SENSOR_WF
+from Core.City import City
 import Core.wfmFunctions as wfm
 import Core.coreFunctions as cf
 import Core.tblFunctions as tbl
+import Core.mcFunctions as mcf
 from Core.RandomSampling import NoiseSampler as SiPMsNoiseSampler
 
 import Sierpe.FEE as FE
@@ -81,24 +81,27 @@ from FEE table. PRE-RELEASE
 15.11, new version of FEE for PMTs
 
 16.11: Using new database utility
+
+Input can be a chain of MCRD files (FILE_IN may be a glob pattern or a list)
+
+Driven by Core.City: per-event stages, batched I/O, optional NJOBS workers.
 """
 
 
-def simulate_sipm_response(event_number, sipmrd_, sipms_noise_sampler):
+def simulate_sipm_response(sipmrd, sipms_noise_sampler):
     """
     Add noise with the NoiseSampler class and return the noisy waveform.
     """
-    return sipmrd_[event_number] + sipms_noise_sampler.Sample()
+    return sipmrd + sipms_noise_sampler.Sample()
 
 
-def simulate_pmt_response(event, pmtrd):
+def simulate_pmt_response(pmtrd):
     """
     Input:
-     1) extensible array pmtrd
-     2) event_number
+     1) MCRD waveforms of the PMTs for one event
 
     returns:
-    array of raw waveforms (RWF), obtained by convoluting pmtrd_ with the PMT
+    array of raw waveforms (RWF), obtained by convoluting pmtrd with the PMT
     front end electronics (LPF, HPF)
     array of BLR waveforms (only decimation)
     """
@@ -106,7 +109,7 @@ def simulate_pmt_response(event, pmtrd):
     spe = FE.SPE()  # spe
     # FEE, with noise PMT
     fee = FE.FEE(noise_FEEPMB_rms=FE.NOISE_I, noise_DAQ_rms=FE.NOISE_DAQ)
-    NPMT = pmtrd.shape[1]
+    NPMT = pmtrd.shape[0]
     RWF = []
     BLRX = []
     DataPMT = DB.DataPMT()
@@ -114,7 +117,7 @@ def simulate_pmt_response(event, pmtrd):
     for pmt in range(NPMT):
         # signal_i in current units
         cc = adc_to_pes[pmt] / FE.ADC_TO_PES
-        signal_i = FE.spe_pulse_from_vector(spe, pmtrd[event, pmt])
+        signal_i = FE.spe_pulse_from_vector(spe, pmtrd[pmt])
         # Decimate (DAQ decimation)
         signal_d = FE.daq_decimator(FE.f_mc, FE.f_sample, signal_i)
         # Effect of FEE and transform to adc counts
@@ -130,6 +133,122 @@ def simulate_pmt_response(event, pmtrd):
     return np.array(RWF), np.array(BLRX)
 
 
+class Diomira(City):
+    """
+    Simulation of the response of the energy and tracking planes.
+    """
+    name = "DIOMIRA"
+    input_nodes = {"pmtrd": "/pmtrd", "sipmrd": "/sipmrd"}
+    output_arrays = {"pmtrwf": "/RD/pmtrwf",
+                     "pmtblr": "/RD/pmtblr",
+                     "sipmrwf": "/RD/sipmrwf"}
+    stages = ("true_waveforms", "simulate_pmts", "simulate_sipms")
+
+    def prepare(self, h5in):
+        NEVENTS_DST, NPMT, PMTWL = h5in.root.pmtrd.shape
+        PMTWL_FEE = int(PMTWL/FE.t_sample)
+        NEVENTS_DST, NSIPM, SIPMWL = h5in.root.sipmrd.shape
+
+        print_configuration({"# PMT": NPMT, "PMT WL": PMTWL,
+                             "PMT WL (FEE)": PMTWL_FEE,
+                             "# SiPM": NSIPM, "SIPM WL": SIPMWL,
+                             "# events in DST": NEVENTS_DST})
+
+        self.sipmdf = DB.DataSiPM()
+
+        # Create instance of the noise sampler
+        self.noise_sampler = SiPMsNoiseSampler(SIPMWL, True)
+        self.sipms_thresholds = (self.CFP["NOISE_CUT"] *
+                                 np.array(self.sipmdf["adc_to_pes"]))
+
+    def create_output(self, h5in, h5out):
+        COMPRESSION = self.CFP["COMPRESSION"]
+        NEVENTS_DST, NPMT, PMTWL = h5in.root.pmtrd.shape
+        PMTWL_FEE = int(PMTWL/FE.t_sample)
+        NEVENTS_DST, NSIPM, SIPMWL = h5in.root.sipmrd.shape
+
+        # create a group to store MC data (the mctrk table of the events
+        # processed is copied at the end, see finalize)
+        mcgroup = h5out.create_group(h5out.root, "MC")
+
+        # create a table to store Energy plane FEE, hang it from MC group
+        fee_table = h5out.create_table(mcgroup, "FEE", FEE,
+                                       "EP-FEE parameters",
+                                       tbl.filters("NOCOMPR"))
+
+        # create a group to store True waveform data
+        twfgroup = h5out.create_group(h5out.root, "TWF")
+        # create a table to store true waveform (zs, rebinned)
+        pmt_twf_table = h5out.create_table(twfgroup, "PMT", SENSOR_WF,
+                                           "Store for PMTs TWF",
+                                           tbl.filters(COMPRESSION))
+
+        sipm_twf_table = h5out.create_table(twfgroup, "SiPM", SENSOR_WF,
+                                            "Store for SiPM TWF",
+                                            tbl.filters(COMPRESSION))
+
+        # and index in event column
+        pmt_twf_table.cols.event.create_index()
+        sipm_twf_table.cols.event.create_index()
+
+        # fill FEE table
+        tbl.store_FEE_table(fee_table)
+
+        # create a group to store RawData
+        h5out.create_group(h5out.root, "RD")
+
+        # create an extensible array to store the RWF waveforms
+        ENCODING = self.CFP.get("RWF_ENCODING")
+        tbl.create_wf_array(h5out.root.RD, "pmtrwf", (NPMT, PMTWL_FEE),
+                            NEVENTS_DST, tbl.filters(COMPRESSION), ENCODING)
+
+        tbl.create_wf_array(h5out.root.RD, "pmtblr", (NPMT, PMTWL_FEE),
+                            NEVENTS_DST, tbl.filters(COMPRESSION), ENCODING)
+
+        tbl.create_wf_array(h5out.root.RD, "sipmrwf", (NSIPM, SIPMWL),
+                            NEVENTS_DST, tbl.filters(COMPRESSION), ENCODING)
+
+    def true_waveforms(self, evt, event):
+        # supress zeros in MCRD and rebin the ZS function in 1 mus bins
+        rebin = int(units.mus/units.ns)
+
+        event["trueSiPM"] = wfm.zero_suppression(event["sipmrd"], 0.)
+
+        # dict_map applies a function to the dictionary values
+        event["truePMT"] = cf.dict_map(lambda df: wfm.rebin_df(df, rebin),
+                                       wfm.zero_suppression(event["pmtrd"],
+                                       0., to_mus=int(units.ns/units.ms)))
+
+    def simulate_pmts(self, evt, event):
+        # simulate PMT response and return an array with RWF;BLR
+        dataPMT, blrPMT = simulate_pmt_response(event["pmtrd"])
+        event["pmtrwf"] = dataPMT.astype(int)
+        event["pmtblr"] = blrPMT.astype(int)
+
+    def simulate_sipms(self, evt, event):
+        # simulate SiPM response and return an array with RWF
+        # convert to adc, zero suppress
+        dataSiPM = simulate_sipm_response(event["sipmrd"], self.noise_sampler)
+        dataSiPM = wfm.to_adc(dataSiPM, self.sipmdf)
+        dataSiPM = wfm.noise_suppression(dataSiPM, self.sipms_thresholds)
+        event["sipmrwf"] = dataSiPM.astype(int)
+
+    def write(self, h5out, evt, event):
+        # store in table
+        tbl.store_wf_table(evt, h5out.root.TWF.PMT, event["truePMT"], False)
+        tbl.store_wf_table(evt, h5out.root.TWF.SiPM, event["trueSiPM"], False)
+
+    def finalize(self, h5in, h5out, start, stop):
+        h5out.root.TWF.PMT.flush()
+        h5out.root.TWF.SiPM.flush()
+        # copy the mctrk table of the events in [start, stop), read once
+        if "/MC/MCTracks" in h5out:
+            h5out.remove_node("/MC", "MCTracks")
+        mctruth = mcf.MCTruth(h5in.root.MC.MCTracks)
+        mctruth.copy(h5out.root.MC, events=np.arange(start, stop))
+        tbl.build_catalog(h5out, np.arange(start, stop))
+
+
 def DIOMIRA(argv=sys.argv):
     """
     Diomira driver
@@ -149,124 +268,7 @@ def DIOMIRA(argv=sys.argv):
         5. Copies the tables on geometry, detector data and MC
         """)
 
-    # open the input file
-    with tables.open_file(CFP["FILE_IN"], "r") as h5in:
-        # access the PMT raw data in file
-        pmtrd_ = h5in.root.pmtrd
-        sipmrd_ = h5in.root.sipmrd
-
-        NEVENTS_DST, NPMT, PMTWL = pmtrd_.shape
-        PMTWL_FEE = int(PMTWL/FE.t_sample)
-        NEVENTS_DST, NSIPM, SIPMWL = sipmrd_.shape
-
-        print_configuration({"# PMT": NPMT, "PMT WL": PMTWL,
-                             "PMT WL (FEE)": PMTWL_FEE,
-                             "# SiPM": NSIPM, "SIPM WL": SIPMWL,
-                             "# events in DST": NEVENTS_DST})
-
-        # access the geometry and the sensors metadata info
-        mctrk_t = h5in.root.MC.MCTracks
-        sipmdf = DB.DataSiPM()
-
-        # Create instance of the noise sampler
-        noise_sampler_ = SiPMsNoiseSampler(SIPMWL, True)
-        sipms_thresholds_ = CFP["NOISE_CUT"] * np.array(sipmdf["adc_to_pes"])
-
-        COMPRESSION = CFP["COMPRESSION"]
-        # open the output file
-        with tables.open_file(CFP["FILE_OUT"], "w",
-                              filters=tbl.filters(COMPRESSION)) as h5out:
-
-            # create a group to store MC data
-            mcgroup = h5out.create_group(h5out.root, "MC")
-            # copy the mctrk table
-            mctrk_t.copy(newparent=mcgroup)
-
-            # create a table to store Energy plane FEE, hang it from MC group
-            fee_table = h5out.create_table(mcgroup, "FEE", FEE,
-                                           "EP-FEE parameters",
-                                           tbl.filters("NOCOMPR"))
-
-            # create a group to store True waveform data
-            twfgroup = h5out.create_group(h5out.root, "TWF")
-            # create a table to store true waveform (zs, rebinned)
-            pmt_twf_table = h5out.create_table(twfgroup, "PMT", SENSOR_WF,
-                                               "Store for PMTs TWF",
-                                               tbl.filters(COMPRESSION))
-
-            sipm_twf_table = h5out.create_table(twfgroup, "SiPM", SENSOR_WF,
-                                                "Store for SiPM TWF",
-                                                tbl.filters(COMPRESSION))
-
-            # and index in event column
-            pmt_twf_table.cols.event.create_index()
-            sipm_twf_table.cols.event.create_index()
-
-            # fill FEE table
-            tbl.store_FEE_table(fee_table)
-
-            # create a group to store RawData
-            h5out.create_group(h5out.root, "RD")
-
-            # create an extensible array to store the RWF waveforms
-            pmtrwf = h5out.create_earray(h5out.root.RD, "pmtrwf",
-                                         atom=tables.Int16Atom(),
-                                         shape=(0, NPMT, PMTWL_FEE),
-                                         expectedrows=NEVENTS_DST,
-                                         filters=tbl.filters(COMPRESSION))
-
-            pmtblr = h5out.create_earray(h5out.root.RD, "pmtblr",
-                                         atom=tables.Int16Atom(),
-                                         shape=(0, NPMT, PMTWL_FEE),
-                                         expectedrows=NEVENTS_DST,
-                                         filters=tbl.filters(COMPRESSION))
-
-            sipmrwf = h5out.create_earray(h5out.root.RD, "sipmrwf",
-                                          atom=tables.Int16Atom(),
-                                          shape=(0, NSIPM, SIPMWL),
-                                          expectedrows=NEVENTS_DST,
-                                          filters=tbl.filters(COMPRESSION))
-            # LOOP
-            t0 = time()
-            for i in define_event_loop(CFP, NEVENTS_DST):
-                # supress zeros in MCRD and rebin the ZS function in 1 mus bins
-                rebin = int(units.mus/units.ns)
-
-                trueSiPM = wfm.zero_suppression(sipmrd_[i], 0.)
-
-                # dict_map applies a function to the dictionary values
-                truePMT = cf.dict_map(lambda df: wfm.rebin_df(df, rebin),
-                                      wfm.zero_suppression(pmtrd_[i],
-                                      0., to_mus=int(units.ns/units.ms)))
-
-                # store in table
-                tbl.store_wf_table(i, pmt_twf_table, truePMT)
-                tbl.store_wf_table(i, sipm_twf_table, trueSiPM)
-
-                # simulate PMT response and return an array with RWF;BLR
-                # convert to float, append to EVector
-
-                dataPMT, blrPMT = simulate_pmt_response(i, pmtrd_)
-                pmtrwf.append(dataPMT.astype(int).reshape(1, NPMT, PMTWL_FEE))
-                pmtblr.append(blrPMT.astype(int).reshape(1, NPMT, PMTWL_FEE))
-
-                # simulate SiPM response and return an array with RWF
-                # convert to float, zero suppress and dump to table
-                dataSiPM = simulate_sipm_response(i, sipmrd_, noise_sampler_)
-                dataSiPM = wfm.to_adc(dataSiPM, sipmdf)
-                dataSiPM = wfm.noise_suppression(dataSiPM, sipms_thresholds_)
-
-                sipmrwf.append(dataSiPM.astype(int).reshape(1, NSIPM, SIPMWL))
-
-            pmtrwf.flush()
-            sipmrwf.flush()
-            pmtblr.flush()
-
-            t1 = time()
-            dt = t1 - t0
-            print("DIOMIRA has run over {} events in {} seconds".format(i+1,
-                                                                        dt))
-    print("Leaving Diomira. Safe travels!")
+    Diomira(CFP).run()
 
 
 if __name__ == "__main__":
@@ -4,28 +4,30 @@ JJGC August-October 2016
 GML October 2016
 
 What DOROTHEA does:
-1) Reads a hdf5 file containing ZS waveform for all PMTs and SiPMs in adc.
+1) Reads a hdf5 file (or a chain of files) containing ZS waveform for all
+PMTs and SiPMs in adc.
 2) Converts waveforms to pes and creates a summed PMT.
 2) Finds the peaks in the summed waveform and links them with those found in
 the SiPMs in the same time window.
 3) Rebins the PMT waveforms to 1 mus.
 4) Writes pmaps into a new file.
+5) Optionally, writes a per-event summary (DST) of the pmaps.
 """
 
 from __future__ import print_function
 import sys
 import math
 import numpy as np
-import tables as tb
-from time import time
 
 import Core.system_of_units as units
 from Core.LogConfig import logger
-from Core.Configure import configure, define_event_loop, print_configuration
+from Core.Configure import configure, print_configuration
 from Core.Bridges import Signal, Peak, PMap
-from Core.Nh5 import PMAP
+from Core.City import City
+from Core.Nh5 import PMAP, PMAP_DST
 
 import Core.tblFunctions as tbl
+import Core.snsFunctions as sns
 import Database.loadDB as DB
 
 
@@ -39,6 +41,12 @@ ChangeLog:
 10.11 Conversion to pes and creation of the summed PMT.
 
 16.11 Using new database utility.
+
+Optional per-event summary table (WRITE_DST).
+
+Input can be a chain of files (FILE_IN may be a glob pattern or a list).
+
+Driven by Core.City: per-event stages, batched I/O, optional NJOBS workers.
 """
 
 
@@ -127,91 +135,159 @@ def build_pmap(pmtwf, sipmwfs, stride=40):
     return pmap
 
 
-def DOROTHEA(argv=sys.argv):
+def pmap_summary(pmap, sipmdf):
     """
-    DOROTHEA driver
+    Compute the per-event quantities of a pmap.
+
+    Parameters
+    ----------
+    pmap : Bridges.PMap
+        Classified pmap of the event.
+    sipmdf : pd.DataFrame
+        Contains the sensors' information.
+
+    Returns
+    -------
+    dst : dictionary
+        Number of S1 and S2 and the integral, width, height and peak time of
+        the largest S1 and S2. Also the S2 anode integral, the drift time
+        and the S2 baricenter. Missing quantities are set to -1.
     """
-    CFP = configure(argv)
-
-    if CFP["INFO"]:
-        print(__doc__)
-
-    COMPRESSION = CFP["COMPRESSION"]
-
-    # open the input file
-    with tb.open_file(CFP["FILE_IN"], "r") as h5in:
-        # access the PMT ZS data in file
-        pmtzs_ = h5in.root.ZS.PMT
-        blrzs_ = h5in.root.ZS.BLR
-        sipmzs_ = h5in.root.ZS.SiPM
+    dst = {"nS1": 0, "nS2": 0, "DT": -1., "X": 1e4, "Y": 1e4}
+    mains = {}
+    for signal in (Signal.S1, Signal.S2):
+        peaks = list(pmap.get(signal))
+        dst["n" + signal] = len(peaks)
+        for key in ("e", "w", "h", "t"):
+            dst[signal + key] = -1.
+        if not peaks:
+            continue
+        peak = max(peaks, key=lambda p: p.cathode_integral)
+        mains[signal] = peak
+        dst[signal + "e"] = peak.cathode_integral
+        dst[signal + "w"] = peak.width
+        dst[signal + "t"] = peak.peakmax[0]
+        dst[signal + "h"] = peak.peakmax[1]
+
+    dst["S2q"] = -1.
+    if Signal.S2 in mains:
+        s2 = mains[Signal.S2]
+        dst["S2q"] = s2.anode_integral
+        dst["X"], dst["Y"] = sns.baricenter(np.nansum(s2.anode, axis=0),
+                                            sipmdf)
+        if Signal.S1 in mains:
+            dst["DT"] = dst["S2t"] - dst["S1t"]
+    return dst
+
+
+class Dorothea(City):
+    """
+    Construction of the pmaps from the zero-suppressed waveforms.
+    """
+    name = "DOROTHEA"
+    input_nodes = {"pmtzs": "/ZS/PMT",
+                   "blrzs": "/ZS/BLR",
+                   "sipmzs": "/ZS/SiPM"}
+    batch_stages = ("calibrate",)
+    stages = ("pmaps", "summary")
 
-        NEVT, NPMT, PMTWL = pmtzs_.shape
-        NEVT, NSIPM, SIPMWL = sipmzs_.shape
+    def prepare(self, h5in):
+        NEVT, NPMT, PMTWL = h5in.root.ZS.PMT.shape
+        NEVT, NSIPM, SIPMWL = h5in.root.ZS.SiPM.shape
 
         print_configuration({"# PMT": NPMT, "PMT WL": PMTWL,
                              "# SiPM": NSIPM, "SIPM WL": SIPMWL,
                              "# events in DST": NEVT})
 
         pmtdf = DB.DataPMT()
-        sipmdf = DB.DataSiPM()
+        self.sipmdf = DB.DataSiPM()
+
+        self.pmt_to_pes = abs(1.0 / pmtdf.adc_to_pes.values.reshape(NPMT, 1))
+        self.sipm_to_pes = abs(1.0 /
+                               self.sipmdf.adc_to_pes.values.reshape(NSIPM, 1))
+        self.write_dst = self.CFP.get("WRITE_DST", False)
 
-        pmt_to_pes = abs(1.0 / pmtdf.adc_to_pes.reshape(NPMT, 1))
-        sipm_to_pes = abs(1.0 / sipmdf.adc_to_pes.reshape(NSIPM, 1))
+    def create_output(self, h5in, h5out):
+        COMPRESSION = self.CFP["COMPRESSION"]
 
-        # open the output file
-        with tb.open_file(CFP["FILE_OUT"], "w",
-                          filters=tbl.filters(COMPRESSION)) as h5out:
+        # create groups and copy MC data to the new file
+        if "/MC" in h5in:
+            mcgroup = h5out.create_group(h5out.root, "MC")
+            twfgroup = h5out.create_group(h5out.root, "TWF")
 
-            # create groups and copy MC data to the new file
-            if "/MC" in h5in:
-                mcgroup = h5out.create_group(h5out.root, "MC")
-                twfgroup = h5out.create_group(h5out.root, "TWF")
+            h5in.root.MC.MCTracks.copy(newparent=mcgroup)
+            h5in.root.MC.FEE.copy(newparent=mcgroup)
+            h5in.root.TWF.PMT.copy(newparent=twfgroup)
+            h5in.root.TWF.SiPM.copy(newparent=twfgroup)
 
-                h5in.root.MC.MCTracks.copy(newparent=mcgroup)
-                h5in.root.MC.FEE.copy(newparent=mcgroup)
-                h5in.root.TWF.PMT.copy(newparent=twfgroup)
-                h5in.root.TWF.SiPM.copy(newparent=twfgroup)
+        if "/Run" in h5in:
+            rungroup = h5out.create_group(h5out.root, "Run")
+            h5in.root.Run.runInfo.copy(newparent=rungroup)
+            h5in.root.Run.events.copy(newparent=rungroup)
 
-            if "/Run" in h5in:
-                rungroup = h5out.create_group(h5out.root, "Run")
-                h5in.root.Run.runInfo.copy(newparent=rungroup)
-                h5in.root.Run.events.copy(newparent=rungroup)
+        pmapsgroup = h5out.create_group(h5out.root, "PMAPS")
 
-            pmapsgroup = h5out.create_group(h5out.root, "PMAPS")
+        # create a table to store pmaps (rebined, linked, zs wfs)
+        pmaps_ = h5out.create_table(pmapsgroup, "PMaps", PMAP,
+                                    "Store for PMaps",
+                                    tbl.filters(COMPRESSION))
 
-            # create a table to store pmaps (rebined, linked, zs wfs)
-            pmaps_ = h5out.create_table(pmapsgroup, "PMaps", PMAP,
-                                        "Store for PMaps",
+        pmaps_blr_ = h5out.create_table(pmapsgroup, "PMapsBLR", PMAP,
+                                        "Store for PMaps made with BLR",
                                         tbl.filters(COMPRESSION))
 
-            pmaps_blr_ = h5out.create_table(pmapsgroup, "PMapsBLR", PMAP,
-                                            "Store for PMaps made with BLR",
-                                            tbl.filters(COMPRESSION))
-
-            # add index in event column
-            pmaps_.cols.event.create_index()
-            pmaps_blr_.cols.event.create_index()
-
-            # LOOP
-            t0 = time()
-            for i in define_event_loop(CFP, NEVT):
-                pmtwf = np.sum(pmtzs_[i] * pmt_to_pes, axis=0)
-                blrwf = np.sum(blrzs_[i] * pmt_to_pes, axis=0)
-                sipmwfs = sipmzs_[i] * sipm_to_pes
-
-                pmap = build_pmap(pmtwf, sipmwfs)
-                classify_peaks(pmap, **CFP)
-                tbl.store_pmap(pmap, pmaps_, i)
-
-                pmap_blr = build_pmap(blrwf, sipmwfs)
-                classify_peaks(pmap_blr, **CFP)
-                tbl.store_pmap(pmap_blr, pmaps_blr_, i)
-
-            t1 = time()
-            dt = t1 - t0
-            print("DOROTHEA has run over {} events in {} seconds".format(i+1,
-                                                                         dt))
-    print("Leaving DOROTHEA. Safe travels!")
+        # add index in event column
+        pmaps_.cols.event.create_index()
+        pmaps_blr_.cols.event.create_index()
+
+        if self.write_dst:
+            dstgroup = h5out.create_group(h5out.root, "DST")
+            dst_ = h5out.create_table(dstgroup, "Events", PMAP_DST,
+                                      "Per-event summary of the PMaps",
+                                      tbl.filters(COMPRESSION))
+            dst_.cols.event.create_index()
+
+    def calibrate(self, start, stop, batch):
+        batch["pmtwf"] = np.sum(batch["pmtzs"] * self.pmt_to_pes, axis=1)
+        batch["blrwf"] = np.sum(batch["blrzs"] * self.pmt_to_pes, axis=1)
+        batch["sipmwfs"] = batch["sipmzs"] * self.sipm_to_pes
+
+    def pmaps(self, evt, event):
+        event["pmap"] = build_pmap(event["pmtwf"], event["sipmwfs"])
+        classify_peaks(event["pmap"], **self.CFP)
+
+        event["pmap_blr"] = build_pmap(event["blrwf"], event["sipmwfs"])
+        classify_peaks(event["pmap_blr"], **self.CFP)
+
+    def summary(self, evt, event):
+        if self.write_dst:
+            event["dst"] = pmap_summary(event["pmap"], self.sipmdf)
+
+    def write(self, h5out, evt, event):
+        tbl.store_pmap(event["pmap"], h5out.root.PMAPS.PMaps, evt, False)
+        tbl.store_pmap(event["pmap_blr"], h5out.root.PMAPS.PMapsBLR, evt,
+                       False)
+        if self.write_dst:
+            tbl.store_dst(event["dst"], h5out.root.DST.Events, evt, False)
+
+    def finalize(self, h5in, h5out, start, stop):
+        h5out.root.PMAPS.PMaps.flush()
+        h5out.root.PMAPS.PMapsBLR.flush()
+        if self.write_dst:
+            h5out.root.DST.Events.flush()
+        tbl.build_catalog(h5out, np.arange(start, stop))
+
+
+def DOROTHEA(argv=sys.argv):
+    """
+    DOROTHEA driver
+    """
+    CFP = configure(argv)
+
+    if CFP["INFO"]:
+        print(__doc__)
+
+    Dorothea(CFP).run()
 
 
 if __name__ == "__main__":
@@ -12,18 +12,20 @@ Change Log:
 
 11.11 JJGC: A major refactoring of the code, now based in a much improved
 deconv algorithm
+
+Driven by Core.City: per-event stages, batched I/O, optional NJOBS workers.
 """
 
 from __future__ import print_function
 
 import sys
-from time import time
 import numpy as np
 import tables as tb
 
 from Core.LogConfig import logger
-from Core.Configure import configure, define_event_loop, print_configuration
+from Core.Configure import configure, print_configuration
 from Core.Nh5 import DECONV_PARAM
+from Core.City import City
 import Core.tblFunctions as tbl
 
 import ICython.Sierpe.cBLR as cblr
@@ -85,6 +87,68 @@ def DBLR(pmtrwf, n_baseline=500, thr_trigger=5,
     return CWF, ACUM, BSL, BSLE, BSLN
 
 
+class Isidora(City):
+    """
+    Baseline restoration of the PMT raw waveforms.
+    """
+    name = "ISIDORA"
+    in_place = True
+    input_nodes = {"pmtrwf": "/RD/pmtrwf"}
+    output_arrays = {"pmtcwf": "/RD/pmtcwf", "bl": "/Deconvolution/BL"}
+    stages = ("deconvolve",)
+
+    def prepare(self, h5in):
+        NEVENTS_DST, NPMT, PMTWL = h5in.root.RD.pmtrwf.shape
+        print_configuration({"# PMT": NPMT, "PMT WL": PMTWL,
+                             "# events in DST": NEVENTS_DST})
+
+    def create_output(self, h5in, h5out):
+        COMPRESSION = self.CFP["COMPRESSION"]
+        NEVENTS_DST, NPMT, PMTWL = h5in.root.RD.pmtrwf.shape
+
+        # create an extensible array to store the CWF waveforms
+        # if it exists remove and create again
+        if "/RD/pmtcwf" in h5out:
+            h5out.remove_node("/RD", "pmtcwf")
+
+        h5out.create_earray(h5out.root.RD, "pmtcwf",
+                            atom=tb.Int16Atom(),
+                            shape=(0, NPMT, PMTWL),
+                            expectedrows=NEVENTS_DST,
+                            filters=tbl.filters(COMPRESSION))
+
+        if "/Deconvolution" not in h5out:
+            h5out.create_group(h5out.root, "Deconvolution")
+        if "/Deconvolution/Parameters" in h5out:
+            h5out.remove_node("/Deconvolution", "Parameters")
+        if "/Deconvolution/BL" in h5out:
+            h5out.remove_node("/Deconvolution", "BL")
+
+        deconv_table = h5out.create_table(h5out.root.Deconvolution,
+                                          "Parameters",
+                                          DECONV_PARAM,
+                                          "Deconvolution parameters",
+                                          tbl.filters("NOCOMPR"))
+        tbl.store_deconv_table(deconv_table, self.CFP)
+
+        h5out.create_earray(h5out.root.Deconvolution, "BL",
+                            atom=tb.Int16Atom(),
+                            shape=(0, NPMT, 3),
+                            expectedrows=NEVENTS_DST,
+                            filters=tbl.filters(COMPRESSION))
+
+    def deconvolve(self, evt, event):
+        CFP = self.CFP
+        data = DBLR(event["pmtrwf"],
+                    n_baseline=CFP["N_BASELINE"],
+                    thr_trigger=CFP["THR_TRIGGER"],
+                    discharge_length=CFP["ACUM_DISCHARGE_LENGTH"],
+                    acum_tau=CFP["ACUM_TAU"],
+                    acum_compress=CFP["ACUM_COMPRESS"])
+        event["pmtcwf"] = data[0]
+        event["bl"] = np.array(data[2:]).T
+
+
 def ISIDORA(argv=sys.argv):
     CFP = configure(argv)
 
@@ -105,85 +169,7 @@ def ISIDORA(argv=sys.argv):
 
         """)
 
-    N_BASELINE = CFP["N_BASELINE"]
-    THR_TRIGGER = CFP["THR_TRIGGER"]
-    ACUM_DISCHARGE_LENGTH = CFP["ACUM_DISCHARGE_LENGTH"]
-    ACUM_TAU = CFP["ACUM_TAU"]
-    ACUM_COMPRESS = CFP["ACUM_COMPRESS"]
-    COMPRESSION = CFP["COMPRESSION"]
-
-    # open the input file in mode append
-    with tb.open_file(CFP["FILE_IN"], "a",
-                      filters=tbl.filters(COMPRESSION)) as h5in:
-        # access the PMT raw data in file
-        pmtrd_ = h5in.root.RD.pmtrwf  # PMT raw data must exist
-        NEVENTS_DST, NPMT, PMTWL = pmtrd_.shape
-
-        print_configuration({"# PMT": NPMT, "PMT WL": PMTWL,
-                             "# events in DST": NEVENTS_DST})
-
-        # create an extensible array to store the CWF waveforms
-        # if it exists remove and create again
-        if "/RD/pmtcwf" in h5in:
-            h5in.remove_node("/RD", "pmtcwf")
-
-        pmtcwf = h5in.create_earray(h5in.root.RD, "pmtcwf",
-                                    atom=tb.Int16Atom(),
-                                    shape=(0, NPMT, PMTWL),
-                                    expectedrows=NEVENTS_DST,
-                                    filters=tbl.filters(COMPRESSION))
-        # if "/RD/pmtacum" in h5in:
-        #     h5in.remove_node("/RD", "pmtacum")
-        #
-        # pmtacum = h5in.create_earray(h5in.root.RD, "pmtacum",
-        #                              atom=tb.Int16Atom(),
-        #                              shape=(0, NPMT, PMTWL),
-        #                              expectedrows=NEVENTS_DST)
-
-        if "/Deconvolution" not in h5in:
-            h5in.create_group(h5in.root, "Deconvolution")
-        if "/Deconvolution/Parameters" in h5in:
-            h5in.remove_node("/Deconvolution", "Parameters")
-        if "/Deconvolution/BL" in h5in:
-            h5in.remove_node("/Deconvolution", "BL")
-
-        deconv_table = h5in.create_table(h5in.root.Deconvolution,
-                                         "Parameters",
-                                         DECONV_PARAM,
-                                         "Deconvolution parameters",
-                                         tbl.filters("NOCOMPR"))
-        tbl.store_deconv_table(deconv_table, CFP)
-
-        bl_array = h5in.create_earray(h5in.root.Deconvolution, "BL",
-                                      atom=tb.Int16Atom(),
-                                      shape=(0, NPMT, 3),
-                                      expectedrows=NEVENTS_DST,
-                                      filters=tbl.filters(COMPRESSION))
-        # LOOP
-        t0 = time()
-        for i in define_event_loop(CFP, NEVENTS_DST):
-            data = DBLR(pmtrd_[i],
-                        n_baseline=N_BASELINE,
-                        thr_trigger=THR_TRIGGER,
-                        discharge_length=ACUM_DISCHARGE_LENGTH,
-                        acum_tau=ACUM_TAU,
-                        acum_compress=ACUM_COMPRESS)
-            signal_r, bl_data = data[0], data[2:]
-
-            # append to pmtcwf
-            pmtcwf.append(signal_r.reshape(1, NPMT, PMTWL))
-            bl_array.append(np.array(bl_data).T[np.newaxis])
-            # append to pmtacum
-            # pmtacum.append(acum.reshape(1, NPMT, PMTWL))
-
-        t1 = time()
-        dt = t1 - t0
-        pmtcwf.flush()
-        bl_array.flush()
-        # pmtacum.flush()
-
-        print("ISIDORA has run over {} events in {} seconds".format(i+1, dt))
-    print("Leaving ISIDORA. Safe travels!")
+    Isidora(CFP).run()
 
 
 if __name__ == "__main__":
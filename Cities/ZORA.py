@@ -0,0 +1,277 @@
+"""
+ZORA
+Monitoring of a run.
+
+What ZORA does:
+1) Reads a RWF file (written by DIOMIRA, or by the DAQ) in one pass, with
+   the CWF and BLR waveforms of the PMTs if the file has them.
+2) Computes for every event the baseline, noise RMS and number of saturated
+   samples of each PMT and, when available, the energy (pes) of each PMT
+   from the CWF and from the BLR waveform and the RMS of their difference
+   (BLR residual).
+3) Computes for every event the energy (pes) above noise and the number of
+   saturated samples (upper end of the adc range) of the SiPM plane, and accumulates for each SiPM the
+   mean baseline, noise and energy over the run (Core.Histograms profiles)
+   and its number of saturated samples.
+4) Writes all this to a small summary file (/Monitor), which the monitoring
+   notebooks read with read_summary instead of looping over the waveforms.
+
+Driven by Core.City: per-event stages, batched I/O, optional NJOBS workers,
+shards and checkpoints (the SiPM summaries are stored with every checkpoint
+and added up when the shards are merged).
+"""
+
+from __future__ import print_function
+
+import sys
+
+import numpy as np
+import tables as tb
+
+from Core.Configure import configure, print_configuration
+from Core.City import City
+import Core.Histograms as hst
+import Core.wfmFunctions as wfm
+import Core.tblFunctions as tbl
+import Database.loadDB as DB
+import Sierpe.FEE as FE
+
+
+# Per-event arrays written in /Monitor: key: (atom, one value per PMT)
+MONITOR_ARRAYS = {"event": (tb.Int64Atom(), False),
+                  "pmt_baseline": (tb.Float32Atom(), True),
+                  "pmt_noise": (tb.Float32Atom(), True),
+                  "pmt_saturated": (tb.Int32Atom(), True),
+                  "pmt_energy": (tb.Float32Atom(), True),
+                  "blr_energy": (tb.Float32Atom(), True),
+                  "blr_residual": (tb.Float32Atom(), True),
+                  "sipm_energy": (tb.Float32Atom(), False),
+                  "sipm_saturated": (tb.Int32Atom(), False)}
+
+# Per-SiPM summaries of the run, in /Monitor/SiPM
+SIPM_PROFILES = ("baseline", "noise", "energy")
+
+
+def saturated(waveforms, low=True):
+    """
+    Number of samples of each waveform at either end of the adc range, or
+    only at the upper end if low is False (zero suppressed waveforms, such
+    as the SiPMs written by DIOMIRA, are mostly 0).
+    """
+    if not low:
+        return np.count_nonzero(waveforms >= FE.CEILING - 1, axis=-1)
+    return np.count_nonzero((waveforms <= 0) | (waveforms >= FE.CEILING - 1),
+                            axis=-1)
+
+
+class Zora(City):
+    """
+    Baselines, noise, energies and saturation of the sensors over a run.
+    """
+    name = "ZORA"
+    in_place = False
+    input_nodes = {"pmtrwf": "/RD/pmtrwf", "sipmrwf": "/RD/sipmrwf"}
+    output_arrays = {}
+    stages = ("pmt_statistics", "blr_statistics", "sipm_statistics")
+
+    def select_inputs(self, h5in):
+        """
+        Read the CWF and BLR waveforms if the input has them and write the
+        arrays that can be computed from what is read.
+        """
+        self.input_nodes = dict(Zora.input_nodes)
+        for key in ("pmtcwf", "pmtblr"):
+            if "/RD/" + key in h5in:
+                self.input_nodes[key] = "/RD/" + key
+        keys = ["event", "pmt_baseline", "pmt_noise", "pmt_saturated",
+                "sipm_energy", "sipm_saturated"]
+        if "pmtcwf" in self.input_nodes:
+            keys.append("pmt_energy")
+        if "pmtblr" in self.input_nodes:
+            keys.append("blr_energy")
+            if "pmtcwf" in self.input_nodes:
+                keys.append("blr_residual")
+        self.output_arrays = {key: "/Monitor/" + key for key in keys}
+
+    def nevents(self, h5in):
+        self.select_inputs(h5in)
+        return City.nevents(self, h5in)
+
+    def prepare(self, h5in):
+        CFP = self.CFP
+        self.select_inputs(h5in)
+        self.nsigma = CFP.get("NSIGMA", 3.)
+        self.nloops = CFP.get("NLOOPS", 3)
+        self.sipm_nsigma = CFP.get("SIPM_NSIGMA", 5.)
+
+        NEVT, NPMT, PMTWL = h5in.root.RD.pmtrwf.shape
+        NEVT, NSIPM, SIPMWL = h5in.root.RD.sipmrwf.shape
+        print_configuration({"# PMT": NPMT, "PMT WL": PMTWL,
+                             "# SiPM": NSIPM, "SIPM WL": SIPMWL,
+                             "# events in DST": NEVT,
+                             "inputs": ", ".join(sorted(self.input_nodes))})
+
+        pmtdf = DB.DataPMT()
+        sipmdf = DB.DataSiPM()
+        self.adc_to_pes = abs(1.0/pmtdf["adc_to_pes"].values.reshape(NPMT,
+                                                                      1))
+        sipm_adc_to_pes = sipmdf["adc_to_pes"].values.reshape(NSIPM, 1)
+        self.sipm_pes = np.where(sipm_adc_to_pes > 0,
+                                 1.0/np.where(sipm_adc_to_pes > 0,
+                                              sipm_adc_to_pes, 1.), 0.)
+        self.nsipm = NSIPM
+
+    def create_output(self, h5in, h5out):
+        NEVT, NPMT, PMTWL = h5in.root.RD.pmtrwf.shape
+        group = h5out.create_group(h5out.root, "Monitor")
+        for key in self.output_arrays:
+            atom, per_pmt = MONITOR_ARRAYS[key]
+            h5out.create_earray(group, key, atom=atom,
+                                shape=(0, NPMT) if per_pmt else (0,),
+                                expectedrows=NEVT,
+                                filters=tbl.filters(self.CFP["COMPRESSION"]))
+        h5out.create_group(group, "SiPM")
+        self.sipm_summaries = self.new_summaries()
+
+    def new_summaries(self):
+        """
+        Empty per-SiPM summaries: a profile of each quantity versus the
+        sensor index and the saturated samples of each sensor.
+        """
+        srange = (-0.5, self.nsipm - 0.5)
+        summaries = {name: hst.Profile1D(self.nsipm, srange)
+                     for name in SIPM_PROFILES}
+        summaries["saturated"] = hst.Histogram1D(self.nsipm, srange)
+        return summaries
+
+    def pmt_statistics(self, evt, event):
+        pmtrwf = event["pmtrwf"]
+        event["event"] = evt
+        event["pmt_baseline"], event["pmt_noise"] = wfm.baselines_and_noise(
+            pmtrwf, self.nsigma, self.nloops)
+        event["pmt_saturated"] = saturated(pmtrwf)
+        if "pmtcwf" in event:
+            event["pmt_energy"] = np.sum(event["pmtcwf"] * self.adc_to_pes,
+                                         axis=1)
+
+    def blr_statistics(self, evt, event):
+        if "pmtblr" not in event:
+            return
+        blr = wfm.subtract_baseline(FE.CEILING - event["pmtblr"])
+        event["blr_energy"] = np.sum(blr * self.adc_to_pes, axis=1)
+        if "pmtcwf" in event:
+            event["blr_residual"] = np.std(event["pmtcwf"] - blr, axis=1)
+
+    def sipm_statistics(self, evt, event):
+        sipmrwf = event["sipmrwf"]
+        baseline, noise = wfm.baselines_and_noise(sipmrwf, self.nsigma,
+                                                  self.nloops)
+        signal = sipmrwf - baseline[:, np.newaxis]
+        signal = np.where(signal > self.sipm_nsigma * noise[:, np.newaxis],
+                          signal, 0.)
+        energy = np.sum(signal * self.sipm_pes, axis=1)
+        nsaturated = saturated(sipmrwf, low=False)
+        event["sipm_energy"] = energy.sum()
+        event["sipm_saturated"] = nsaturated.sum()
+        event["sipm"] = {"baseline": baseline, "noise": noise,
+                         "energy": energy, "saturated": nsaturated}
+
+    def write_batch(self, h5out, start, stop, batch, results):
+        City.write_batch(self, h5out, start, stop, batch, results)
+        sensors = np.tile(np.arange(self.nsipm), len(results))
+        sipm = [event["sipm"] for event in results]
+        for name in SIPM_PROFILES:
+            self.sipm_summaries[name].fill(
+                sensors, np.concatenate([values[name] for values in sipm]))
+        self.sipm_summaries["saturated"].fill(
+            sensors, weights=np.concatenate([values["saturated"]
+                                             for values in sipm]))
+
+    def store_summaries(self, h5out):
+        for name, summary in self.sipm_summaries.items():
+            summary.store(h5out.root.Monitor.SiPM, name, overwrite=True)
+
+    def checkpoint(self, h5out, tables, start, stop, next_event,
+                   random_state=None):
+        self.store_summaries(h5out)
+        City.checkpoint(self, h5out, tables, start, stop, next_event,
+                        random_state)
+
+    def restore(self, h5out):
+        checkpoint = City.restore(self, h5out)
+        self.sipm_summaries = read_summaries(h5out)
+        return checkpoint
+
+    def merge_shards(self, shards, tables, start, stop):
+        summaries = []
+        for shard in shards:
+            with tb.open_file(shard) as h5shard:
+                summaries.append(read_summaries(h5shard))
+        self.sipm_summaries = {name: sum(summary[name]
+                                         for summary in summaries)
+                               for name in summaries[0]}
+        City.merge_shards(self, shards, tables, start, stop)
+
+    def finalize(self, h5in, h5out, start, stop):
+        self.store_summaries(h5out)
+        tbl.build_catalog(h5out, np.arange(start, stop))
+
+
+def read_summaries(h5f):
+    """
+    Per-SiPM accumulators stored by ZORA in an open file.
+
+    Returns
+    -------
+    summaries : dictionary
+        name: Core.Histograms accumulator.
+    """
+    return {group._v_name: hst.read(group)
+            for group in h5f.root.Monitor.SiPM._f_iter_nodes("Group")}
+
+
+def read_summary(filename):
+    """
+    Read the summary written by ZORA, for the monitoring plots.
+
+    Parameters
+    ----------
+    filename : string
+
+    Returns
+    -------
+    events : dictionary
+        name: per-event array of /Monitor (events along axis 0, PMTs along
+        axis 1).
+    sipms : dictionary
+        baseline, noise, energy: (sensor index, mean, error of the mean)
+        of each SiPM over the run; saturated: (sensor index, number of
+        saturated samples).
+    """
+    with tb.open_file(filename) as h5in:
+        events = {node.name: node.read()
+                  for node in h5in.root.Monitor._f_iter_nodes("Array")}
+        summaries = read_summaries(h5in)
+    sipms = {name: summaries[name].profile(drop_nan=False)
+             for name in SIPM_PROFILES}
+    sipms["saturated"] = (summaries["saturated"].x,
+                          summaries["saturated"].counts)
+    return events, sipms
+
+
+def ZORA(argv=sys.argv):
+    """
+    ZORA driver
+    """
+    CFP = configure(argv)
+
+    if CFP["INFO"]:
+        print(__doc__)
+
+    Zora(CFP).run()
+
+
+if __name__ == "__main__":
+    from cities import zora
+    print(zora)
+    ZORA(sys.argv)
@@ -56,3 +56,10 @@ along the streets towards the market, the women had fine teeth and looked you
 straight in the the eye, three soldiers on a platform played the trumpet, and
 all around wheels turned and colored banners fluttered in the wind.
 """
+
+zora = """
+Zora is the city that whoever has seen it once can never forget: not because
+it leaves an unusual image in the memory, but because every street, house and
+sign in it stays in place, one after the other, like the squares of a
+notebook in which anything can be written down and read again in order.
+"""
@@ -0,0 +1,373 @@
+"""
+Present a collection of files as a single event stream (a la ROOT TChain).
+
+Files are opened lazily and only a limited number of them are kept open at
+the same time (least recently used ones are closed first). Event numbers are
+global: event i of the chain is event i - offset of the file containing it.
+"""
+from __future__ import print_function
+
+import os
+import glob
+from collections import OrderedDict
+
+import numpy as np
+import tables as tb
+
+import Core.tblFunctions as tbl
+
+# Columns holding event numbers, made global when the tables are joined
+EVENT_COLUMNS = ("event", "event_indx")
+
+# Tables describing the run rather than its events, taken from the first file
+RUN_TABLES = ("/Run/runInfo", "/MC/FEE", "/Detector/DetectorGeometry",
+              "/Sensors/DataPMT", "/Sensors/DataBLR", "/Sensors/DataSiPM")
+
+
+def global_events(data, offset):
+    """
+    Add the global number of the first event of a file to the event
+    columns (EVENT_COLUMNS) of some rows of its tables, in place.
+
+    Raises
+    ------
+    ValueError
+        If the global event numbers do not fit in the type of a column.
+    """
+    for name in EVENT_COLUMNS:
+        if data.dtype.names is None or name not in data.dtype.names:
+            continue
+        events = data[name].astype(np.int64) + offset
+        if events.size and events.max() > np.iinfo(data.dtype[name]).max:
+            raise ValueError("Event {} does not fit in column {} ({})"
+                             "".format(events.max(), name,
+                                       data.dtype[name]))
+        data[name] = events
+    return data
+
+
+def read_pmap(h5f, evt, blr=False):
+    """
+    Read the pmap of an event of a file or of a chain (global event
+    number), through the catalog if the file has one.
+
+    Parameters
+    ----------
+    h5f : tb.File or Chain
+    evt : int
+        Event number.
+    blr : bool, optional
+        Read the pmaps of the BLR waveforms. Default is False.
+
+    Returns
+    -------
+    pmap : Bridges.PMap
+    """
+    if isinstance(h5f, Chain):
+        h5f, evt = h5f.event(evt)
+    name = "pmaps_blr" if blr else "pmaps"
+    table = h5f.root.PMAPS.PMapsBLR if blr else h5f.root.PMAPS.PMaps
+    return tbl.read_pmap(table, evt, tbl.get_event_rows(h5f, name, evt))
+
+
+class Chain:
+    """
+    A sequence of files seen as one.
+
+    Parameters
+    ----------
+    files : string or sequence of strings
+        Glob pattern (environment variables are expanded) or list of file
+        names. Patterns are sorted alphabetically, lists are kept as given.
+    max_open : int, optional
+        Maximum number of files open at the same time. Default is 16.
+
+    Attributes
+    ----------
+    filenames : list of strings
+        Files in the chain.
+    offsets : 1-dim np.ndarray
+        Global number of the first event of each file. The last element is
+        the total number of events.
+    root : ChainGroup
+        Mimics tb.File.root, e.g. chain.root.RD.pmtrwf[i].
+    """
+
+    def __init__(self, files, max_open=16):
+        if not isinstance(files, (list, tuple)):
+            files = sorted(glob.glob(os.path.expandvars(files)))
+        if not len(files):
+            raise ValueError("No files found for the chain")
+
+        self.filenames = list(files)
+        self.max_open = max(1, max_open)
+        self._handles = OrderedDict()
+
+        nevts = [tbl.get_nevents(self.file(i))
+                 for i in range(len(self.filenames))]
+        self.offsets = np.concatenate(([0], np.cumsum(nevts))).astype(int)
+        self.root = ChainGroup(self, "/")
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __contains__(self, path):
+        return path in self.file(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def file(self, ifile):
+        """
+        Return the (open) file number *ifile*, opening it if needed.
+        """
+        if ifile in self._handles:
+            self._handles[ifile] = self._handles.pop(ifile)
+        else:
+            if len(self._handles) >= self.max_open:
+                self._handles.popitem(last=False)[1].close()
+            self._handles[ifile] = tb.open_file(self.filenames[ifile], "r")
+        return self._handles[ifile]
+
+    def close(self):
+        """
+        Close all open files.
+        """
+        while self._handles:
+            self._handles.popitem()[1].close()
+
+    def locate(self, evt):
+        """
+        Map a global event number to (file number, local event number).
+        """
+        if evt < 0:
+            evt += len(self)
+        if not 0 <= evt < len(self):
+            raise IndexError("Event {} out of range".format(evt))
+        ifile = int(np.searchsorted(self.offsets, evt, "right")) - 1
+        return ifile, int(evt - self.offsets[ifile])
+
+    def event(self, evt):
+        """
+        Return the open file containing a global event and the local number.
+        """
+        ifile, local = self.locate(evt)
+        return self.file(ifile), local
+
+    def events(self, start=0, stop=None):
+        """
+        Iterate over (file, local event, global event) in chain order.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        for evt in range(start, stop):
+            h5f, local = self.event(evt)
+            yield h5f, local, evt
+
+    def blocks(self, start=0, stop=None):
+        """
+        Split the global events in [start, stop) by file. Iterate over
+        (file number, local start, local stop) for the files they span.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+        first, _ = self.locate(start)
+        last, _ = self.locate(stop - 1)
+        for ifile in range(first, last + 1):
+            offset = self.offsets[ifile]
+            yield (ifile, int(max(start, offset) - offset),
+                   int(min(stop, self.offsets[ifile + 1]) - offset))
+
+    def get_node(self, path):
+        """
+        Return the node at *path* as seen through the chain, like
+        tb.File.get_node.
+        """
+        node = self.file(0).get_node(path)
+        if isinstance(node, tb.Group):
+            return ChainGroup(self, path)
+        if isinstance(node, tb.Table):
+            return ChainTable(self, path)
+        return ChainArray(self, path)
+
+    def read_pmap(self, evt, blr=False):
+        """
+        Read the pmap of a global event (see tblFunctions.read_pmap).
+        """
+        return read_pmap(self, evt, blr)
+
+    def read_wf_table(self, evt, sensor="PMT"):
+        """
+        Read the true waveforms of a global event for sensor = PMT or SiPM
+        (see tblFunctions.read_wf_table).
+        """
+        h5f, local = self.event(evt)
+        name = "twf_pmt" if sensor == "PMT" else "twf_sipm"
+        return tbl.read_wf_table(h5f.get_node("/TWF", sensor), local,
+                                 tbl.get_event_rows(h5f, name, local))
+
+    @property
+    def pmtrd(self):
+        return self.root.pmtrd
+
+    @property
+    def sipmrd(self):
+        return self.root.sipmrd
+
+    @property
+    def pmtrwf(self):
+        return self.root.RD.pmtrwf
+
+    @property
+    def pmtblr(self):
+        return self.root.RD.pmtblr
+
+    @property
+    def pmtcwf(self):
+        return self.root.RD.pmtcwf
+
+    @property
+    def sipmrwf(self):
+        return self.root.RD.sipmrwf
+
+    @property
+    def ZS(self):
+        return self.root.ZS
+
+    @property
+    def PMaps(self):
+        return ChainPMaps(self, blr=False)
+
+    @property
+    def PMapsBLR(self):
+        return ChainPMaps(self, blr=True)
+
+
+class ChainGroup:
+    """
+    Attribute access to the nodes of a chain, like tb.Group.
+    Leaves are returned as ChainArray or ChainTable instances.
+    """
+
+    def __init__(self, chain, path):
+        self._chain = chain
+        self._v_pathname = path
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._chain.get_node(self._v_pathname.rstrip("/") + "/" + name)
+
+
+class ChainArray:
+    """
+    An (extensible) array whose first axis runs over the events of all the
+    files in the chain.
+    """
+
+    def __init__(self, chain, path):
+        self._chain = chain
+        self._v_pathname = path
+        node = tbl.get_wf_array(chain.file(0), path)
+        self.shape = (len(chain),) + tuple(int(n) for n in node.shape[1:])
+        self.dtype = node.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _node(self, ifile):
+        return tbl.get_wf_array(self._chain.file(ifile), self._v_pathname)
+
+    def read(self, start=0, stop=None):
+        """
+        Read the events in [start, stop) as one array.
+        """
+        blocks = [self._node(ifile)[low:upp]
+                  for ifile, low, upp in self._chain.blocks(start, stop)]
+        if not blocks:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        return np.concatenate(blocks)
+
+    def __getitem__(self, key):
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            data = self.read(start, stop)[::step]
+            return data[(slice(None),) + rest] if rest else data
+        ifile, local = self._chain.locate(key)
+        return self._node(ifile)[(local,) + rest]
+
+
+class ChainTable:
+    """
+    A table made of the tables of all files in the chain. Event numbers
+    (EVENT_COLUMNS) are made global; run tables (RUN_TABLES) are those of
+    the first file.
+    """
+
+    def __init__(self, chain, path):
+        self._chain = chain
+        self._v_pathname = path
+
+    def _node(self, ifile):
+        return tbl.get_wf_array(self._chain.file(ifile), self._v_pathname)
+
+    def _files(self):
+        if self._v_pathname in RUN_TABLES:
+            return range(1)
+        return range(len(self._chain.filenames))
+
+    @property
+    def nrows(self):
+        return sum(self._node(i).nrows for i in self._files())
+
+    def nodes(self):
+        """
+        Iterate over the table of each file with the global number of its
+        first event, as (offset, tb.Table) pairs. Files are opened as they
+        are reached, so a table may be closed once the next one is.
+        """
+        for i in self._files():
+            yield int(self._chain.offsets[i]), self._node(i)
+
+    def read(self):
+        """
+        Read all rows.
+        """
+        return np.concatenate([global_events(node.read(), offset)
+                               for offset, node in self.nodes()])
+
+    def copy(self, newparent, newname=None):
+        """
+        Write the rows of all files into a new table, like tb.Table.copy.
+        """
+        node = self._node(0)
+        h5out = newparent._v_file
+        table = h5out.create_table(newparent, newname or node.name,
+                                   node.description, node.title,
+                                   node.filters)
+        for offset, node in self.nodes():
+            table.append(global_events(node.read(), offset))
+        table.flush()
+        return table
+
+
+class ChainPMaps:
+    """
+    Sequence of the pmaps of a chain, chain.PMaps[i] is a Bridges.PMap.
+    """
+
+    def __init__(self, chain, blr=False):
+        self._chain = chain
+        self._blr = blr
+
+    def __len__(self):
+        return len(self._chain)
+
+    def __getitem__(self, evt):
+        return self._chain.read_pmap(evt, self._blr)
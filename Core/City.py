@@ -0,0 +1,719 @@
+"""
+Common driver for the cities.
+
+A city declares the per-event arrays it reads, the arrays it writes and the
+sequence of stages (its physics) applied to each event. The City base class
+takes care of the rest: opening the files, reading the input in batches,
+running the stages (optionally in several processes), writing the output in
+bulk and timing each step.
+"""
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import tempfile
+import cProfile
+import traceback
+import multiprocessing
+from collections import OrderedDict
+from datetime import datetime
+from time import time
+try:
+    from time import process_time as cpu_time
+except ImportError:  # python 2
+    from time import clock as cpu_time
+try:
+    from queue import Empty
+except ImportError:  # python 2
+    from Queue import Empty
+
+import numpy as np
+import tables as tb
+
+from Core.LogConfig import logger
+from Core.Configure import event_range
+from Core.Chain import Chain
+from Core.Writer import Writer
+import Core.tblFunctions as tbl
+
+
+# Default memory budget for the input of a batch
+MAX_BATCH_BYTES = 64 * 2**20
+
+
+class City(object):
+    """
+    Base class of the cities.
+
+    Parameters
+    ----------
+    CFP : dictionary
+        Job configuration, as given by Configure.configure. Besides the
+        city parameters, the framework uses:
+        FILE_IN, FILE_OUT : input and output files (FILE_IN may be a chain).
+        COMPRESSION : compression of the output nodes.
+        BATCH_SIZE : events read and written at once (default: as many as
+                     fit in MAX_BATCH_BYTES).
+        NJOBS : number of processes running the per-event stages
+                (default 1).
+        WRITE_QUEUE : number of batches that may wait to be written by the
+                      writer thread while the next ones are processed
+                      (default 2; 0 writes in the event loop thread).
+        CHECKPOINT : minimum number of events between checkpoints of the
+                     output (default 0: after every batch). The checkpoint
+                     is an attribute of the output file (see checkpoint).
+        RESUME : continue from the last checkpoint of the output, if any.
+        SEED : seed the random generator with (SEED, event number) before
+               processing each event, so that the random sequence of an
+               event does not depend on how the job is split.
+        SHARDS : split the events in this many contiguous ranges, run each
+                 range in its own process writing to a temporary file and
+                 concatenate the outputs (default 1, see run_shards).
+        PROFILE : write cProfile statistics of the main process to this file
+                  (or to a default name if empty, see profile_name).
+        TIMING : print a throughput report at the end and write it as JSON
+                 to this file (or to the output file name + .timing.json if
+                 empty).
+
+    Subclasses define
+    -----------------
+    name : string
+        Name of the city, used in the reports.
+    in_place : bool
+        If True the output is written into the input file (opened in append
+        mode) instead of into FILE_OUT. Default is False.
+    input_nodes : dictionary
+        key: path of the arrays read for each event (events along axis 0).
+    output_arrays : dictionary
+        key: path of the arrays the framework appends the values of *key*
+        to, one entry per event. They must be created in create_output.
+    batch_stages : sequence of strings
+        Methods called as stage(start, stop, batch) on each batch of events.
+        batch holds the input arrays of the batch and any array (with
+        events along axis 0) added by the stage is passed on to the events.
+    stages : sequence of strings
+        Methods called as stage(evt, event) on each event, in order. event
+        holds the input of the event and stages add their results to it.
+
+    and may override the hooks prepare, create_output, write and finalize.
+    Stages must not use the open files, as they may run in a different
+    process.
+    """
+    name = "CITY"
+    in_place = False
+    input_nodes = {}
+    output_arrays = {}
+    batch_stages = ()
+    stages = ()
+
+    def __init__(self, CFP):
+        self.CFP = CFP
+        self.timing = OrderedDict()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.compression_ratio = None
+        self.loop_tables = {}
+
+    # Hooks
+    def prepare(self, h5in):
+        """
+        Read whatever the stages need from the input (shapes, databases,
+        ...) and store it in the city. Called once before the event loop.
+        """
+        pass
+
+    def create_output(self, h5in, h5out):
+        """
+        Create the output nodes and copy the metadata.
+        """
+        pass
+
+    def write(self, h5out, evt, event):
+        """
+        Write the results of an event which are not in output_arrays
+        (e.g. table rows).
+        """
+        pass
+
+    def finalize(self, h5in, h5out, start, stop):
+        """
+        Called after the last batch has been written.
+        """
+        pass
+
+    # Framework
+    def add_time(self, name, wall, cpu):
+        """
+        Accumulate the wall and CPU time spent in a step.
+        """
+        timing = self.timing.setdefault(name, [0., 0.])
+        timing[0] += wall
+        timing[1] += cpu
+
+    def timed(self, name, function, *args):
+        """
+        Call function(*args) accounting its time to step *name*.
+        """
+        t0, c0 = time(), cpu_time()
+        output = function(*args)
+        self.add_time(name, time() - t0, cpu_time() - c0)
+        return output
+
+    def process(self, evt, event):
+        """
+        Run the per-event stages on an event.
+        """
+        if self.CFP.get("SEED") is not None:
+            np.random.seed([self.CFP["SEED"], evt])
+        for name in self.stages:
+            self.timed(name, getattr(self, name), evt, event)
+        return event
+
+    def open_input(self):
+        """
+        Open the input file(s).
+        """
+        if self.in_place and "SHARD" not in self.CFP:
+            return tb.open_file(self.CFP["FILE_IN"], "a",
+                                filters=tbl.filters(self.CFP["COMPRESSION"]))
+        return Chain(self.CFP["FILE_IN"])
+
+    def batch_size(self, h5in):
+        """
+        Number of events read at once. Given by option BATCH_SIZE or, by
+        default, as many as fit in MAX_BATCH_BYTES.
+        """
+        if "BATCH_SIZE" in self.CFP:
+            return max(1, self.CFP["BATCH_SIZE"])
+        rowsize = 0
+        for path in self.input_nodes.values():
+            node = tbl.get_wf_array(h5in, path)
+            rowsize += np.prod(node.shape[1:]) * node.dtype.itemsize
+        return max(1, int(MAX_BATCH_BYTES // max(rowsize, 1)))
+
+    def nevents(self, h5in):
+        """
+        Number of events in the input, as given by the input arrays.
+        """
+        return min(tbl.get_wf_array(h5in, path).shape[0]
+                   for path in self.input_nodes.values())
+
+    def read_batch(self, h5in, start, stop):
+        """
+        Read the input arrays for the events in [start, stop).
+        """
+        return {key: tbl.get_wf_array(h5in, path)[start:stop]
+                for key, path in self.input_nodes.items()}
+
+    def run_batch(self, h5in, h5out, start, stop, pool=None, writer=None):
+        """
+        Read, process and write (or hand to the writer) the events in
+        [start, stop).
+        """
+        if writer is None:
+            writer = Writer(0)
+        with writer.lock:
+            batch = self.timed("read", self.read_batch, h5in, start, stop)
+        self.bytes_read += sum(value.nbytes for value in batch.values())
+
+        for name in self.batch_stages:
+            self.timed(name, getattr(self, name), start, stop, batch)
+
+        events = [(i, {key: value[i - start] for key, value in batch.items()})
+                  for i in range(start, stop)]
+        if pool is None:
+            results = [self.process(i, event) for i, event in events]
+        else:
+            results = []
+            for event, timing in pool.imap(_process_event, events):
+                results.append(event)
+                for name, (wall, cpu) in timing.items():
+                    self.add_time(name, wall, cpu)
+
+        if writer.queue is None:
+            writer.submit(self.write_batch, h5out, start, stop, batch,
+                          results)
+        else:
+            self.timed("write_wait", writer.submit, self.write_batch, h5out,
+                       start, stop, batch, results)
+
+    def write_batch(self, h5out, start, stop, batch, results):
+        """
+        Append the output arrays of a batch and write the rest of the
+        results of each event.
+        """
+        for key, path in self.output_arrays.items():
+            if key in batch:
+                data = batch[key]
+            else:
+                data = np.array([event[key] for event in results])
+            tbl.get_wf_array(h5out, path).append(data)
+            self.bytes_written += data.nbytes
+        for i, event in zip(range(start, stop), results):
+            self.write(h5out, i, event)
+
+    def checkpoint_name(self):
+        """
+        Name of the output attribute holding the checkpoint of the city.
+        """
+        return self.name + "_checkpoint"
+
+    def checkpoint(self, h5out, tables, start, stop, next_event,
+                   random_state=None):
+        """
+        Flush the output and record in its attributes the first event not
+        written yet, the number of rows of the output arrays and of the
+        tables and the state of the random generator (the current one
+        unless given), so that the run can be resumed from there.
+        """
+        rows = {}
+        for path in list(self.output_arrays.values()) + list(tables):
+            node = tbl.get_wf_array(h5out, path)
+            node.flush()
+            rows[path] = node.nrows
+        h5out.set_node_attr("/", self.checkpoint_name(),
+                            {"start": start, "stop": stop,
+                             "next_event": next_event, "rows": rows,
+                             "random_state": (np.random.get_state()
+                                              if random_state is None
+                                              else random_state)})
+        h5out.flush()
+
+    def resumable(self, filename):
+        """
+        Whether RESUME is set and the file holds a checkpoint of the city.
+        """
+        if not self.CFP.get("RESUME") or not os.path.exists(filename):
+            return False
+        with tb.open_file(filename) as h5f:
+            return self.checkpoint_name() in h5f.root._v_attrs
+
+    def restore(self, h5out):
+        """
+        Bring the output back to its last checkpoint: drop whatever was
+        appended afterwards and restore the random generator.
+
+        Returns
+        -------
+        checkpoint : dictionary
+            As written by checkpoint.
+        """
+        checkpoint = h5out.get_node_attr("/", self.checkpoint_name())
+        for path, nrows in checkpoint["rows"].items():
+            node = tbl.get_wf_array(h5out, path)
+            if node.nrows > nrows:
+                node.truncate(nrows)
+                if isinstance(node, tb.Table) and node.indexed:
+                    node.reindex()
+        np.random.set_state(checkpoint["random_state"])
+        logger.info("Resuming {} from event {}".format(
+                    self.name, checkpoint["next_event"]))
+        return checkpoint
+
+    def event_loop(self, h5in, h5out, checkpoint=None):
+        """
+        Run over the configured events, or over those left by an
+        interrupted run if a checkpoint is given. The output is
+        checkpointed after each batch, or every CHECKPOINT events.
+
+        Returns
+        -------
+        start, stop : ints
+            Range of events processed.
+        """
+        if checkpoint is None:
+            start, stop = event_range(self.CFP, self.nevents(h5in))
+            first_event = start
+        else:
+            start, stop = checkpoint["start"], checkpoint["stop"]
+            first_event = checkpoint["next_event"]
+        tables = [path for path in table_rows(h5out)
+                  if not path.startswith("/Catalog")]
+        batch = self.batch_size(h5in)
+        print_mod = self.CFP.get("PRINT_MOD", max(1, (stop - start)//20))
+        every = self.CFP.get("CHECKPOINT", 0)
+
+        njobs = self.CFP.get("NJOBS", 1)
+        pool = None
+        if njobs > 1:
+            pool = multiprocessing.Pool(njobs, _init_worker, (self,))
+        writer = Writer(self.CFP.get("WRITE_QUEUE", 2))
+        try:
+            last_checkpoint = first_event
+            for first in range(first_event, stop, batch):
+                last = min(first + batch, stop)
+                for i in range(first, last):
+                    if not i % print_mod:
+                        logger.info("Event # {}".format(i))
+                self.run_batch(h5in, h5out, first, last, pool, writer)
+                if last - last_checkpoint >= every:
+                    # The random state is that of the end of this batch
+                    writer.submit(self.checkpoint, h5out, tables, start,
+                                  stop, last, np.random.get_state())
+                    last_checkpoint = last
+            if pool is not None:
+                pool.close()
+            self.timed("write_wait", writer.close)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            writer.close(check=False)
+            self.add_time("write", writer.wall, writer.cpu)
+
+        def close():
+            for path in self.output_arrays.values():
+                tbl.get_wf_array(h5out, path).flush()
+            self.finalize(h5in, h5out, start, stop)
+            self.checkpoint(h5out, tables, start, stop, stop)
+        self.timed("write", close)
+        return first_event, stop
+
+    def loop(self, h5in, h5out):
+        """
+        Create the output (or restore it, when resuming) and run over the
+        events.
+        """
+        checkpoint = None
+        if self.CFP.get("RESUME"):
+            if self.checkpoint_name() in h5out.root._v_attrs:
+                checkpoint = self.restore(h5out)
+            else:
+                logger.warning("No checkpoint of {} found, starting from "
+                               "scratch".format(self.name))
+        if checkpoint is None:
+            self.create_output(h5in, h5out)
+        nrows = table_rows(h5out)
+        start, stop = self.event_loop(h5in, h5out, checkpoint)
+
+        # Account for the rows written to tables and the compression of all
+        # the nodes filled in the loop
+        nodes = [tbl.get_wf_array(h5out, path)
+                 for path in self.output_arrays.values()]
+        for path, n in table_rows(h5out).items():
+            if n > nrows.get(path, 0):
+                table = h5out.get_node(path)
+                self.bytes_written += (n - nrows.get(path, 0)) * table.rowsize
+                nodes.append(table)
+            # Tables filled event by event (as opposed to created whole)
+            if path in nrows and n > nrows[path]:
+                self.loop_tables[path] = nrows[path]
+        self.compression_ratio = compression_ratio(nodes)
+        return start, stop
+
+    def process_files(self):
+        """
+        Open the files and run over the events.
+
+        Returns
+        -------
+        start, stop : ints
+            Range of events processed.
+        """
+        if self.CFP.get("SHARDS", 1) > 1:
+            return self.run_shards()
+
+        with self.open_input() as h5in:
+            self.prepare(h5in)
+            if self.in_place and "SHARD" not in self.CFP:
+                return self.loop(h5in, h5in)
+            mode = "a" if self.resumable(self.CFP["FILE_OUT"]) else "w"
+            with tb.open_file(self.CFP["FILE_OUT"], mode,
+                              filters=tbl.filters(
+                                  self.CFP["COMPRESSION"])) as h5out:
+                if self.in_place:
+                    # Shard of an in-place city: its output goes to a file
+                    # of its own, with the groups the input would provide
+                    for path in self.output_arrays.values():
+                        where, name = os.path.dirname(path).rsplit("/", 1)
+                        if name and os.path.dirname(path) not in h5out:
+                            h5out.create_group(where or "/", name,
+                                               createparents=True)
+                return self.loop(h5in, h5out)
+
+    def run_shards(self):
+        """
+        Split the events in SHARDS contiguous ranges and run each one in a
+        subprocess writing to a temporary file. The outputs are then
+        concatenated in order (see merge_shards). Events keep their
+        numbers, so the result is the same as that of a single process.
+
+        Returns
+        -------
+        start, stop : ints
+            Range of events processed.
+        """
+        with Chain(self.CFP["FILE_IN"]) as h5in:
+            start, stop = event_range(self.CFP, self.nevents(h5in))
+        bounds = np.linspace(start, stop, self.CFP["SHARDS"] + 1).astype(int)
+        ranges = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        if len(ranges) < 2:
+            self.CFP = dict(self.CFP, SHARDS=1)
+            return self.process_files()
+
+        output = self.CFP["FILE_IN" if self.in_place else "FILE_OUT"]
+        tmpdir = tempfile.mkdtemp(prefix=".shards_",
+                                  dir=os.path.dirname(os.path.abspath(output)))
+        try:
+            shards = [os.path.join(tmpdir, "shard{}.h5".format(i))
+                      for i in range(len(ranges))]
+            queue = multiprocessing.Queue()
+            processes = []
+            for i, ((first, last), shard) in enumerate(zip(ranges, shards)):
+                CFP = dict(self.CFP, SKIP=first, NEVENTS=last, RUN_ALL=False,
+                           FILE_OUT=shard, SHARD=i)
+                for key in ("SHARDS", "PROFILE", "TIMING", "RESUME"):
+                    CFP.pop(key, None)
+                processes.append(multiprocessing.Process(
+                                 target=_run_shard,
+                                 args=(type(self), CFP, queue)))
+                processes[-1].start()
+
+            results = {}
+            while len(results) < len(processes):
+                try:
+                    message = queue.get(timeout=1)
+                    results[message[0]] = message[1:]
+                except Empty:
+                    if not any(p.is_alive() for p in processes):
+                        break
+            for process in processes:
+                process.join()
+
+            failed = [i for i in range(len(processes))
+                      if i not in results or len(results[i]) == 1]
+            for i in failed:
+                logger.error("Shard {} (events {}-{}) failed:\n{}".format(
+                             i, ranges[i][0], ranges[i][1],
+                             results[i][0] if i in results else
+                             "exit code {}".format(processes[i].exitcode)))
+            if failed:
+                raise RuntimeError("{} shard(s) of {} failed".format(
+                                   len(failed), self.name))
+
+            for i in range(len(processes)):
+                timing, bytes_read, bytes_written, tables = results[i]
+                for name, (wall, cpu) in timing.items():
+                    self.add_time(name, wall, cpu)
+                self.bytes_read += bytes_read
+                self.bytes_written += bytes_written
+
+            self.timed("merge", self.merge_shards, shards,
+                       [results[i][3] for i in range(len(processes))],
+                       start, stop)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        return start, stop
+
+    def merge_shards(self, shards, tables, start, stop):
+        """
+        Concatenate the outputs of the shards. The first shard becomes the
+        output file (in-place cities create their output again in the input
+        file instead) and the output arrays of the rest, as well as the rows
+        their event loop wrote to each table, are appended to it. Tables
+        copied whole, like the MC information, come from the first shard
+        only. The output is finalized as in a single process run.
+
+        Parameters
+        ----------
+        shards : sequence of strings
+            Shard file names, in event order.
+        tables : sequence of dictionaries
+            For each shard, path: first row written in the event loop of the
+            tables filled event by event.
+        start, stop : ints
+            Range of events of the whole job.
+        """
+        if not self.in_place:
+            shutil.move(shards[0], self.CFP["FILE_OUT"])
+            shards, tables = shards[1:], tables[1:]
+
+        with self.open_input() as h5in:
+            self.prepare(h5in)
+            if self.in_place:
+                self.create_output(h5in, h5in)
+                h5out = h5in
+            else:
+                h5out = tb.open_file(self.CFP["FILE_OUT"], "a")
+            try:
+                merged = set()
+                for shard, rows in zip(shards, tables):
+                    with tb.open_file(shard) as h5shard:
+                        for path in self.output_arrays.values():
+                            append_rows(tbl.get_wf_array(h5shard, path),
+                                        tbl.get_wf_array(h5out, path))
+                        for path, first in rows.items():
+                            append_rows(h5shard.get_node(path),
+                                        h5out.get_node(path), first)
+                            merged.add(path)
+                nodes = [tbl.get_wf_array(h5out, path)
+                         for path in set(self.output_arrays.values()) | merged]
+                for node in nodes:
+                    node.flush()
+                self.finalize(h5in, h5out, start, stop)
+                self.compression_ratio = compression_ratio(nodes)
+            finally:
+                if h5out is not h5in:
+                    h5out.close()
+
+    def profile_name(self):
+        """
+        Name of the cProfile output file.
+        """
+        filename = self.CFP.get("PROFILE")
+        if filename:
+            return filename
+        return "{}_{}.stat".format(self.name.lower(),
+                                   datetime.now().strftime("%Y%m%d_%H%M%S"))
+
+    def timing_name(self):
+        """
+        Name of the JSON timing report.
+        """
+        filename = self.CFP.get("TIMING")
+        if filename:
+            return filename
+        output = self.CFP["FILE_IN" if self.in_place else "FILE_OUT"]
+        if isinstance(output, (list, tuple)):
+            output = output[0]
+        return os.path.splitext(output)[0] + ".timing.json"
+
+    def report(self, nevt, wall, cpu):
+        """
+        Throughput report of the run.
+
+        Returns
+        -------
+        report : dictionary
+            Per-stage and total wall and CPU times (s), events/s, MB read and
+            written (uncompressed) and compression ratio of the output.
+        """
+        MB = 2.**20
+        return OrderedDict([
+            ("city", self.name),
+            ("date", datetime.now().isoformat()),
+            ("file_in", self.CFP.get("FILE_IN")),
+            ("file_out", None if self.in_place else self.CFP.get("FILE_OUT")),
+            ("njobs", self.CFP.get("NJOBS", 1)),
+            ("events", nevt),
+            ("wall", wall),
+            ("cpu", cpu),
+            ("events_per_s", nevt / wall if wall else None),
+            ("mb_read", self.bytes_read / MB),
+            ("mb_written", self.bytes_written / MB),
+            ("compression_ratio", self.compression_ratio),
+            ("stages", OrderedDict((name, {"wall": t[0], "cpu": t[1]})
+                                   for name, t in self.timing.items()))])
+
+    def print_report(self, report):
+        """
+        Print the throughput report.
+        """
+        print("{0: <22}   {1: >10} {2: >10} {3: >6}".format(
+              "stage", "wall (s)", "cpu (s)", "%"))
+        for name, t in report["stages"].items():
+            print("{0: <22} : {1: >10.3f} {2: >10.3f} {3: >6.1f}".format(
+                  name, t["wall"], t["cpu"],
+                  t["wall"] * 100. / report["wall"] if report["wall"] else 0.))
+        print("{0: <22} : {1: >10.3f} {2: >10.3f}".format(
+              "total", report["wall"], report["cpu"]))
+        if report["events_per_s"] is not None:
+            print("{0: <22} : {1:.2f}".format("events/s",
+                                             report["events_per_s"]))
+        print("{0: <22} : {1:.2f}".format("MB read", report["mb_read"]))
+        print("{0: <22} : {1:.2f}".format("MB written", report["mb_written"]))
+        if report["compression_ratio"] is not None:
+            print("{0: <22} : {1:.2f}".format("compression ratio",
+                                             report["compression_ratio"]))
+
+    def run(self):
+        """
+        Run the city.
+        """
+        t0, c0 = time(), cpu_time()
+        if self.CFP.get("PROFILE") is not None:
+            profiler = cProfile.Profile()
+            start, stop = profiler.runcall(self.process_files)
+            profiler.dump_stats(self.profile_name())
+            print("Profile written to", self.profile_name())
+        else:
+            start, stop = self.process_files()
+        dt = time() - t0
+
+        print("{} has run over {} events in {} seconds".format(
+              self.name, stop - start, dt))
+        if self.CFP.get("TIMING") is not None:
+            report = self.report(stop - start, dt, cpu_time() - c0)
+            self.print_report(report)
+            with open(self.timing_name(), "w") as sidecar:
+                json.dump(report, sidecar, indent=2)
+            print("Timing report written to", self.timing_name())
+        print("Leaving {}. Safe travels!".format(self.name))
+
+
+def compression_ratio(nodes):
+    """
+    Ratio of the uncompressed to the compressed size of some nodes (None if
+    there is no data).
+    """
+    on_disk = sum(node.size_on_disk for node in nodes)
+    if not on_disk:
+        return None
+    return sum(node.size_in_memory for node in nodes) * 1. / on_disk
+
+
+def append_rows(source, target, first=0):
+    """
+    Append the rows of an array or table from *first* on to another one,
+    reading at most MAX_BATCH_BYTES at once.
+    """
+    if isinstance(source, tb.Table):
+        rowsize = source.rowsize
+    else:
+        rowsize = np.prod(source.shape[1:]) * source.dtype.itemsize
+    chunk = max(1, int(MAX_BATCH_BYTES // max(rowsize, 1)))
+    for i in range(first, source.nrows, chunk):
+        target.append(source.read(i, min(i + chunk, source.nrows)))
+
+
+def table_rows(h5f):
+    """
+    Number of rows of each table in a file, indexed by path.
+    """
+    return {table._v_pathname: table.nrows
+            for table in h5f.walk_nodes("/", "Table")}
+
+
+# Worker processes get their own copy of the city
+_city = None
+
+
+def _init_worker(city):
+    global _city
+    _city = city
+    # Do not repeat the random sequence of the parent in every worker
+    np.random.seed()
+
+
+def _process_event(args):
+    evt, event = args
+    _city.timing.clear()
+    event = _city.process(evt, event)
+    for key in _city.input_nodes:
+        event.pop(key, None)
+    return event, _city.timing
+
+
+def _run_shard(city_class, CFP, queue):
+    """
+    Subprocess of a sharded run: process a range of events and send back
+    the timing, the volumes read and written and the tables filled in the
+    event loop (or the traceback on failure).
+    """
+    try:
+        city = city_class(CFP)
+        city.process_files()
+        queue.put((CFP["SHARD"], dict(city.timing), city.bytes_read,
+                   city.bytes_written, city.loop_tables))
+    except Exception:
+        queue.put((CFP["SHARD"], traceback.format_exc()))
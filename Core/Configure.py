@@ -54,6 +54,17 @@ def configure(input_options=sys.argv):
                         help="print every this number of events")
     parser.add_argument("--runall", action="store_true",
                         help="number of events to be skipped")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the last checkpoint of the output")
+    parser.add_argument("--shards", metavar="nshards", type=int,
+                        help="split the events in this many ranges processed"
+                             " in parallel and merge the outputs")
+    parser.add_argument("--profile", metavar="pfile", nargs="?", const="",
+                        help="write cProfile statistics (to pfile or to "
+                             "<city>_<date>.stat)")
+    parser.add_argument("--timing", metavar="tfile", nargs="?", const="",
+                        help="print a throughput report and write it as JSON"
+                             " (to tfile or next to the output file)")
     parser.add_argument("-I", action="store_true", help="print info")
     parser.add_argument("-v", action="count", help="verbosity level")
 
@@ -72,6 +83,14 @@ def configure(input_options=sys.argv):
         options["PRINT_MOD"] = flags.p
     if flags.runall:
         options["RUN_ALL"] = flags.runall
+    if flags.resume:
+        options["RESUME"] = flags.resume
+    if flags.shards is not None:
+        options["SHARDS"] = flags.shards
+    if flags.profile is not None:
+        options["PROFILE"] = flags.profile
+    if flags.timing is not None:
+        options["TIMING"] = flags.timing
     options["INFO"] = flags.I
     if flags.v is not None:
         options["VERBOSITY"] = 50 - min(flags.v, 4)*10
@@ -86,6 +105,27 @@ def configure(input_options=sys.argv):
     return options
 
 
+def event_range(options, n_evt):
+    """
+    Find the range of event numbers to be processed.
+
+    Parameters
+    ----------
+    options : dictionary
+        Contains the job parameters.
+    n_evt : int
+        Number of events in the input file.
+
+    Returns
+    ------
+    start, stop : ints
+        First event to be processed and one past the last one.
+    """
+    nevt = options.get("NEVENTS", 0)
+    max_evt = n_evt if options["RUN_ALL"] or nevt > n_evt else nevt
+    return options["SKIP"], max_evt
+
+
 def define_event_loop(options, n_evt):
     """
     Produce an iterator over the event numbers.
@@ -102,9 +142,7 @@ def define_event_loop(options, n_evt):
     gen : generator
         A generator producing the event numbers as configured in the job.
     """
-    nevt = options.get("NEVENTS", 0)
-    max_evt = n_evt if options["RUN_ALL"] or nevt > n_evt else nevt
-    start = options["SKIP"]
+    start, max_evt = event_range(options, n_evt)
     print_mod = options.get("PRINT_MOD", max(1, (max_evt-start)//20))
 
     for i in range(start, max_evt):
@@ -165,7 +203,10 @@ def read_config_file(cfile):
         d[key] = value[0] if len(value) == 1 else value
 
     if "PATH_IN" in d and "FILE_IN" in d:
-        d["FILE_IN"] = d["PATH_IN"] + "/" + d["FILE_IN"]
+        if isinstance(d["FILE_IN"], list):
+            d["FILE_IN"] = [d["PATH_IN"] + "/" + f for f in d["FILE_IN"]]
+        else:
+            d["FILE_IN"] = d["PATH_IN"] + "/" + d["FILE_IN"]
         del d["PATH_IN"]
     if "PATH_OUT" in d and "FILE_OUT" in d:
         d["FILE_OUT"] = d["PATH_OUT"] + "/" + d["FILE_OUT"]
@@ -0,0 +1,504 @@
+"""
+Histograms and profiles with a fixed binning, filled incrementally.
+
+The accumulators are filled chunk by chunk (e.g. reading a table a slice
+at a time with fill_chunks), so that the data never has to be in memory at
+once. Accumulators with the same binning filled by different processes or
+from different files are merged with +, and sum() of a list of them works.
+They are written to and read from HDF5 groups with store and read.
+
+- Histogram1D, Histogram2D: sum of weights (and of squared weights) per
+  bin, with the binning of np.histogram (the last bin includes its upper
+  edge).
+- Profile1D, Profile2D: number of entries, mean and sum of squared
+  deviations of a variable per bin, merged with the parallel algorithm of
+  Chan et al. They give the results of fitFunctions.profileX and
+  profileXY over the same ranges.
+
+The results are arrays of bin centers and values, which can be fitted with
+fitFunctions.fit (see the fit methods).
+"""
+
+from __future__ import print_function, division
+
+import copy
+
+import numpy as np
+
+import Core.fitFunctions as fitf
+
+
+class Accumulator(object):
+    """
+    Fixed binning, merging and storage of the accumulators.
+
+    Parameters
+    ----------
+    nbins : sequence of ints
+        Number of bins in each axis.
+    ranges : sequence of (min, max) tuples
+        Range of each axis.
+
+    Attributes
+    ----------
+    edges : list of np.ndarray
+        Bin edges of each axis.
+    entries : int
+        Number of values filled (in range or not).
+    """
+    fields = ()
+    attributes = ()
+
+    def __init__(self, nbins, ranges):
+        self.nbins = tuple(int(n) for n in nbins)
+        self.ranges = tuple((float(lo), float(hi)) for lo, hi in ranges)
+        self.entries = 0
+        for field in self.fields:
+            setattr(self, field, np.zeros(self.nbins))
+
+    @property
+    def edges(self):
+        return [np.linspace(lo, hi, n + 1)
+                for n, (lo, hi) in zip(self.nbins, self.ranges)]
+
+    @property
+    def centers(self):
+        """
+        Bin centers of each axis (computed as in fitFunctions.profileX).
+        """
+        return [edges[:-1] + (edges[1] - edges[0]) / 2.
+                for edges in self.edges]
+
+    def reset(self):
+        """
+        Empty the accumulator, keeping its binning.
+        """
+        self.__init__(*self._args())
+
+    def _args(self):
+        raise NotImplementedError
+
+    def _merge(self, other):
+        raise NotImplementedError
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def __iadd__(self, other):
+        if (type(other) is not type(self) or other.nbins != self.nbins or
+                other.ranges != self.ranges):
+            raise ValueError("Cannot add a {} {} {} to a {} {} {}".format(
+                             type(other).__name__,
+                             getattr(other, "nbins", ""),
+                             getattr(other, "ranges", ""),
+                             type(self).__name__, self.nbins, self.ranges))
+        self._merge(other)
+        self.entries += other.entries
+        return self
+
+    def __add__(self, other):
+        result = self.copy()
+        result += other
+        return result
+
+    def __radd__(self, other):
+        # so that sum(accumulators) works
+        if isinstance(other, int) and other == 0:
+            return self.copy()
+        return NotImplemented
+
+    def store(self, where, name, filters=None, overwrite=False):
+        """
+        Write the accumulator in a new group.
+
+        Parameters
+        ----------
+        where : tb.Group
+            Parent group.
+        name : string
+            Name of the group.
+        filters : tb.Filters, optional
+            Compression of the arrays.
+        overwrite : bool, optional
+            Replace the group if it exists (e.g. to update the accumulator
+            at every checkpoint of a city). Default is False.
+
+        Returns
+        -------
+        group : tb.Group
+        """
+        h5f = where._v_file
+        if overwrite and name in where:
+            h5f.remove_node(where, name, recursive=True)
+        group = h5f.create_group(where, name)
+        group._v_attrs.kind = type(self).__name__
+        group._v_attrs.nbins = np.array(self.nbins)
+        group._v_attrs.ranges = np.array(self.ranges)
+        group._v_attrs.entries = self.entries
+        for attribute in self.attributes:
+            setattr(group._v_attrs, attribute,
+                    np.array(getattr(self, attribute)))
+        for field in self.fields:
+            h5f.create_carray(group, field, obj=getattr(self, field),
+                              filters=filters)
+        return group
+
+
+def read(group):
+    """
+    Read an accumulator written with store.
+
+    Parameters
+    ----------
+    group : tb.Group
+
+    Returns
+    -------
+    accumulator : Histogram1D, Histogram2D, Profile1D or Profile2D
+    """
+    attrs = group._v_attrs
+    kind = attrs.kind
+    if isinstance(kind, bytes):
+        kind = kind.decode()
+    if kind not in KINDS:
+        raise ValueError("Unknown accumulator {} in {}".format(
+                         kind, group._v_pathname))
+    accumulator = object.__new__(KINDS[kind])
+    accumulator.nbins = tuple(int(n) for n in attrs.nbins)
+    accumulator.ranges = tuple((float(lo), float(hi))
+                               for lo, hi in attrs.ranges)
+    accumulator.entries = int(attrs.entries)
+    for attribute in accumulator.attributes:
+        setattr(accumulator, attribute, tuple(getattr(attrs, attribute)))
+    for field in accumulator.fields:
+        setattr(accumulator, field, group._f_get_child(field).read())
+    return accumulator
+
+
+def fill_chunks(accumulator, arrays, weights=None, chunksize=100000):
+    """
+    Fill an accumulator with data read a chunk at a time.
+
+    Parameters
+    ----------
+    accumulator : Accumulator
+    arrays : sequence
+        Data of each variable taken by fill: anything with a length which
+        can be sliced (np.ndarray, tb.Array, table columns as table.cols.x).
+    weights : array-like, optional
+        Weights, for the histograms.
+    chunksize : int, optional
+        Number of rows read at a time. Default is 100000.
+
+    Returns
+    -------
+    accumulator : Accumulator
+    """
+    nrows = len(arrays[0])
+    for start in range(0, nrows, chunksize):
+        chunk = [array[start:start + chunksize] for array in arrays]
+        if weights is None:
+            accumulator.fill(*chunk)
+        else:
+            accumulator.fill(*chunk,
+                             weights=weights[start:start + chunksize])
+    return accumulator
+
+
+class Histogram1D(Accumulator):
+    """
+    Histogram of a variable.
+
+    Parameters
+    ----------
+    nbins : int
+        Number of bins.
+    range : (min, max) tuple
+        Range of the histogram.
+
+    Attributes
+    ----------
+    counts : np.ndarray
+        Sum of the weights in each bin.
+    sumw2 : np.ndarray
+        Sum of the squared weights in each bin.
+    """
+    fields = ("counts", "sumw2")
+
+    def __init__(self, nbins, range):
+        Accumulator.__init__(self, (nbins,), (range,))
+
+    def _args(self):
+        return self.nbins[0], self.ranges[0]
+
+    def fill(self, x, weights=None):
+        x = np.asarray(x)
+        self.entries += x.size
+        counts, _ = np.histogram(x, self.nbins[0], self.ranges[0],
+                                 weights=weights)
+        self.counts += counts
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            counts, _ = np.histogram(x, self.nbins[0], self.ranges[0],
+                                     weights=weights * weights)
+        self.sumw2 += counts
+
+    def _merge(self, other):
+        self.counts += other.counts
+        self.sumw2 += other.sumw2
+
+    @property
+    def x(self):
+        return self.centers[0]
+
+    @property
+    def errors(self):
+        return np.sqrt(self.sumw2)
+
+    def fit(self, func, seed=(), **kwargs):
+        """
+        Fit the non-empty bins with fitFunctions.fit, weighted with the
+        errors of the bins.
+        """
+        filled = self.sumw2 > 0
+        kwargs.setdefault("sigma", self.errors[filled])
+        return fitf.fit(func, self.x[filled], self.counts[filled], seed,
+                        **kwargs)
+
+
+class Histogram2D(Accumulator):
+    """
+    Histogram of two variables.
+
+    Parameters
+    ----------
+    nbinsx, nbinsy : int
+        Number of bins in each axis.
+    xrange, yrange : (min, max) tuples
+        Range of each axis.
+
+    Attributes
+    ----------
+    counts : np.ndarray
+        (nbinsx, nbinsy) sum of the weights in each bin.
+    sumw2 : np.ndarray
+        Sum of the squared weights in each bin.
+    """
+    fields = ("counts", "sumw2")
+
+    def __init__(self, nbinsx, nbinsy, xrange, yrange):
+        Accumulator.__init__(self, (nbinsx, nbinsy), (xrange, yrange))
+
+    def _args(self):
+        return self.nbins + self.ranges
+
+    def fill(self, x, y, weights=None):
+        x = np.asarray(x)
+        self.entries += x.size
+        counts, _, _ = np.histogram2d(x, y, self.nbins, self.ranges,
+                                      weights=weights)
+        self.counts += counts
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            counts, _, _ = np.histogram2d(x, y, self.nbins, self.ranges,
+                                          weights=weights * weights)
+        self.sumw2 += counts
+
+    def _merge(self, other):
+        self.counts += other.counts
+        self.sumw2 += other.sumw2
+
+    @property
+    def x(self):
+        return self.centers[0]
+
+    @property
+    def y(self):
+        return self.centers[1]
+
+    @property
+    def errors(self):
+        return np.sqrt(self.sumw2)
+
+    def projection(self, axis=0):
+        """
+        Histogram1D of the x (axis=0) or y (axis=1) variable.
+        """
+        histogram = Histogram1D(self.nbins[axis], self.ranges[axis])
+        histogram.entries = self.entries
+        histogram.counts = self.counts.sum(axis=1 - axis)
+        histogram.sumw2 = self.sumw2.sum(axis=1 - axis)
+        return histogram
+
+
+class Profile(Accumulator):
+    """
+    Number of entries, mean and sum of squared deviations of a variable in
+    the bins of one or two others.
+    """
+    fields = ("count", "mean", "m2")
+    attributes = ("vrange",)
+
+    def __init__(self, nbins, ranges, vrange):
+        Accumulator.__init__(self, nbins, ranges)
+        self.mean[:] = np.nan
+        self.vrange = ((-np.inf, np.inf) if vrange is None else
+                       tuple(float(v) for v in vrange))
+
+    def _fill(self, coordinates, values):
+        values = np.asarray(values)
+        self.entries += values.size
+        selection = fitf.in_range(values, *self.vrange)
+        for data, (lo, hi) in zip(coordinates, self.ranges):
+            selection &= fitf.in_range(np.asarray(data), lo, hi)
+        bins = None
+        for data, edges, n in zip(coordinates, self.edges, self.nbins):
+            axis = fitf.bin_indices(np.asarray(data)[selection], edges)
+            if bins is None:
+                bins = axis
+                continue
+            # every combination of the bins of each value in each axis
+            outside = (bins[:, np.newaxis] < 0) | (axis[np.newaxis] < 0)
+            bins = bins[:, np.newaxis] * n + axis[np.newaxis]
+            bins[outside] = -1
+        count, mean, m2 = fitf.binned_moments(bins, values[selection],
+                                               int(np.prod(self.nbins)))
+        self._combine(count.reshape(self.nbins), mean.reshape(self.nbins),
+                      m2.reshape(self.nbins))
+
+    def _combine(self, count, mean, m2):
+        """
+        Add the moments of another set of values.
+        """
+        total = self.count + count
+        both = (self.count > 0) & (count > 0)
+        only_new = (self.count == 0) & (count > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = mean - self.mean
+            both_mean = self.mean + delta * count / total
+            both_m2 = self.m2 + m2 + delta * delta * self.count * count / total
+        self.mean = np.where(both, both_mean,
+                             np.where(only_new, mean, self.mean))
+        self.m2 = np.where(both, both_m2, np.where(only_new, m2, self.m2))
+        self.count = total
+
+    def _merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+
+    @property
+    def errors(self):
+        """
+        Error of the mean of each bin (nan for empty bins).
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(self.m2 / self.count) / self.count**0.5
+
+
+class Profile1D(Profile):
+    """
+    Average of a variable y in bins of x.
+
+    Parameters
+    ----------
+    nbins : int
+        Number of bins.
+    xrange : (min, max) tuple
+        Range of x.
+    yrange : (min, max) tuple, optional
+        Values of y outside this range are ignored. Default is no limit.
+
+    Attributes
+    ----------
+    count, mean, m2 : np.ndarray
+        Number of entries, mean and sum of squared deviations from the mean
+        of y in each bin.
+    """
+
+    def __init__(self, nbins, xrange, yrange=None):
+        Profile.__init__(self, (nbins,), (xrange,), yrange)
+
+    def _args(self):
+        return self.nbins[0], self.ranges[0], self.vrange
+
+    def fill(self, x, y):
+        self._fill((x,), y)
+
+    @property
+    def x(self):
+        return self.centers[0]
+
+    def profile(self, drop_nan=True):
+        """
+        Bin centers, means and errors of the means, as given by
+        fitFunctions.profileX.
+        """
+        x_out, y_out, y_err = self.x, self.mean.copy(), self.errors
+        if drop_nan:
+            selection = ~(np.isnan(y_out) | np.isnan(y_err))
+            x_out = x_out[selection]
+            y_out = y_out[selection]
+            y_err = y_err[selection]
+        return x_out, y_out, y_err
+
+    def fit(self, func, seed=(), **kwargs):
+        """
+        Fit the means of the bins with more than one entry with
+        fitFunctions.fit, weighted with their errors.
+        """
+        filled = self.count > 1
+        kwargs.setdefault("sigma", self.errors[filled])
+        return fitf.fit(func, self.x[filled], self.mean[filled], seed,
+                        **kwargs)
+
+
+class Profile2D(Profile):
+    """
+    Average of a variable z in bins of x and y.
+
+    Parameters
+    ----------
+    nbinsx, nbinsy : int
+        Number of bins in each axis.
+    xrange, yrange : (min, max) tuples
+        Range of each axis.
+    zrange : (min, max) tuple, optional
+        Values of z outside this range are ignored. Default is no limit.
+
+    Attributes
+    ----------
+    count, mean, m2 : np.ndarray
+        (nbinsx, nbinsy) number of entries, mean and sum of squared
+        deviations from the mean of z in each bin.
+    """
+
+    def __init__(self, nbinsx, nbinsy, xrange, yrange, zrange=None):
+        Profile.__init__(self, (nbinsx, nbinsy), (xrange, yrange), zrange)
+
+    def _args(self):
+        return self.nbins + self.ranges + (self.vrange,)
+
+    def fill(self, x, y, z):
+        self._fill((x, y), z)
+
+    @property
+    def x(self):
+        return self.centers[0]
+
+    @property
+    def y(self):
+        return self.centers[1]
+
+    def profile(self):
+        """
+        Bin centers, means and errors of the means, with zeros for the
+        empty bins, as given by fitFunctions.profileXY.
+        """
+        z_out, z_err = self.mean.copy(), self.errors
+        empty = self.count == 0
+        z_out[empty] = 0.
+        z_err[empty] = 0.
+        return self.x, self.y, z_out, z_err
+
+
+KINDS = dict((cls.__name__, cls)
+             for cls in (Histogram1D, Histogram2D, Profile1D, Profile2D))
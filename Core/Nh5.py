@@ -112,3 +112,40 @@ class PMAP(tb.IsDescription):
     ToT = tb.UInt16Col(pos=4)
     cathode = tb.Float32Col(pos=5)
     anode = tb.Float32Col(pos=6, shape=(1792,))
+
+
+class PMAP_DST(tb.IsDescription):
+    """
+    Per-event summary of a PMap. The S1 and S2 quantities refer to the
+    peak with the largest cathode integral of each type. Missing values
+    are set to -1 (positions to 1e4, as in snsFunctions.baricenter).
+    """
+    event = tb.Int32Col(pos=0)
+    nS1 = tb.UInt16Col(pos=1)
+    nS2 = tb.UInt16Col(pos=2)
+    S1e = tb.Float32Col(pos=3)  # cathode integral (pes)
+    S1w = tb.Float32Col(pos=4)  # width (mus)
+    S1h = tb.Float32Col(pos=5)  # height (pes)
+    S1t = tb.Float32Col(pos=6)  # peak time (mus)
+    S2e = tb.Float32Col(pos=7)
+    S2w = tb.Float32Col(pos=8)
+    S2h = tb.Float32Col(pos=9)
+    S2t = tb.Float32Col(pos=10)
+    S2q = tb.Float32Col(pos=11)  # anode integral (pes)
+    DT = tb.Float32Col(pos=12)  # drift time S2t - S1t (mus)
+    X = tb.Float32Col(pos=13)  # SiPM baricenter of S2 (mm)
+    Y = tb.Float32Col(pos=14)
+
+
+class EVENT_CATALOG(tb.IsDescription):
+    """
+    One row per event (in file order) with the range of rows [start, stop)
+    it occupies in each variable-length table. Empty ranges mean no data.
+    """
+    event = tb.Int32Col(pos=0)
+    timestamp = tb.UInt64Col(pos=1)
+    twf_pmt = tb.Int64Col(shape=2, pos=2)  # /TWF/PMT
+    twf_sipm = tb.Int64Col(shape=2, pos=3)  # /TWF/SiPM
+    pmaps = tb.Int64Col(shape=2, pos=4)  # /PMAPS/PMaps
+    pmaps_blr = tb.Int64Col(shape=2, pos=5)  # /PMAPS/PMapsBLR
+    dst = tb.Int64Col(shape=2, pos=6)  # /DST/Events
@@ -0,0 +1,122 @@
+"""
+Write-behind output for the cities.
+
+A Writer runs write tasks (appending the arrays of a batch, filling table
+rows, checkpointing) in order in a background thread, so that the event
+loop can go on with the next batch while the previous one is compressed
+and written. Tasks wait in a bounded queue: when it is full, submit blocks
+until the writer catches up. HDF5 calls of the two threads are serialized
+through a lock shared with the readers.
+"""
+from __future__ import print_function
+
+import threading
+import traceback
+from time import time
+try:
+    from queue import Queue
+except ImportError:  # python 2
+    from Queue import Queue
+try:
+    from time import thread_time
+except ImportError:  # python < 3.7
+    thread_time = None
+
+from Core.LogConfig import logger
+
+
+class Writer(object):
+    """
+    Ordered execution of write tasks in a background thread.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Number of tasks that may be waiting to be written. If 0 the tasks
+        run in the calling thread when submitted. Default is 2.
+    lock : threading.Lock, optional
+        Lock held while running each task. Readers of the same files (or of
+        any file, since HDF5 is not thread-safe) must hold it too.
+
+    Attributes
+    ----------
+    wall, cpu : floats
+        Time spent running the tasks (CPU time is that of the writer
+        thread where it can be measured, wall time otherwise).
+    """
+    def __init__(self, maxsize=2, lock=None):
+        self.lock = lock if lock is not None else threading.Lock()
+        self.wall = 0.
+        self.cpu = 0.
+        self.error = None
+        self.traceback = None
+        self.reported = False
+        self.queue = None
+        if maxsize > 0:
+            self.queue = Queue(maxsize)
+            self.thread = threading.Thread(target=self._run, name="writer")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _execute(self, function, args):
+        t0 = time()
+        c0 = thread_time() if thread_time else None
+        with self.lock:
+            function(*args)
+        self.wall += time() - t0
+        self.cpu += thread_time() - c0 if thread_time else time() - t0
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                # After an error nothing else is written, so that the output
+                # is not left with a gap
+                if self.error is None:
+                    self._execute(*task)
+            except Exception as error:
+                self.traceback = traceback.format_exc()
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """
+        Raise in the calling thread the error of a failed task, if any.
+        """
+        if self.error is not None and not self.reported:
+            self.reported = True
+            logger.error("Error in the writer thread:\n" + self.traceback)
+            raise self.error
+
+    def submit(self, function, *args):
+        """
+        Queue function(*args) for execution. The arguments must not be
+        modified afterwards.
+        """
+        self.check()
+        if self.queue is None:
+            self._execute(function, args)
+        else:
+            self.queue.put((function, args))
+
+    def flush(self):
+        """
+        Wait until all the submitted tasks have run.
+        """
+        if self.queue is not None:
+            self.queue.join()
+        self.check()
+
+    def close(self, check=True):
+        """
+        Run the pending tasks and stop the thread. With check=False errors
+        are not raised (e.g. when closing after an exception).
+        """
+        if self.queue is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if check:
+            self.check()
@@ -28,7 +28,7 @@ def dict_map(func, dic):
     mapdic : dictionary
         Contains key: func(value) for each key, value pair in dic.
     """
-    return {key: func(val) for key, val in dic.iteritems()}
+    return {key: func(val) for key, val in dic.items()}
 
 
 def df_map(func, df, field):
@@ -71,7 +71,7 @@ def dict_filter(cond, dic):
     filterdic : dictionary
         Contains the key, value pairs in dic satisfying cond.
     """
-    return {key: val for key, val in dic.iteritems() if cond(val)}
+    return {key: val for key, val in dic.items() if cond(val)}
 
 
 def farray_from_string(sfl):
@@ -4,10 +4,13 @@ A set of functions for data fitting.
 GML November 2016
 """
 
-import inspect
 import numpy as np
 import scipy as sc
 import scipy.optimize as optim
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:  # python 2
+    from inspect import getargspec
 
 
 def in_range(data, minval=-np.inf, maxval=np.inf):
@@ -192,17 +195,123 @@ def fit(func, x, y, seed=(), **kwargs):
             str_fun += " {} ".format(token)
         else:
             f = get_from_name(token, globals(), locals())
-            end = start + len(inspect.getargspec(f).args) - 1
+            end = start + len(getargspec(f).args) - 1
             if start == end:
                 end = ""
             str_fun += token + "(x, *args[{}:{}])".format(start, end)
         start = end
-    exec("local['fit_fun'] = {}".format(str_fun)) in globals(), locals()
+    exec("local['fit_fun'] = {}".format(str_fun), globals(), local)
     fit_fun = local["fit_fun"]
     vals, cov = optim.curve_fit(fit_fun, x, y, seed, **kwargs)
     return lambda x: fit_fun(x, *vals), vals, get_errors(cov)
 
 
+def bin_indices(data, edges):
+    """
+    Find the bins a dataset falls in, in a single pass.
+
+    Bins are closed intervals [edges[i], edges[i+1]], as selected by
+    in_range, so that values lying on an inner edge belong to both bins.
+
+    Parameters
+    ----------
+    data : 1-dim np.ndarray
+        Data set.
+    edges : 1-dim np.ndarray
+        Equally spaced bin edges, as given by np.linspace.
+
+    Returns
+    -------
+    bins : 2-dim np.ndarray
+        (2, data.size) array of ints. The first row holds the bin of each
+        value and the second one the bin to the left for values on an edge.
+        Entries are -1 where there is no such bin. If all the edges are
+        equal, (nbins, data.size) array: the values in range are in every
+        bin.
+    """
+    nbins = len(edges) - 1
+    inside = in_range(data, edges[0], edges[-1])
+    width = edges[-1] - edges[0]
+    if width == 0:
+        return np.where(inside, np.arange(nbins)[:, np.newaxis], -1)
+    guess = np.where(inside, (data - edges[0]) * (nbins / width), 0.)
+    bins = np.clip(guess, 0, nbins - 1).astype(int)
+    # the guess can be one bin off for values next to an edge
+    bins -= data < edges[bins]
+    bins += (data >= edges[bins + 1]) & (bins < nbins - 1)
+    left = np.where((data == edges[bins]) & (bins > 0), bins - 1, -1)
+    bins[~inside] = -1
+    left[~inside] = -1
+    return np.stack((bins, left))
+
+
+def binned_moments(bins, values, nbins):
+    """
+    Compute the number of entries, mean and sum of squared deviations from
+    the mean of the values falling in each bin.
+
+    Parameters
+    ----------
+    bins : np.ndarray of ints
+        Bin of each value (-1 for none), as given by bin_indices.
+    values : np.ndarray
+        Values to average, broadcastable to the shape of bins.
+    nbins : int
+        Number of bins.
+
+    Returns
+    -------
+    count : 1-dim np.ndarray
+        Number of entries in each bin.
+    mean : 1-dim np.ndarray
+        Average of each bin (nan for empty bins).
+    m2 : 1-dim np.ndarray
+        Sum of the squared deviations from the average of each bin (0 for
+        empty bins).
+    """
+    values = np.broadcast_to(values, bins.shape)
+    selection = bins >= 0
+    bins, values = bins[selection], values[selection]
+    count = np.bincount(bins, minlength=nbins).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(bins, values, minlength=nbins) / count
+    # squared deviations rather than squares, to avoid the cancellations
+    # of sum(x**2) - n mean**2 for large values
+    deviation = values - mean[bins]
+    m2 = np.bincount(bins, deviation * deviation, minlength=nbins)
+    return count, mean, m2
+
+
+def binned_stats(bins, values, nbins):
+    """
+    Compute the number of entries, mean and error of the mean of the
+    values falling in each bin.
+
+    Parameters
+    ----------
+    bins : np.ndarray of ints
+        Bin of each value (-1 for none), as given by bin_indices.
+    values : np.ndarray
+        Values to average, broadcastable to the shape of bins.
+    nbins : int
+        Number of bins.
+
+    Returns
+    -------
+    count : 1-dim np.ndarray
+        Number of entries in each bin.
+    mean : 1-dim np.ndarray
+        Average of each bin (nan for empty bins).
+    err : 1-dim np.ndarray
+        Standard deviation over the square root of the number of entries
+        (nan for empty bins).
+    """
+    count, mean, m2 = binned_moments(bins, values, nbins)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        err = np.sqrt(m2 / count) / count**0.5
+    return count, mean, err
+
+
 def profileX(xdata, ydata, nbins, xrange=None, yrange=None, drop_nan=True):
     """
     Compute the x-axis binned average of a dataset.
@@ -233,16 +342,11 @@ def profileX(xdata, ydata, nbins, xrange=None, yrange=None, drop_nan=True):
     ymin, ymax = (np.min(ydata), np.max(ydata)) if yrange is None else yrange
 
     x_out = np.linspace(xmin, xmax, nbins+1)
-    y_out = np.empty(nbins)
-    y_err = np.empty(nbins)
     dx = np.diff(x_out)[0]
 
     selection = in_range(xdata, xmin, xmax) & in_range(ydata, ymin, ymax)
     xdata, ydata = xdata[selection], ydata[selection]
-    for i in range(nbins):
-        bin_data = np.extract(in_range(xdata, x_out[i], x_out[i+1]), ydata)
-        y_out[i] = np.mean(bin_data)
-        y_err[i] = np.std(bin_data) / bin_data.size**0.5
+    _, y_out, y_err = binned_stats(bin_indices(xdata, x_out), ydata, nbins)
     x_out += dx / 2.
     x_out = x_out[:-1]
     if drop_nan:
@@ -283,16 +387,11 @@ def profileY(xdata, ydata, nbins, yrange=None, xrange=None, drop_nan=True):
     ymin, ymax = (np.min(ydata), np.max(ydata)) if yrange is None else yrange
 
     x_out = np.linspace(ymin, ymax, nbins+1)
-    y_out = np.empty(nbins)
-    y_err = np.empty(nbins)
     dx = np.diff(x_out)[0]
 
     selection = in_range(xdata, xmin, xmax) & in_range(ydata, ymin, ymax)
     xdata, ydata = xdata[selection], ydata[selection]
-    for i in range(nbins):
-        bin_data = np.extract(in_range(ydata, x_out[i], x_out[i+1]), xdata)
-        y_out[i] = np.mean(bin_data)
-        y_err[i] = np.std(bin_data) / bin_data.size**0.5
+    _, y_out, y_err = binned_stats(bin_indices(ydata, x_out), xdata, nbins)
     x_out += dx / 2.
     x_out = x_out[:-1]
     if drop_nan:
@@ -340,8 +439,6 @@ def profileXY(xdata, ydata, zdata, nbinsx, nbinsy,
 
     x_out = np.linspace(xmin, xmax, nbinsx+1)
     y_out = np.linspace(ymin, ymax, nbinsy+1)
-    z_out = np.empty((nbinsx, nbinsy))
-    z_err = np.empty((nbinsx, nbinsy))
     dx = np.diff(x_out)[0]
     dy = np.diff(y_out)[0]
 
@@ -349,13 +446,16 @@ def profileXY(xdata, ydata, zdata, nbinsx, nbinsy,
                  in_range(ydata, ymin, ymax) &
                  in_range(zdata, zmin, zmax))
     xdata, ydata, zdata = xdata[selection], ydata[selection], zdata[selection]
-    for i in range(nbinsx):
-        for j in range(nbinsy):
-            selection = (in_range(xdata, x_out[i], x_out[i+1]) &
-                         in_range(ydata, y_out[j], y_out[j+1]))
-            bin_data = np.extract(selection, zdata)
-            z_out[i,j] = np.nanmean(bin_data) if bin_data.size else 0.
-            z_err[i,j] = np.nanstd(bin_data) / bin_data.size**0.5 if bin_data.size else 0.
+    xbins = bin_indices(xdata, x_out)
+    ybins = bin_indices(ydata, y_out)
+    # every combination of the x and y bins of each value
+    bins = xbins[:, np.newaxis] * nbinsy + ybins[np.newaxis, :]
+    bins[(xbins[:, np.newaxis] < 0) | (ybins[np.newaxis, :] < 0)] = -1
+    count, z_out, z_err = binned_stats(bins, zdata, nbinsx * nbinsy)
+    z_out[count == 0] = 0.
+    z_err[count == 0] = 0.
+    z_out = z_out.reshape(nbinsx, nbinsy)
+    z_err = z_err.reshape(nbinsx, nbinsy)
     x_out += dx / 2.
     y_out += dy / 2.
     x_out = x_out[:-1]
@@ -392,14 +492,11 @@ def projectionX(xdata, ydata, nbins, xrange=None, yrange=None):
     ymin, ymax = (np.min(ydata), np.max(ydata)) if yrange is None else yrange
 
     x_out = np.linspace(xmin, xmax, nbins+1)
-    y_out = np.empty(nbins)
     dx = np.diff(x_out)[0]
 
     selection = in_range(xdata, xmin, xmax) & in_range(ydata, ymin, ymax)
-    xdata, ydata = xdata[selection], ydata[selection]
-    for i in range(nbins):
-        bin_data = np.extract(in_range(xdata, x_out[i], x_out[i+1]), ydata)
-        y_out[i] = bin_data.size
+    bins = bin_indices(xdata[selection], x_out)
+    y_out = np.bincount(bins[bins >= 0], minlength=nbins).astype(float)
     x_out += dx / 2.
     x_out = x_out[:-1]
     return x_out, y_out
@@ -431,14 +528,11 @@ def projectionY(xdata, ydata, nbins, yrange=None, xrange=None):
     ymin, ymax = (np.min(ydata), np.max(ydata)) if yrange is None else yrange
 
     x_out = np.linspace(ymin, ymax, nbins+1)
-    y_out = np.empty(nbins)
     dx = np.diff(x_out)[0]
 
     selection = in_range(xdata, xmin, xmax) & in_range(ydata, ymin, ymax)
-    xdata, ydata = xdata[selection], ydata[selection]
-    for i in range(nbins):
-        bin_data = np.extract(in_range(ydata, x_out[i], x_out[i+1]), xdata)
-        y_out[i] = bin_data.size
+    bins = bin_indices(ydata[selection], x_out)
+    y_out = np.bincount(bins[bins >= 0], minlength=nbins).astype(float)
     x_out += dx / 2.
     x_out = x_out[:-1]
     return x_out, y_out
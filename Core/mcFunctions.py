@@ -1,36 +1,203 @@
 """
 Monte Carlo Functions
 JJGC, September 2016
+
+ChangeLog
+MCTruth: the MCTracks table read once into columns indexed by event and
+track. get_mctrks and get_mchits accept it instead of the table.
 """
+import numpy as np
 import pandas as pd
 
 
+class MCTruth(object):
+    """
+    Columnar view of a MCTracks table (see Nh5.MCTrack), sorted by event
+    and track, with an index of the rows of each event and track. The
+    tracks and hits of an event are slices of the columns (no copy), so
+    that looking up N events costs O(N log rows) instead of N table scans.
+
+    Parameters
+    ----------
+    table : tb.Table or Chain.ChainTable
+        The MCTracks table. The tables of a chain are read file by file and
+        their event numbers made global.
+    chunksize : int, optional
+        Number of rows read at a time. Default is 100000.
+
+    Attributes
+    ----------
+    columns : dictionary
+        Column name: np.ndarray, one entry per row (hit).
+    tracks_columns : dictionary
+        Column name: np.ndarray, one entry per track (its first hit, as
+        flagged by hit_indx == 0).
+    events : 1-dim np.ndarray
+        Event numbers with MC truth, in increasing order.
+    """
+
+    def __init__(self, table, chunksize=100000):
+        nodes = table.nodes() if hasattr(table, "nodes") else [(0, table)]
+        blocks, events = [], []
+        for i, (offset, node) in enumerate(nodes):
+            if i == 0:
+                self.description = node.description
+                self.title = node.title
+                self.filters = node.filters
+                self.dtype = node.dtype
+            for start in range(0, node.nrows, chunksize):
+                blocks.append(node.read(start, min(start + chunksize,
+                                                   node.nrows)))
+                events.append(blocks[-1]["event_indx"].astype(np.int64) +
+                              offset)
+        if blocks:
+            data, events = np.concatenate(blocks), np.concatenate(events)
+        else:
+            data, events = (np.empty(0, dtype=self.dtype),
+                            np.empty(0, dtype=np.int64))
+
+        tracks = data["mctrk_indx"].astype(np.int64)
+        self.track_base = int(tracks.max()) + 1 if tracks.size else 1
+        keys = events * self.track_base + tracks
+        order = None
+        if np.any(np.diff(keys) < 0):
+            # stable, so the hits of a track keep their order
+            order = np.argsort(keys, kind="mergesort")
+            keys = keys[order]
+        self.columns = {}
+        for name in data.dtype.names:
+            column = data[name] if order is None else data[name][order]
+            self.columns[name] = np.ascontiguousarray(column)
+        self.columns["event_indx"] = np.ascontiguousarray(
+            events if order is None else events[order])
+        self.keys = keys
+
+        first_hits = np.flatnonzero(self.columns["hit_indx"] == 0)
+        self.tracks_columns = {name: column[first_hits]
+                               for name, column in self.columns.items()}
+        self.events = np.unique(self.columns["event_indx"])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, event_number):
+        start, stop = self.event_rows(event_number)
+        return stop > start
+
+    def event_rows(self, event_number):
+        """
+        Range of rows [start, stop) of the hits of an event.
+        """
+        events = self.columns["event_indx"]
+        return (int(np.searchsorted(events, event_number, "left")),
+                int(np.searchsorted(events, event_number, "right")))
+
+    def track_rows(self, event_number, particle_number):
+        """
+        Range of rows [start, stop) of the hits of a track.
+        """
+        if not 0 <= particle_number < self.track_base:
+            return 0, 0
+        key = event_number * self.track_base + particle_number
+        return (int(np.searchsorted(self.keys, key, "left")),
+                int(np.searchsorted(self.keys, key, "right")))
+
+    def tracks(self, event_number=0):
+        """
+        Tracks of an event: column name: slice of tracks_columns.
+        """
+        start, stop = np.searchsorted(self.tracks_columns["event_indx"],
+                                      (event_number, event_number + 1))
+        return {name: column[start:stop]
+                for name, column in self.tracks_columns.items()}
+
+    def hits(self, event_number=0, particle_number=0):
+        """
+        Hits of a track in an event: column name: slice of columns.
+        """
+        start, stop = self.track_rows(event_number, particle_number)
+        return {name: column[start:stop]
+                for name, column in self.columns.items()}
+
+    def copy(self, newparent, events=None, newname="MCTracks", filters=None,
+             chunksize=100000):
+        """
+        Write the rows of some events in a new table with the layout of the
+        original one, sorted by event and track.
+
+        Parameters
+        ----------
+        newparent : tb.Group
+            Where the table is created.
+        events : sequence of ints, optional
+            Event numbers to copy. All by default.
+        newname : string, optional
+            Name of the table. Default is MCTracks.
+        filters : tb.Filters, optional
+            Compression of the table. Default is that of the original one.
+        chunksize : int, optional
+            Number of rows written at a time. Default is 100000.
+
+        Returns
+        -------
+        table : tb.Table
+
+        Raises
+        ------
+        ValueError
+            If the (global) event numbers do not fit in the event_indx
+            column of the original layout.
+        """
+        h5out = newparent._v_file
+        if events is None:
+            ranges = [(0, len(self))]
+        else:
+            events = np.unique(np.asarray(events, dtype=np.int64))
+            column = self.columns["event_indx"]
+            starts = np.searchsorted(column, events, "left")
+            stops = np.searchsorted(column, events, "right")
+            starts, stops = starts[stops > starts], stops[stops > starts]
+            # the rows of consecutive events are written in one go
+            joined = np.flatnonzero(starts[1:] == stops[:-1])
+            ranges = list(zip(np.delete(starts, joined + 1),
+                              np.delete(stops, joined)))
+        if ranges and ranges[-1][1] > ranges[-1][0]:
+            last = self.columns["event_indx"][ranges[-1][1] - 1]
+            dtype = self.dtype["event_indx"]
+            if last > np.iinfo(dtype).max:
+                raise ValueError("Event {} does not fit in column event_indx"
+                                 " ({})".format(last, dtype))
+        table = h5out.create_table(newparent, newname, self.description,
+                                   self.title, filters or self.filters,
+                                   expectedrows=max(1, sum(b - a for a, b
+                                                           in ranges)))
+        for first, last in ranges:
+            for start in range(first, last, chunksize):
+                stop = min(start + chunksize, last)
+                rows = np.empty(stop - start, dtype=self.dtype)
+                for name in self.dtype.names:
+                    rows[name] = self.columns[name][start:stop]
+                table.append(rows)
+        table.flush()
+        return table
+
+
 def get_mctrks(mctrk, event_number=0):
     """
     Return all the mc trks in an event
+    Takes the pointer to the table or a MCTruth (to look at many events)
     """
+    if not isinstance(mctrk, MCTruth):
+        mctrk = MCTruth(mctrk)
+    tracks = mctrk.tracks(event_number)
+
     mcparticle = {}
-    mc_name = []
-    mc_pdg = []
-    mc_vxi = []
-    mc_vxf = []
-    mc_nhits = []
-    mc_energy = []
-    for row in mctrk.iterrows():
-        if row['hit_indx'] == 0 and row['event_indx'] == event_number:
-            mc_name.append(row['particle_name'])
-            mc_pdg.append(row['pdg_code'])
-            mc_vxi.append(row['initial_vertex'])
-            mc_vxf.append(row['final_vertex'])
-            mc_nhits.append(row['nof_hits'])
-            mc_energy.append(row['energy'])
-
-    mcparticle['name'] = mc_name
-    mcparticle['pdg'] = mc_pdg
-    mcparticle['vxi'] = mc_vxi
-    mcparticle['vxf'] = mc_vxf
-    mcparticle['nhits'] = mc_nhits
-    mcparticle['energy'] = mc_energy
+    mcparticle['name'] = tracks['particle_name']
+    mcparticle['pdg'] = tracks['pdg_code']
+    mcparticle['vxi'] = list(tracks['initial_vertex'])
+    mcparticle['vxf'] = list(tracks['final_vertex'])
+    mcparticle['nhits'] = tracks['nof_hits']
+    mcparticle['energy'] = tracks['energy']
 
     return pd.DataFrame(mcparticle)
 
@@ -38,28 +205,17 @@ def get_mctrks(mctrk, event_number=0):
 def get_mchits(mctrk, event_number=0, particle_number=0):
     """
     Return the mc hits of a mc particle in an event
-    Takes the pointer to the table (not to the mctrk data frame)
+    Takes the pointer to the table or a MCTruth (to look at many events)
     """
+    if not isinstance(mctrk, MCTruth):
+        mctrk = MCTruth(mctrk)
+    hits = mctrk.hits(event_number, particle_number)
+
     mchits = {}
-    hit_x = []
-    hit_y = []
-    hit_z = []
-    hit_time = []
-    hit_energy = []
-
-    for row in mctrk.iterrows():
-        if (row['mctrk_indx'] == particle_number and
-           row['event_indx'] == event_number):
-            hit_x.append(row['hit_position'][0])
-            hit_y.append(row['hit_position'][1])
-            hit_z.append(row['hit_position'][2])
-            hit_time.append(row['hit_time'])
-            hit_energy.append(row['hit_energy'])
-
-    mchits['x'] = hit_x
-    mchits['y'] = hit_y
-    mchits['z'] = hit_z
-    mchits['time'] = hit_time
-    mchits['energy'] = hit_energy
+    mchits['x'] = hits['hit_position'][:, 0]
+    mchits['y'] = hits['hit_position'][:, 1]
+    mchits['z'] = hits['hit_position'][:, 2]
+    mchits['time'] = hits['hit_time']
+    mchits['energy'] = hits['hit_energy']
 
     return pd.DataFrame(mchits)
@@ -5,12 +5,10 @@ from __future__ import print_function
 
 import math
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
-import matplotlib.animation
 from matplotlib.patches import Circle
 from matplotlib.collections import PatchCollection
-from mpl_toolkits.mplot3d import Axes3D
-from IPython.display import HTML
 
 import Core.coreFunctions as cf
 import Core.system_of_units as units
@@ -459,6 +457,7 @@ def plot_track(geom_df, mchits_df, vox_size=10, zoom=False):
         emin = np.min(varr_c)
 
     # Plot the 3D voxelized track.
+    from mpl_toolkits.mplot3d import Axes3D  # registers the 3d projection
     fig = plt.figure(1)
     fig.set_figheight(6.)
     fig.set_figwidth(8.)
@@ -599,10 +598,63 @@ def plot_track_projections(geom_df, mchits_df, vox_size=10, zoom=False):
     plt.show()
 
 
-def make_movie(slices, sipmdf, thrs=0.1):
+def slice_selections(slices, thrs=0.1):
+    """
+    Select the SiPMs above a relative cut in every slice at once.
+
+    Parameters
+    ----------
+    slices : 2-dim np.ndarray
+        The signal of each SiPM (axis 1) for each time sample (axis 0).
+    thrs : float, optional
+        Fraction of the maximum of each slice a SiPM must exceed.
+        Defaults to 0.1.
+
+    Returns
+    -------
+    selections : 2-dim np.ndarray of bools
+        Whether each SiPM (axis 1) passes the cut in each slice (axis 0).
+    """
+    slices = np.asarray(slices, dtype=float)
+    with np.errstate(invalid="ignore"):
+        maxima = np.max(np.where(np.isnan(slices), -np.inf, slices), axis=1)
+        return slices > maxima[:, np.newaxis] * thrs
+
+
+def _anode_frames(fig, ax, slices, X, Y, thrs):
+    """
+    Create the artists of a movie of the tracking plane once and return
+    the function updating them to show a given slice.
+    """
+    ax.set_xlabel("x (mm)")
+    ax.set_ylabel("y (mm)")
+    ax.set_xlim((np.nanmin(X), np.nanmax(X)))
+    ax.set_ylim((np.nanmin(Y), np.nanmax(Y)))
+    vmax = np.nanmax(slices) if np.isfinite(slices).any() else 0.
+    if not vmax > 0:
+        # no signal in the event: any color scale will do
+        vmax = 1.
+    scplot = ax.scatter([], [], c=[], marker="s", vmin=0, vmax=vmax)
+    cbar = fig.colorbar(scplot, ax=ax,
+                        boundaries=np.linspace(0, vmax, 100))
+    cbar.set_label("Charge (pes)")
+
+    XY = np.column_stack((X, Y))
+    selections = slice_selections(slices, thrs)
+
+    def show(i):
+        selection = selections[i]
+        scplot.set_offsets(XY[selection])
+        scplot.set_array(slices[i][selection])
+        return (scplot,)
+    return show
+
+
+def make_movie(slices, sipmdf, thrs=0.1, interval=200):
     """
     Create a video made of consecutive frames showing the response of the
-    tracking plane.
+    tracking plane. The figure is drawn once and each frame only updates
+    the positions and colors of the SiPMs above the cut (with blitting).
 
     Parameters
     ----------
@@ -612,50 +664,95 @@ def make_movie(slices, sipmdf, thrs=0.1):
         Contains the sensors information.
     thrs : float, optional
         Default cut value to be applied to each slice. Defaults to 0.1.
+    interval : int, optional
+        Time between frames in ms. Defaults to 200.
 
     Returns
     -------
     mov : matplotlib.animation
         The movie.
     """
+    import matplotlib.animation
 
     fig, ax = plt.subplots()
     fig.set_size_inches(10, 8)
-    X, Y = sipmdf["X"].values, sipmdf["Y"].values
-    xmin, xmax = np.nanmin(X), np.nanmax(X)
-    ymin, ymax = np.nanmin(Y), np.nanmax(Y)
-    def init():
-        global cbar, scplot
-        ax.set_xlabel("x (mm)")
-        ax.set_ylabel("y (mm)")
-        ax.set_xlim((xmin, xmax))
-        ax.set_ylim((ymin, ymax))
-        scplot = ax.scatter([], [], c=[])
-        cbar = fig.colorbar(scplot, ax=ax)
-        cbar.set_label("Charge (pes)")
-        return (scplot,)
+    slices = np.asarray(slices, dtype=float)
+    show = _anode_frames(fig, ax, slices, sipmdf["X"].values,
+                         sipmdf["Y"].values, thrs)
+
+    anim = matplotlib.animation.FuncAnimation(fig, show,
+                                              init_func=lambda: show(0),
+                                              frames=len(slices),
+                                              interval=interval, blit=True)
+    return anim
 
-    def animate(i):
-        global cbar, scplot
-        slice_ = slices[i]
-        selection = slice_ > np.nanmax(slice_) * thrs
-        x, y, q = X[selection], Y[selection], slice_[selection]
-        cbar.remove()
-        fig.clear()
-        ax = plt.gca()
-        ax.set_xlabel("x (mm)")
-        ax.set_ylabel("y (mm)")
-        ax.set_xlim((xmin, xmax))
-        ax.set_ylim((ymin, ymax))
-        scplot = ax.scatter(x, y, c=q, marker="s", vmin=0, vmax=np.nanmax(slices))
-        cbar = fig.colorbar(scplot, ax=ax, boundaries=np.linspace(0,np.nanmax(slices),100))
-        cbar.set_label("Charge (pes)")
-        return (scplot,)
 
-    anim = matplotlib.animation.FuncAnimation(fig, animate, init_func=init,
-                                              frames=len(slices), interval=200,
-                                              blit=False)
-    return anim
+def save_movie_frames(events, sipmdf, directory, thrs=0.1, njobs=1,
+                      fmt="png", dpi=None):
+    """
+    Render the tracking plane movies of many events offline, one image
+    file per frame, in njobs processes. The frames of an event are named
+    event<number>_<frame>.<fmt>.
+
+    Parameters
+    ----------
+    events : dictionary or sequence of (event number, slices) pairs
+        The slices of each event, as taken by make_movie.
+    sipmdf : pd.DataFrame
+        Contains the sensors information.
+    directory : string
+        Where the images are written.
+    thrs : float, optional
+        Default cut value to be applied to each slice. Defaults to 0.1.
+    njobs : int, optional
+        Number of processes rendering events. Defaults to 1.
+    fmt : string, optional
+        Image format. Defaults to "png".
+    dpi : int, optional
+        Resolution of the images. Default is that of matplotlib.
+
+    Returns
+    -------
+    filenames : list of lists of strings
+        The frames written for each event, in order.
+    """
+    if isinstance(events, dict):
+        events = sorted(events.items())
+    X, Y = sipmdf["X"].values, sipmdf["Y"].values
+    jobs = [(evt, slices, X, Y, directory, thrs, fmt, dpi)
+            for evt, slices in events]
+    if njobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(njobs)
+        try:
+            return pool.map(_save_event_frames, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return [_save_event_frames(job) for job in jobs]
+
+
+def _save_event_frames(args):
+    """
+    Render the frames of one event without pyplot, so that it can run in a
+    worker process with any (or no) display.
+    """
+    import os
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    evt, slices, X, Y, directory, thrs, fmt, dpi = args
+    fig = Figure(figsize=(10, 8))
+    FigureCanvasAgg(fig)
+    show = _anode_frames(fig, fig.add_subplot(111),
+                         np.asarray(slices, dtype=float), X, Y, thrs)
+    filenames = []
+    for i in range(len(slices)):
+        show(i)
+        filenames.append(os.path.join(directory, "event{}_{:04d}.{}".format(
+                                      evt, i, fmt)))
+        fig.savefig(filenames[-1], dpi=dpi)
+    return filenames
 
 
 def plot_event_3D(pmap, sipmdf, outputfile=None, thrs=0.):
@@ -675,19 +772,23 @@ def plot_event_3D(pmap, sipmdf, outputfile=None, thrs=0.):
     thrs : float, optional
         Relative cut to be applied per slice. Defaults to 0.
     """
+    from mpl_toolkits.mplot3d import Axes3D  # registers the 3d projection
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
 
-    x, y, z, q = [], [], [], []
-    for peak in pmap.get("S2"):
-        for time, sl in zip(peak.times, peak.anode):
-            selection = sl > thrs * np.nanmax(sl)
-            x.extend(sipmdf["X"].values[selection])
-            y.extend(sipmdf["Y"].values[selection])
-            z.extend(np.ones_like(sl[selection])*time)
-            q.extend(sl[selection])
-
-    ax.scatter(x, z, y, c=q, s=[2*qi for qi in q], alpha=0.3)
+    peaks = list(pmap.get("S2"))
+    if peaks:
+        anode = np.concatenate([peak.anode for peak in peaks])
+        times = np.concatenate([peak.times for peak in peaks])
+    else:
+        anode, times = np.empty((0, len(sipmdf))), np.empty(0)
+    slices, sipms = np.nonzero(slice_selections(anode, thrs))
+    x = sipmdf["X"].values[sipms]
+    y = sipmdf["Y"].values[sipms]
+    z = times[slices]
+    q = anode[slices, sipms]
+
+    ax.scatter(x, z, y, c=q, s=2*q, alpha=0.3)
     ax.set_xlabel("x (mm)")
     ax.set_ylabel("z (mm)")
     ax.set_zlabel("y (mm)")
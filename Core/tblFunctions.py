@@ -19,8 +19,25 @@ import pandas as pd
 
 import Core.wfmFunctions as wfm
 import Core.Bridges as bdg
-import Database.loadDB as DB
-import Sierpe.FEE as FE
+import Core.wfEncoding as enc
+from Core.Nh5 import EVENT_CATALOG
+
+
+# Compression presets: name -> keyword arguments of tb.Filters
+FILTERS = {"NOCOMPR": dict(complevel=0),
+           "ZLIB1": dict(complevel=1, complib="zlib"),
+           "ZLIB4": dict(complevel=4, complib="zlib"),
+           "ZLIB5": dict(complevel=5, complib="zlib"),
+           "ZLIB9": dict(complevel=9, complib="zlib"),
+           "BLOSC5": dict(complevel=5, complib="blosc"),
+           "BLZ4HC5": dict(complevel=5, complib="blosc:lz4hc"),
+           "BLZ45": dict(complevel=5, complib="blosc:lz4"),
+           "BZSTD1": dict(complevel=1, complib="blosc:zstd"),
+           "BZSTD5": dict(complevel=5, complib="blosc:zstd"),
+           "BZSTD1BIT": dict(complevel=1, complib="blosc:zstd",
+                             shuffle=False, bitshuffle=True),
+           "BZSTD5BIT": dict(complevel=5, complib="blosc:zstd",
+                             shuffle=False, bitshuffle=True)}
 
 
 def filters(name):
@@ -35,33 +52,28 @@ def filters(name):
         - ZLIB(1,4,5,9): ZLIB library with compression level (1,4,5,9)
         - BLOSC(5): BLOSC library with compresion level 5
         - BLZ4HC(5): BLOSC library with codec lz4hc and compression level 5
+        - BLZ4(5): BLOSC library with codec lz4 and compression level 5
+        - BZSTD(1,5): BLOSC library with codec zstd and compression level
+          (1,5)
+        - BZSTD(1,5)BIT: as BZSTD(1,5) with bit (instead of byte) shuffle
+        Benchmarks/compression.py measures them on sample data.
 
     Returns
     -------
     filt : tb.filters.Filter
         Filter mode instance.
     """
-    if name == "NOCOMPR":
-        return tb.Filters(complevel=0)  # no compression
-    if name == "ZLIB1":
-        return tb.Filters(complevel=1, complib="zlib")
-    if name == "ZLIB4":
-        return tb.Filters(complevel=4, complib="zlib")
-    if name == "ZLIB5":
-        return tb.Filters(complevel=5, complib="zlib")
-    if name == "ZLIB9":
-        return tb.Filters(complevel=9, complib="zlib")
-    if name == "BLOSC5":
-        return tb.Filters(complevel=5, complib="blosc")
-    if name == "BLZ4HC5":
-        return tb.Filters(complevel=5, complib="blosc:lz4hc")
-    raise ValueError("Compression option {} not found.".format(name))
+    if name not in FILTERS:
+        raise ValueError("Compression option {} not found.".format(name))
+    return tb.Filters(**FILTERS[name])
 
 
 def store_FEE_table(fee_table):
     """
     Stores the parameters of the EP FEE simulation
     """
+    import Database.loadDB as DB
+    import Sierpe.FEE as FE
     DataPMT = DB.DataPMT()
     row = fee_table.row
     row["OFFSET"] = FE.OFFSET
@@ -154,9 +166,9 @@ def get_vectors(h5f):
     """
     pmttwf = h5f.root.TWF.PMT
     sipmtwf = h5f.root.TWF.SiPM
-    pmtrwf = h5f.root.RD.pmtrwf
-    pmtblr = h5f.root.RD.pmtblr
-    sipmrwf = h5f.root.RD.sipmrwf
+    pmtrwf = get_wf_array(h5f, "/RD/pmtrwf")
+    pmtblr = get_wf_array(h5f, "/RD/pmtblr")
+    sipmrwf = get_wf_array(h5f, "/RD/sipmrwf")
     return pmttwf, sipmtwf, pmtrwf, pmtblr, sipmrwf
 
 
@@ -179,11 +191,63 @@ def get_pmt_vectors(h5f):
         BLR array for PMTs
     """
     pmttwf = h5f.root.TWF.PMT
-    pmtrwf = h5f.root.RD.pmtrwf
-    pmtblr = h5f.root.RD.pmtblr
+    pmtrwf = get_wf_array(h5f, "/RD/pmtrwf")
+    pmtblr = get_wf_array(h5f, "/RD/pmtblr")
     return pmttwf, pmtrwf, pmtblr
 
 
+def create_wf_array(where, name, shape, expectedrows=None, filters=None,
+                    encoding=None):
+    """
+    Create an extensible array of Int16 waveforms.
+
+    Parameters
+    ----------
+    where : tb.Group
+        Parent group.
+    name : string
+        Name of the array.
+    shape : tuple
+        Shape of the waveforms of an event (nsensors, nsamples).
+    expectedrows : int, optional
+        Expected number of events.
+    filters : tb.Filters, optional
+        Compression filters.
+    encoding : string, optional
+        Store the waveforms as baselines plus Int8 deltas (see
+        Core.wfEncoding). Options are "baseline" and "diff". By default
+        they are stored as they are.
+
+    Returns
+    -------
+    array : tb.EArray or wfEncoding.EncodedArray
+    """
+    if encoding:
+        return enc.create_encoded_array(where, name, shape, encoding,
+                                        expectedrows, filters)
+    kwargs = {"expectedrows": expectedrows} if expectedrows else {}
+    return where._v_file.create_earray(where, name, atom=tb.Int16Atom(),
+                                       shape=(0,) + tuple(shape),
+                                       filters=filters, **kwargs)
+
+
+def get_wf_array(h5f, path):
+    """
+    Return the node at path, decoding it on read if it is an encoded
+    waveform array (see create_wf_array).
+    """
+    return enc.decoded(h5f.get_node(path))
+
+
+def get_wf_encoding(h5f, path):
+    """
+    Return the encoding of the waveform array at path (see create_wf_array)
+    or None if it is stored as it is.
+    """
+    node = h5f.get_node(path)
+    return node.attrs.encoding if enc.is_encoded(node) else None
+
+
 def store_wf_table(event, table, wfdic, flush=True):
     """
     Stores a set of waveforms in a table.
@@ -200,7 +264,7 @@ def store_wf_table(event, table, wfdic, flush=True):
         Whether to flush the table or not.
     """
     row = table.row
-    for isens, wf in wfdic.iteritems():
+    for isens, wf in wfdic.items():
         for t, e in zip(wf.time_mus, wf.ene_pes):
             row["event"] = event
             row["ID"] = isens
@@ -211,7 +275,7 @@ def store_wf_table(event, table, wfdic, flush=True):
         table.flush()
 
 
-def read_sensor_wf(table, evt, isens):
+def read_sensor_wf(table, evt, isens, rows=None):
     """
     Reads back a particular waveform from a table.
 
@@ -223,6 +287,9 @@ def read_sensor_wf(table, evt, isens):
         Event number
     isens : int
         Sensor number
+    rows : pair of ints, optional
+        Range of rows [start, stop) of the event in the table, as given by
+        the event catalog. If given, the table is not searched.
 
     Returns
     -------
@@ -231,13 +298,17 @@ def read_sensor_wf(table, evt, isens):
     ene_pes : 1-dim np.ndarray
         Amplitudes of the waveform
     """
+    if rows is not None:
+        data = table.read(*rows)
+        data = data[data["ID"] == isens]
+        return data["time_mus"], data["ene_pes"]
     return (table.read_where("(event=={}) & (ID=={})".format(evt, isens),
                              field="time_mus"),
             table.read_where("(event=={}) & (ID=={})".format(evt, isens),
                              field="ene_pes"))
 
 
-def read_wf_table(table, event_number):
+def read_wf_table(table, event_number, rows=None):
     """
     Reads back a set of waveforms from a table.
 
@@ -247,12 +318,25 @@ def read_wf_table(table, event_number):
         Table in which waveforms are stored.
     event_number : int
         Event number
+    rows : pair of ints, optional
+        Range of rows [start, stop) of the event in the table, as given by
+        the event catalog. If given, the table is not searched.
 
     Returns
     -------
     wf_panel : pd.Panel
         pd.Panel with a pd.DataFrame for each sensor.
     """
+    if rows is not None:
+        data = table.read(*rows)
+
+        def get_df_rows(isens):
+            sensor = data[data["ID"] == isens]
+            return wfm.wf2df(sensor["time_mus"], sensor["ene_pes"])
+
+        return pd.Panel({isens: get_df_rows(isens)
+                         for isens in set(data["ID"])})
+
     sensor_list = set(table.read_where("event == {}".format(event_number),
                       field="ID"))
 
@@ -292,7 +376,15 @@ def store_pmap(pmap, table, evt, flush=True):
         table.flush()
 
 
-def read_pmap(table, evt):
+def _signal(value):
+    """
+    Peak type read from a table as a string (tables return bytes in
+    python 3), so it compares equal to the Bridges.Signal values.
+    """
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def read_pmap(table, evt, rows=None):
     """
     Reads back the pmap stored in table.
 
@@ -302,6 +394,9 @@ def read_pmap(table, evt):
         Table in which the pmap is stored.
     evt : int
         Event number
+    rows : pair of ints, optional
+        Range of rows [start, stop) of the event in the table, as given by
+        the event catalog. If given, the table is not searched.
 
     Returns
     -------
@@ -309,11 +404,19 @@ def read_pmap(table, evt):
         Full PMap instance with data from table.
     """
     pmap = bdg.PMap()
+    if rows is not None:
+        data = table.read(*rows)
+        for peak in sorted(set(data["peak"])):
+            pdata = data[data["peak"] == peak]
+            pmap.peaks.append(bdg.Peak(pdata["time"], pdata["cathode"],
+                                       pdata["anode"], pdata["ToT"],
+                                       _signal(pdata["signal"][0])))
+        return pmap
     peaks = set(table.read_where("event=={}".format(evt), field="peak"))
     for peak in peaks:
         coords = table.get_where_list("(event == {}) & "
                                       "(peak == {})".format(evt, peak))
-        signal = table[coords[0]]["signal"]
+        signal = _signal(table[coords[0]]["signal"])
         times = table.read_coordinates(coords, "time")
         ToT = table.read_coordinates(coords, "ToT")
         cathode = table.read_coordinates(coords, "cathode")
@@ -340,3 +443,223 @@ def get_nofevents(table, column_name="evt_number"):
         Number of events in table.
     """
     return len(set(table.read(field=column_name)))
+
+
+def store_dst(dst, table, evt, flush=True):
+    """
+    Stores a per-event summary in a table.
+
+    Parameters
+    ----------
+    dst : dictionary
+        Summary quantities. Keys must match the table column names
+        (except for event).
+    table : tb.Table
+        Table in which the summary will be stored.
+    evt : int
+        Event number
+    flush : bool
+        Whether to flush the table or not.
+    """
+    row = table.row
+    row["event"] = evt
+    for key, value in dst.items():
+        row[key] = value
+    row.append()
+    if flush:
+        table.flush()
+
+
+def read_dst(table):
+    """
+    Reads back a per-event summary table.
+
+    Parameters
+    ----------
+    table : tb.Table
+        Table in which the summaries are stored.
+
+    Returns
+    -------
+    dst : pd.DataFrame
+        One row per event and one column per quantity.
+    """
+    return pd.DataFrame.from_records(table.read())
+
+
+# Paths of the variable-length tables indexed by the event catalog
+CATALOG_TABLES = (("twf_pmt", "/TWF/PMT"),
+                  ("twf_sipm", "/TWF/SiPM"),
+                  ("pmaps", "/PMAPS/PMaps"),
+                  ("pmaps_blr", "/PMAPS/PMapsBLR"),
+                  ("dst", "/DST/Events"))
+
+# Paths of the arrays holding one entry per event along their first axis
+EVENT_ARRAYS = ("/pmtrd", "/sipmrd",
+                "/RD/pmtrwf", "/RD/pmtblr", "/RD/sipmrwf", "/RD/pmtcwf",
+                "/BLR/mau", "/BLR/pulse_on", "/BLR/wait_over",
+                "/ZS/PMT", "/ZS/BLR", "/ZS/SiPM")
+
+
+def get_nevents(h5f):
+    """
+    Find the number of events in a file without scanning its tables.
+
+    Parameters
+    ----------
+    h5f : tb.File
+        (Open) hdf5 file.
+
+    Returns
+    -------
+    nevt : int
+        Number of events in the file. The event catalog, the Run info and
+        the length of the event arrays (EVENT_ARRAYS) are looked up in this
+        order. As a last resort, the range of event numbers in the TWF or
+        PMaps tables is used.
+    """
+    for path in ("/Catalog/Events", "/Run/events"):
+        if path in h5f:
+            return h5f.get_node(path).nrows
+    for path in EVENT_ARRAYS:
+        if path in h5f:
+            return h5f.get_node(path).shape[0]
+    last = [h5f.get_node(path)[-1]["event"] + 1
+            for _, path in CATALOG_TABLES
+            if path in h5f and h5f.get_node(path).nrows]
+    return int(max(last)) - first_event(h5f) if last else 0
+
+
+def first_event(h5f):
+    """
+    Event number, as stored in the event tables, of the first event of a
+    file. The cities number the events of a file consecutively from it:
+    from 0, or from SKIP in the output of DIOMIRA. It is read from the
+    tables with rows for every event (true waveforms and DST), as the pmaps
+    of the first events may be empty.
+
+    Returns
+    -------
+    evt : int
+        Smallest event number in those tables, 0 if there are none.
+    """
+    first = [h5f.get_node(path)[0]["event"]
+             for path in ("/TWF/PMT", "/TWF/SiPM", "/DST/Events")
+             if path in h5f and h5f.get_node(path).nrows]
+    return int(min(first)) if first else 0
+
+
+def event_ranges(table, events, column_name="event"):
+    """
+    Find the rows occupied by each event in a table.
+
+    Parameters
+    ----------
+    table : tb.Table
+        Table whose rows are stored in increasing event number.
+    events : 1-dim np.ndarray
+        Event numbers (as stored in the table) to be looked up.
+    column_name : string, optional
+        Name of the column holding the event number. Default is "event".
+
+    Returns
+    -------
+    ranges : 2-dim np.ndarray
+        Range of rows [start, stop) (axis 1) for each event (axis 0).
+    """
+    column = table.read(field=column_name)
+    if np.any(np.diff(column) < 0):
+        raise ValueError("Table {} is not sorted by {}"
+                         "".format(table._v_pathname, column_name))
+    return np.column_stack((np.searchsorted(column, events, "left"),
+                            np.searchsorted(column, events, "right")))
+
+
+def build_catalog(h5f, events=None):
+    """
+    Write (or overwrite) the event catalog of a file.
+
+    Parameters
+    ----------
+    h5f : tb.File
+        (Open, writable) hdf5 file.
+    events : sequence of ints, optional
+        Event numbers, as stored in the tables, of each event in file order.
+        Default is get_nevents(h5f) consecutive numbers from first_event.
+
+    Returns
+    -------
+    catalog : tb.Table
+        The catalog table (/Catalog/Events).
+    """
+    if "/Catalog/Events" in h5f:
+        h5f.remove_node("/Catalog", "Events")
+    if events is None:
+        events = first_event(h5f) + np.arange(get_nevents(h5f))
+    events = np.asarray(events, dtype=np.int64)
+
+    if "/Catalog" not in h5f:
+        h5f.create_group(h5f.root, "Catalog")
+    catalog = h5f.create_table(h5f.root.Catalog, "Events", EVENT_CATALOG,
+                               "Row ranges of each event",
+                               filters("NOCOMPR"),
+                               expectedrows=max(events.size, 1))
+
+    data = np.zeros(events.size, dtype=catalog.dtype)
+    data["event"] = events
+    if "/Run/events" in h5f and h5f.root.Run.events.nrows == events.size:
+        data["event"] = h5f.root.Run.events.cols.evt_number[:]
+        data["timestamp"] = h5f.root.Run.events.cols.timestamp[:]
+    for name, path in CATALOG_TABLES:
+        if path in h5f:
+            data[name] = event_ranges(h5f.get_node(path), events)
+
+    catalog.append(data)
+    catalog.cols.event.create_index()
+    catalog.flush()
+    return catalog
+
+
+def read_catalog(h5f):
+    """
+    Read the event catalog of a file.
+
+    Parameters
+    ----------
+    h5f : tb.File
+        (Open) hdf5 file.
+
+    Returns
+    -------
+    catalog : np.ndarray or None
+        Structured array with one row per event (see Nh5.EVENT_CATALOG).
+        None if the file has no catalog.
+    """
+    if "/Catalog/Events" not in h5f:
+        return None
+    return h5f.root.Catalog.Events.read()
+
+
+def get_event_rows(h5f, name, evt):
+    """
+    Find the rows of an event in a variable-length table using the catalog.
+
+    Parameters
+    ----------
+    h5f : tb.File
+        (Open) hdf5 file.
+    name : string
+        Table key in CATALOG_TABLES (twf_pmt, twf_sipm, pmaps, pmaps_blr,
+        dst).
+    evt : int
+        Position of the event in the file.
+
+    Returns
+    -------
+    rows : pair of ints or None
+        Range of rows [start, stop). None if the file has no catalog.
+    """
+    if "/Catalog/Events" not in h5f:
+        return None
+    start, stop = h5f.root.Catalog.Events[evt][name]
+    return int(start), int(stop)
@@ -0,0 +1,234 @@
+"""
+Compact storage of raw waveforms.
+
+Raw waveforms sit on a baseline (FE.OFFSET = 2500 ADC counts for the PMTs)
+with a few counts of noise, so most of the bits of their Int16 samples are
+redundant. An encoded array stores instead, for each event and sensor, a
+baseline (the median of the waveform) and Int8 deltas, either:
+- "baseline": each sample minus the baseline, or
+- "diff": each sample minus the previous one (the first one minus the
+  baseline).
+Deltas out of the Int8 range (pulses) are replaced by ESCAPE and stored
+as (sensor, sample, delta) rows in a separate array, together with the
+cumulative number of escapes at the end of each event.
+
+The Int8 array keeps the path, shape and chunking of the original one and
+carries the encoding as an attribute; the rest lives in the group
+<name>_encoding next to it. EncodedArray decodes on read, so that code
+going through tblFunctions.get_wf_array sees an Int16 array either way.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+import tables as tb
+
+ENCODINGS = ("baseline", "diff")
+ESCAPE = -128
+
+
+def encode_wfs(wfs, encoding="diff"):
+    """
+    Encode a set of events.
+
+    Parameters
+    ----------
+    wfs : np.ndarray
+        (nevt, nsensors, nsamples) integer waveforms.
+    encoding : string, optional
+        One of ENCODINGS. Default is "diff".
+
+    Returns
+    -------
+    deltas : np.ndarray
+        (nevt, nsensors, nsamples) Int8 deltas.
+    baselines : np.ndarray
+        (nevt, nsensors) Int16 baselines.
+    escapes : np.ndarray
+        (nescapes, 3) Int32 array of sensor, sample and delta, in event
+        order.
+    counts : np.ndarray
+        Number of escapes of each event.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown waveform encoding {}".format(encoding))
+    wfs = np.asarray(wfs, dtype=np.int32)
+    baselines = np.round(np.median(wfs, axis=-1)).astype(np.int16)
+    deltas = wfs - baselines[..., np.newaxis]
+    if encoding == "diff":
+        deltas[..., 1:] = np.diff(wfs, axis=-1)
+
+    escaped = (deltas <= ESCAPE) | (deltas > 127)
+    events, sensors, samples = np.nonzero(escaped)
+    escapes = np.column_stack((sensors, samples,
+                               deltas[escaped])).astype(np.int32)
+    deltas[escaped] = ESCAPE
+    counts = np.bincount(events, minlength=len(wfs))
+    return deltas.astype(np.int8), baselines, escapes, counts
+
+
+def decode_wfs(deltas, baselines, escapes, counts, encoding="diff"):
+    """
+    Inverse of encode_wfs.
+
+    Returns
+    -------
+    wfs : np.ndarray
+        (nevt, nsensors, nsamples) Int16 waveforms.
+    """
+    values = deltas.astype(np.int32)
+    events = np.repeat(np.arange(len(values)), counts)
+    values[events, escapes[:, 0], escapes[:, 1]] = escapes[:, 2]
+    if encoding == "diff":
+        np.cumsum(values, axis=-1, out=values)
+    values += baselines[..., np.newaxis]
+    return values.astype(np.int16)
+
+
+def create_encoded_array(where, name, shape, encoding, expectedrows=None,
+                         filters=None):
+    """
+    Create an empty encoded array of events of the given shape (without
+    the event axis).
+
+    Returns
+    -------
+    array : EncodedArray
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown waveform encoding {}".format(encoding))
+    h5f = where._v_file
+    kwargs = {"filters": filters}
+    if expectedrows:
+        kwargs["expectedrows"] = expectedrows
+    node = h5f.create_earray(where, name, atom=tb.Int8Atom(),
+                             shape=(0,) + tuple(shape), **kwargs)
+    node.attrs.encoding = encoding
+    group = h5f.create_group(where, name + "_encoding")
+    h5f.create_earray(group, "baselines", atom=tb.Int16Atom(),
+                      shape=(0, shape[0]), **kwargs)
+    h5f.create_earray(group, "escapes", atom=tb.Int32Atom(), shape=(0, 3),
+                      filters=filters)
+    h5f.create_earray(group, "offsets", atom=tb.Int64Atom(), shape=(0,),
+                      **kwargs)
+    return EncodedArray(node)
+
+
+def is_encoded(node):
+    """
+    Whether a node is the delta array of an encoded array.
+    """
+    return isinstance(node, tb.EArray) and "encoding" in node.attrs
+
+
+def decoded(node):
+    """
+    Return an EncodedArray for encoded nodes and the node itself otherwise.
+    """
+    return EncodedArray(node) if is_encoded(node) else node
+
+
+class EncodedArray(object):
+    """
+    Read and append access to an encoded array, with the interface of the
+    tb.EArray of Int16 waveforms it replaces (shape, dtype, nrows, read,
+    slicing along the event axis, append, truncate, flush).
+
+    Parameters
+    ----------
+    node : tb.EArray
+        The Int8 delta array.
+    """
+
+    def __init__(self, node):
+        self.deltas = node
+        self.encoding = node.attrs.encoding
+        group = node._v_parent._f_get_child(node._v_name + "_encoding")
+        self.baselines = group.baselines
+        self.escapes = group.escapes
+        self.offsets = group.offsets
+        self.dtype = np.dtype(np.int16)
+        self._v_pathname = node._v_pathname
+
+    @property
+    def shape(self):
+        return self.deltas.shape
+
+    @property
+    def nrows(self):
+        return self.deltas.nrows
+
+    @property
+    def rowsize(self):
+        return int(np.prod(self.shape[1:])) * self.dtype.itemsize
+
+    @property
+    def size_in_memory(self):
+        return self.nrows * self.rowsize
+
+    @property
+    def size_on_disk(self):
+        return sum(node.size_on_disk for node in self._nodes())
+
+    def __len__(self):
+        return self.nrows
+
+    def _nodes(self):
+        return self.deltas, self.baselines, self.escapes, self.offsets
+
+    def _escape_rows(self, event):
+        """
+        First row of the escapes of an event.
+        """
+        return int(self.offsets[event - 1]) if event > 0 else 0
+
+    def read(self, start=0, stop=None):
+        """
+        Decode the events in [start, stop).
+        """
+        stop = self.nrows if stop is None else min(stop, self.nrows)
+        start = min(start, stop)
+        first, last = self._escape_rows(start), self._escape_rows(stop)
+        counts = np.diff(np.concatenate(([first],
+                                         self.offsets[start:stop])))
+        return decode_wfs(self.deltas[start:stop],
+                          self.baselines[start:stop],
+                          self.escapes[first:last], counts, self.encoding)
+
+    def __getitem__(self, key):
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.nrows)
+            data = self.read(start, stop)[::step]
+            return data[(slice(None),) + rest] if rest else data
+        if key < 0:
+            key += self.nrows
+        if not 0 <= key < self.nrows:
+            raise IndexError("Event {} out of range".format(key))
+        return self.read(key, key + 1)[(0,) + rest]
+
+    def append(self, wfs):
+        """
+        Encode and append a set of events.
+        """
+        deltas, baselines, escapes, counts = encode_wfs(wfs, self.encoding)
+        total = self._escape_rows(self.nrows)
+        self.deltas.append(deltas)
+        self.baselines.append(baselines)
+        self.escapes.append(escapes.reshape(-1, 3))
+        self.offsets.append(total + np.cumsum(counts))
+
+    def truncate(self, nrows):
+        """
+        Keep only the first nrows events.
+        """
+        self.escapes.truncate(self._escape_rows(nrows))
+        self.offsets.truncate(nrows)
+        self.baselines.truncate(nrows)
+        self.deltas.truncate(nrows)
+
+    def flush(self):
+        for node in self._nodes():
+            node.flush()
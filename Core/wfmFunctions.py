@@ -27,7 +27,7 @@ def to_adc(wfs, sensdf):
     adc_wfs : 2-dim np.ndarray
         The input wfs scaled to adc.
     """
-    return wfs * sensdf["adc_to_pes"].reshape(wfs.shape[0], 1)
+    return wfs * sensdf["adc_to_pes"].values.reshape(wfs.shape[0], 1)
 
 
 def to_pes(wfs, sensdf):
@@ -46,7 +46,7 @@ def to_pes(wfs, sensdf):
     pes_wfs : 2-dim np.ndarray
         The input wfs scaled to pes.
     """
-    return wfs / sensdf["adc_to_pes"].reshape(wfs.shape[0], 1)
+    return wfs / sensdf["adc_to_pes"].values.reshape(wfs.shape[0], 1)
 
 
 def get_waveforms(pmtea, event_number=0):
@@ -386,7 +386,7 @@ def noise_suppression(waveforms, thresholds):
     """
     if not hasattr(thresholds, "__iter__"):
         thresholds = np.ones(waveforms.shape[0]) * thresholds
-    suppressed_wfs = map(suppress_wf, waveforms, thresholds)
+    suppressed_wfs = list(map(suppress_wf, waveforms, thresholds))
     return np.array(suppressed_wfs)
 
 
@@ -421,6 +421,39 @@ def find_baseline(waveform, n_samples=500, check_no_signal=True):
     return np.mean(waveform[:n_samples])
 
 
+def find_baselines(waveforms, n_samples=500, check_no_signal=True):
+    """
+    Vectorized version of find_baseline for any number of waveforms.
+
+    Parameters
+    ----------
+    waveforms : n-dim np.ndarray
+        The waveform amplitudes along the last axis, e.g. (sensor, sample)
+        for an event or (event, sensor, sample) for a block of events.
+    n_samples : int, optional
+        Number of samples to measure baseline. Default is 500.
+    check_no_signal : bool, optional
+        Check RMS in waveform subsample to ensure there is no signal present
+        in it. Default is True.
+
+    Returns
+    -------
+    baselines : (n-1)-dim np.ndarray
+        The baseline of each waveform, as given by find_baseline.
+    """
+    default = np.mean(waveforms[..., :n_samples], axis=-1)
+    nwindows = waveforms.shape[-1] // n_samples
+    if not check_no_signal or not nwindows:
+        return default
+
+    windows = waveforms[..., :nwindows * n_samples]
+    windows = windows.reshape(waveforms.shape[:-1] + (nwindows, n_samples))
+    quiet = np.std(windows, axis=-1) < 3
+    first = np.argmax(quiet, axis=-1)[..., np.newaxis]
+    means = np.take_along_axis(np.mean(windows, axis=-1), first, axis=-1)
+    return np.where(quiet.any(axis=-1), means[..., 0], default)
+
+
 def subtract_baseline(waveforms, n_samples=500, check_no_signal=True):
     """
     Computes the baseline for each sensor in the event and subtracts it.
@@ -428,7 +461,8 @@ def subtract_baseline(waveforms, n_samples=500, check_no_signal=True):
     Parameters
     ----------
     waveforms : 2-dim np.ndarray
-        The waveform amplitudes (axis 1) for each sensor (axis 0)
+        The waveform amplitudes (axis 1) for each sensor (axis 0). A block
+        of events (axis 0) is also accepted.
     n_samples : int
         Number of samples to measure baseline. Default is 500.
     check_no_signal : bool, optional
@@ -440,7 +474,41 @@ def subtract_baseline(waveforms, n_samples=500, check_no_signal=True):
     blr_wfs : 2-dim np.array
         The input waveform with the baseline subtracted.
     """
-    bls = np.apply_along_axis(lambda wf: find_baseline(wf, n_samples,
-                                                       check_no_signal),
-                              1, waveforms)
-    return waveforms - bls.reshape(waveforms.shape[0], 1)
+    bls = find_baselines(waveforms, n_samples, check_no_signal)
+    return waveforms - bls[..., np.newaxis]
+
+
+def baselines_and_noise(waveforms, nsigma=3., nloops=1):
+    """
+    Baseline and noise RMS of any number of waveforms, excluding the
+    signal-like samples recursively: each loop recomputes the mean and
+    RMS using only the samples within nsigma RMS of the previous mean.
+
+    Parameters
+    ----------
+    waveforms : n-dim np.ndarray
+        The waveform amplitudes along the last axis, e.g. (sensor, sample)
+        for an event or (event, sensor, sample) for a block of events.
+    nsigma : float, optional
+        Samples further than nsigma RMS from the mean are excluded.
+        Default is 3.
+    nloops : int, optional
+        Number of recursive steps. Default is 1.
+
+    Returns
+    -------
+    baselines, rmss : (n-1)-dim np.ndarrays
+        The mean and RMS of the signal-free samples of each waveform.
+    """
+    waveforms = np.asarray(waveforms, dtype=np.float64)
+    baselines = np.mean(waveforms, axis=-1)
+    rmss = np.std(waveforms, axis=-1)
+    for _ in range(nloops):
+        deviations = waveforms - baselines[..., np.newaxis]
+        quiet = np.abs(deviations) <= nsigma * rmss[..., np.newaxis]
+        n = np.maximum(np.count_nonzero(quiet, axis=-1), 1)
+        shift = np.sum(np.where(quiet, deviations, 0.), axis=-1) / n
+        variance = np.sum(np.where(quiet, deviations**2, 0.), axis=-1) / n
+        baselines = baselines + shift
+        rmss = np.sqrt(np.maximum(variance - shift**2, 0.))
+    return baselines, rmss
@@ -60,21 +60,21 @@ where MinRun <= {0} and (MaxRun >= {0} or MaxRun is NULL)
 order by SensorID;'''.format(run_number)
     cursor.execute(sqlbaseline)
     data = cursor.fetchall()
-    baselines = np.array(map(lambda s: s[0], data))
+    baselines = np.array([row[0] for row in data])
 
     sqlnoisebins = '''select Energy from SipmNoiseBins
 where MinRun <= {0} and (MaxRun >= {0} or MaxRun is NULL)
 order by Bin;'''.format(run_number)
     cursor.execute(sqlnoisebins)
     data = cursor.fetchall()
-    noise_bins = np.array(map(lambda s: s[0], data))
+    noise_bins = np.array([row[0] for row in data])
 
     sqlnoise = '''select * from SipmNoise
 where MinRun <= {0} and (MaxRun >= {0} or MaxRun is NULL)
 order by SensorID;'''.format(run_number)
     cursor.execute(sqlnoise)
     data = cursor.fetchall()
-    data = map(lambda l: l[3:], data)
+    data = [row[3:] for row in data]
     noise = np.array(data).reshape(1792, 300)
 
     return noise, noise_bins, baselines
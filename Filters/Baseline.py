@@ -8,6 +8,7 @@ import sys
 import numpy as np
 
 import Core.wfmFunctions as wfm
+import Core.tblFunctions as tbl
 
 
 class Baseline:
@@ -23,6 +24,9 @@ class Baseline:
         lifting. Default is 10.
     apply_on : string, optional
         Apply filter on different data types: CWF (defult), BLR
+    cost : int or float, optional
+        Relative cost used to order the filters. Default is 1 for CWF and
+        5 for BLR.
     """
 
     def __init__(self, **opts):
@@ -36,11 +40,31 @@ class Baseline:
         if self.wftype not in ["CWF", "BLR"]:
             raise ValueError("Wrong value for argument apply_on: {}\n"
                              "Available options are 'CWF' and 'BLR'")
+        self.cost = opts.get("cost", 1 if self.wftype == "CWF" else 5)
 
     def __call__(self, f, i):
         if self.wftype == "CWF":
-            data = f.root.RD.pmtcwf[i]
+            data = tbl.get_wf_array(f, "/RD/pmtcwf")[i]
         else:
-            data = wfm.subtract_baseline(f.root.RD.pmtblr[i])
+            data = tbl.get_wf_array(f, "/RD/pmtblr")[i]
+            data = wfm.subtract_baseline(data)
         means = np.mean(data[:, -self.n_samples:], axis=1)
         return np.all(means < self.max_adc)
+
+    def select(self, f, start, stop, selection=None):
+        if self.wftype == "CWF":
+            data = tbl.get_wf_array(f, "/RD/pmtcwf")[start:stop, :,
+                                                     -self.n_samples:]
+            return np.all(np.mean(data, axis=2) < self.max_adc, axis=1)
+
+        mask = np.zeros(stop - start, dtype=bool)
+        if selection is None:
+            selection = np.ones(stop - start, dtype=bool)
+        if not selection.any():
+            return mask
+
+        data = tbl.get_wf_array(f, "/RD/pmtblr")[start:stop][selection]
+        data = wfm.subtract_baseline(data)
+        means = np.mean(data[..., -self.n_samples:], axis=2)
+        mask[selection] = np.all(means < self.max_adc, axis=1)
+        return mask
@@ -7,6 +7,7 @@ import sys
 import numpy as np
 
 import Core.wfmFunctions as wfm
+import Core.tblFunctions as tbl
 
 
 class Min_charge:
@@ -27,6 +28,9 @@ class Min_charge:
     integrate_wf : bool, optional
         Flag to apply selection on the integrated wf (True)
         or per sample (False)
+
+    cost : int or float, optional
+        Relative cost used to order the filters. Default is 10.
     """
 
     def __init__(self, **opts):
@@ -37,16 +41,34 @@ class Min_charge:
         self.min_signal = opts["min_signal"]
         self.mau_len = opts.get("mau_len", 200)
         self.integrate_wf = opts.get("integrate_wf", False)
+        self.cost = opts.get("cost", 10)
 
         self.do_selection = "sipm_selection" in opts
         if self.do_selection:
             self.selection = np.array(opts["sipm_selection"], ndmin=1)
 
     def __call__(self, f, i):
-        sipms = f.root.RD.sipmrwf
+        sipms = tbl.get_wf_array(f, "/RD/sipmrwf")
 
         wfs = sipms[i][self.selection] if self.do_selection else sipms[i]
         wfs = wfm.subtract_baseline(wfs, self.mau_len)
         if self.integrate_wf:
             wfs = np.sum(wfs, axis=1)
         return np.max(wfs) > self.min_signal
+
+    def select(self, f, start, stop, selection=None):
+        mask = np.zeros(stop - start, dtype=bool)
+        if selection is None:
+            selection = np.ones(stop - start, dtype=bool)
+        if not selection.any():
+            return mask
+
+        wfs = tbl.get_wf_array(f, "/RD/sipmrwf")[start:stop][selection]
+        if self.do_selection:
+            wfs = wfs[:, self.selection]
+        wfs = wfm.subtract_baseline(wfs, self.mau_len)
+        if self.integrate_wf:
+            wfs = np.sum(wfs, axis=2)
+        mask[selection] = np.max(wfs.reshape(len(wfs), -1), axis=1) > \
+            self.min_signal
+        return mask
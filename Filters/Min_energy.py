@@ -5,6 +5,8 @@ from __future__ import print_function
 
 import sys
 
+import Core.tblFunctions as tbl
+
 
 class Min_energy:
     """
@@ -18,6 +20,9 @@ class Min_energy:
     apply_on : string, optional
         WF to be used for computing signal. Options are: "ZS" (default)
         "RWF" or "CWF".
+
+    cost : int or float, optional
+        Relative cost used to order the filters. Default is 1.
     """
 
     def __init__(self, **opts):
@@ -27,14 +32,20 @@ class Min_energy:
 
         self.min_signal = opts["min_signal"]
         self.wftype = opts.get("apply_on", "ZS")
+        self.cost = opts.get("cost", 1)
 
-    def __call__(self, f, i):
+    def _pmts(self, f):
         if self.wftype == "ZS":
-            pmts = f.root.ZS.PMT
+            return tbl.get_wf_array(f, "/ZS/PMT")
         elif self.wftype == "CWF":
-            pmts = f.root.RD.pmtcwf
+            return tbl.get_wf_array(f, "/RD/pmtcwf")
         elif self.wftype == "RWF":
-            pmts = f.root.RD.pmtrwf
+            return tbl.get_wf_array(f, "/RD/pmtrwf")
+
+    def __call__(self, f, i):
+        ene = self._pmts(f)[i].sum()
+        return ene > self.min_signal
 
-        ene = pmts[i].sum()
+    def select(self, f, start, stop, selection=None):
+        ene = self._pmts(f)[start:stop].sum(axis=(1, 2))
         return ene > self.min_signal
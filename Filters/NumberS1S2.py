@@ -5,7 +5,10 @@ from __future__ import print_function
 
 import sys
 
+import numpy as np
+
 from Core.Bridges import Signal
+from Core.Chain import Chain, read_pmap
 import Core.tblFunctions as tbl
 
 
@@ -19,6 +22,8 @@ class NumberS1S2:
         Number of S1 signals
     nS2 : int, optional
         Number of S2 signals
+    cost : int or float, optional
+        Relative cost used to order the filters. Default is 2.
     """
 
     def __init__(self, **opts):
@@ -29,11 +34,48 @@ class NumberS1S2:
 
         self.nS1 = opts["nS1"]
         self.nS2 = opts["nS2"]
+        self.cost = opts.get("cost", 2)
 
     def __call__(self, f, i):
-        pmap = tbl.read_pmap(f.root.PMAPS.PMaps, i)
-        if len(pmap.get(Signal.S1)) != self.nS1:
+        pmap = read_pmap(f, i)
+        if len(list(pmap.get(Signal.S1))) != self.nS1:
             return False
-        if len(pmap.get(Signal.S2)) != self.nS2:
+        if len(list(pmap.get(Signal.S2))) != self.nS2:
             return False
         return True
+
+    def select(self, f, start, stop, selection=None):
+        if isinstance(f, Chain):
+            # the catalog of each file refers to its own rows
+            masks = [self.select(f.file(ifile), low, upp)
+                     for ifile, low, upp in f.blocks(start, stop)]
+            return np.concatenate([np.zeros(0, dtype=bool)] + masks)
+        if start >= stop:
+            return np.zeros(0, dtype=bool)
+
+        table = f.root.PMAPS.PMaps
+        catalog = tbl.read_catalog(f)
+        if catalog is not None:
+            rows = catalog["pmaps"][start:stop]
+            lengths = rows[:, 1] - rows[:, 0]
+            data = table.read(rows[0, 0], rows[-1, 1])
+            events = np.repeat(np.arange(stop - start), lengths)
+        else:
+            first = tbl.first_event(f) + start
+            data = table.read_where("(event >= {}) & (event < {})"
+                                    "".format(first, first + stop - start))
+            events = data["event"] - first
+
+        # One entry per peak: rows are grouped by event and peak
+        new = np.ones(data.size, dtype=bool)
+        new[1:] = ((events[1:] != events[:-1]) |
+                   (data["peak"][1:] != data["peak"][:-1]))
+        events = events[new]
+        signals = data["signal"][new]
+
+        def count(signal):
+            signal = np.array(signal, dtype=signals.dtype)
+            return np.bincount(events[signals == signal],
+                               minlength=stop - start)
+
+        return (count(Signal.S1) == self.nS1) & (count(Signal.S2) == self.nS2)
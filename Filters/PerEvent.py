@@ -0,0 +1,53 @@
+"""
+Batch interface for filters.
+
+Filters select events through select(f, start, stop, selection=None), which
+returns a boolean mask for the events in [start, stop) and is expected to
+work on the whole block at once. Filters implementing only the per-event
+interface (__call__(f, i)) are wrapped in PerEvent.
+"""
+from __future__ import print_function
+
+import numpy as np
+
+
+class PerEvent:
+    """
+    Adapter giving the batch interface to a per-event filter.
+
+    Parameters
+    ----------
+    filter_ : callable
+        Object or function taking an hdf5 file and an event number and
+        returning a boolean.
+    cost : int or float, optional
+        Relative cost of the filter, used to order them. Default is the
+        filter's own cost attribute, if any, or 100.
+    """
+
+    def __init__(self, filter_, cost=None):
+        self.filter_ = filter_
+        if cost is None:
+            cost = getattr(filter_, "cost", 100)
+        self.cost = cost
+
+    def __call__(self, f, i):
+        return self.filter_(f, i)
+
+    def select(self, f, start, stop, selection=None):
+        mask = np.zeros(stop - start, dtype=bool)
+        if selection is None:
+            selection = np.ones(stop - start, dtype=bool)
+        for i in np.flatnonzero(selection):
+            mask[i] = self.filter_(f, start + i)
+        return mask
+
+
+def batch_filters(filters):
+    """
+    Give the batch interface to all filters and sort them by increasing cost,
+    so the cheap ones reject events before the expensive ones are evaluated.
+    Filters with the same cost keep their order.
+    """
+    filters = [f if hasattr(f, "select") else PerEvent(f) for f in filters]
+    return sorted(filters, key=lambda f: f.cost)
@@ -0,0 +1,67 @@
+"""
+Add (or rebuild) the event catalog of existing files.
+
+The catalog stores, for each event, the range of rows it occupies in the
+TWF, PMaps and DST tables, so readers can slice them instead of searching.
+Event numbers in the tables are assumed to be consecutive in file order, as
+written by the cities and file_merger, starting from the first one found in
+the tables (0, or SKIP in the output of DIOMIRA).
+"""
+from __future__ import print_function
+
+import sys
+import argparse
+import traceback
+import tables as tb
+
+import Core.tblFunctions as tbl
+
+
+def add_catalog(filename, force=False):
+    """
+    Write the event catalog of a file.
+
+    Parameters
+    ----------
+    filename : string
+        Name of the file (path included).
+    force : bool, optional
+        Rebuild the catalog if it already exists. Default is False.
+
+    Returns
+    -------
+    nevt : int
+        Number of events in the catalog. -1 if the file already had one and
+        force is False.
+    """
+    with tb.open_file(filename, "r+") as h5f:
+        if "/Catalog/Events" in h5f and not force:
+            return -1
+        return tbl.build_catalog(h5f).nrows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-i", metavar="ifile", type=str, nargs="+",
+                        help="files to be catalogued", required=True)
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild existing catalogs")
+    parser.add_argument("--raise-errors", action="store_true",
+                        help="raise errors if present")
+
+    args = parser.parse_args()
+    for filename in args.i:
+        print("Cataloguing", filename, end="... ")
+        sys.stdout.flush()
+        try:
+            nevt = add_catalog(filename, args.force)
+            print("already present" if nevt < 0 else
+                  "OK ({} events)".format(nevt))
+        except Exception as e:
+            if args.raise_errors:
+                print("\n" + "-"*80 + "\n- TRACEBACK:\n" + "-"*80)
+                traceback.print_tb(sys.exc_info()[2])
+                print("-"*80)
+                raise e
+            else:
+                print("Error")
@@ -5,16 +5,21 @@ Merge a bunch of files into a single one reproducing the structure.
 """
 from __future__ import print_function
 
+import os
 import sys
+import shutil
+import tempfile
 import importlib
+import multiprocessing
 import argparse
 import traceback
 import tables as tb
 import numpy as np
 
 import Core.tblFunctions as tbl
-from Core.Nh5 import EventInfo, SENSOR_WF, PMAP
+from Core.Nh5 import EventInfo, SENSOR_WF, PMAP, PMAP_DST
 from Core.Configure import read_config_file, filter_options
+from Filters.PerEvent import batch_filters
 
 
 def init_filter(filtername, **options):
@@ -26,7 +31,9 @@ def init_filter(filtername, **options):
     filtername : string
         Name of the filter to be used. Must be a class with the __call__
         method or a function taking keyword arguments and returnin another
-        function. The filter must be contained in a module with the same name.
+        function. Classes may also implement the batch method select (see
+        Filters.PerEvent). The filter must be contained in a module with the
+        same name.
 
     Optional keyword arguments for the filter configuration can be passed
     through the options keyword argument.
@@ -78,12 +85,7 @@ def create_new_file(outputfilename, inputfilename, **options):
                                "Events information",
                                tbl.filters("NOCOMPR"))
 
-            NEVT = h5in.root.Run.events.cols.evt_number[:].size
-            NEVT *= options.get("nfiles", 1)
-        elif "/RD" in h5in:
-            NEVT = h5in.root.RD.pmtrwf
-        else:
-            NEVT = tbl.get_nofevents(h5in.root.TWF.PMT, "event")
+        NEVT = tbl.get_nevents(h5in) * options.get("nfiles", 1)
 
         if "/MC" in h5in:
             mcgroup = h5out.create_group(h5out.root, "MC")
@@ -117,34 +119,21 @@ def create_new_file(outputfilename, inputfilename, **options):
                                 filters=tbl.filters(COMPRESSION))
 
         if "/RD" in h5in:
+            # encoded waveforms (see tblFunctions.create_wf_array) stay so
             rdgroup = h5out.create_group(h5out.root, "RD")
             _, NPMT, PMTWL = h5in.root.RD.pmtrwf.shape
-            h5out.create_earray(rdgroup, "pmtrwf",
-                                atom=tb.Int16Atom(),
-                                shape=(0, NPMT, PMTWL),
-                                expectedrows=NEVT,
-                                filters=tbl.filters(COMPRESSION))
-
-            h5out.create_earray(rdgroup, "pmtblr",
-                                atom=tb.Int16Atom(),
-                                shape=(0, NPMT, PMTWL),
-                                expectedrows=NEVT,
-                                filters=tbl.filters(COMPRESSION))
-
             _, NSIPM, SIPMWL = h5in.root.RD.sipmrwf.shape
-            h5out.create_earray(rdgroup, "sipmrwf",
-                                atom=tb.Int16Atom(),
-                                shape=(0, NSIPM, SIPMWL),
-                                expectedrows=NEVT,
-                                filters=tbl.filters(COMPRESSION))
-
-            if "/RD/pmtcwf" in h5in:
-                h5out.create_earray(rdgroup, "pmtcwf",
-                                    atom=tb.Int16Atom(),
-                                    shape=(0, NPMT, PMTWL),
-                                    expectedrows=NEVT,
-                                    filters=tbl.filters(COMPRESSION))
-
+            for name, shape in (("pmtrwf", (NPMT, PMTWL)),
+                                ("pmtblr", (NPMT, PMTWL)),
+                                ("sipmrwf", (NSIPM, SIPMWL)),
+                                ("pmtcwf", (NPMT, PMTWL))):
+                path = "/RD/" + name
+                if name == "pmtcwf" and path not in h5in:
+                    continue
+                encoding = (tbl.get_wf_encoding(h5in, path)
+                            if path in h5in else None)
+                tbl.create_wf_array(rdgroup, name, shape, NEVT,
+                                    tbl.filters(COMPRESSION), encoding)
 
         if "/TWF" in h5in:
             twfgroup = h5out.create_group(h5out.root, "TWF")
@@ -210,248 +199,354 @@ def create_new_file(outputfilename, inputfilename, **options):
             pmaps_table.cols.event.create_index()
             pmaps_blr_table.cols.event.create_index()
 
+        if "/DST" in h5in:
+            dstgroup = h5out.create_group(h5out.root, "DST")
+            dst_table = h5out.create_table(dstgroup, "Events", PMAP_DST,
+                                           "Per-event summary of the PMaps",
+                                           tbl.filters(COMPRESSION))
+            dst_table.cols.event.create_index()
+
     return h5out
 
 
-def file_merger(outputfilename, discardedfilename, *inputfilenames, **options):
-    options["nfiles"] = len(inputfilenames)
+# Nodes holding one entry per event along their first axis
+EVENT_ARRAYS = tbl.EVENT_ARRAYS
 
-    filters = options.get("FILTERS", [])
-    if not isinstance(filters, list):
-        filters = [filters]
-    filters = map(lambda f: init_filter(f, **options), filters)
+# Tables holding a variable number of rows per event (column event)
+EVENT_TABLES = tbl.CATALOG_TABLES
+
+# Default memory budget for the largest array of a chunk
+MAX_CHUNK_BYTES = 64 * 2**20
+
+
+def chunk_size(h5in, **options):
+    """
+    Number of events to be read at once. Given by option CHUNK_SIZE or,
+    by default, as many as fit in MAX_CHUNK_BYTES for the largest array.
+    """
+    if "CHUNK_SIZE" in options:
+        return max(1, options["CHUNK_SIZE"])
+    rowsizes = [tbl.get_wf_array(h5in, path).rowsize
+                for path in EVENT_ARRAYS if path in h5in]
+    return max(1, MAX_CHUNK_BYTES // max(rowsizes + [1]))
+
+
+def get_event_ranges(h5in, nevt):
+    """
+    Find the rows [start, stop) of each event in the event tables, from the
+    catalog if present (see tblFunctions.get_event_rows). Otherwise, the
+    events are looked up by number, counting from the first one in the
+    tables (tblFunctions.first_event). Returns a dictionary indexed by table
+    path.
+    """
+    catalog = tbl.read_catalog(h5in)
+    events = None
+    ranges = {}
+    for name, path in EVENT_TABLES:
+        if path not in h5in:
+            continue
+        if catalog is not None and name in catalog.dtype.names:
+            ranges[path] = catalog[name]
+        else:
+            if events is None:
+                events = tbl.first_event(h5in) + np.arange(nevt)
+            ranges[path] = tbl.event_ranges(h5in.get_node(path), events)
+    return ranges
+
+
+def select_events(filters, h5in, start, stop):
+    """
+    Apply the filters (see PerEvent.batch_filters) to the events in
+    [start, stop). Filters are told which events passed the previous ones and
+    are not evaluated at all once every event has been rejected.
+
+    Returns
+    -------
+    selection : 1-dim np.ndarray of bools
+        True for the selected events.
+    """
+    selection = np.ones(stop - start, dtype=bool)
+    for filter_ in filters:
+        if not selection.any():
+            break
+        selection &= filter_.select(h5in, start, stop, selection)
+    return selection
+
+
+def copy_events(h5in, h5out, start, stop, selection, ranges, first):
+    """
+    Append the selected events of a chunk to the output file. Events are
+    renumbered consecutively starting from *first*.
 
-    h5out = create_new_file(outputfilename, inputfilenames[0], **options)
+    Returns
+    -------
+    nsel : int
+        Number of events copied.
+    """
+    nsel = np.count_nonzero(selection)
+    if not nsel:
+        return 0
+
+    for path in EVENT_ARRAYS:
+        if path in h5out:
+            data = tbl.get_wf_array(h5in, path)[start:stop]
+            tbl.get_wf_array(h5out, path).append(data[selection])
+
+    if "/Run/events" in h5out:
+        data = h5in.root.Run.events.read(start, stop)
+        h5out.root.Run.events.append(data[selection])
+
+    for path, rows in ranges.items():
+        if path not in h5out:
+            continue
+        lengths = rows[start:stop, 1] - rows[start:stop, 0]
+        data = h5in.get_node(path).read(rows[start, 0], rows[stop-1, 1])
+        if data.size != lengths.sum():
+            raise ValueError("Rows of {} are not sorted by event"
+                             "".format(path))
+        data = data[np.repeat(selection, lengths)]
+        if data.size:
+            data["event"] = np.repeat(first + np.arange(nsel),
+                                      lengths[selection])
+            h5out.get_node(path).append(data)
+    return nsel
+
+
+def flush_tables(h5f):
+    """
+    Flush the tables filled by copy_events.
+    """
+    for path in ("/Run/events",) + tuple(p for _, p in EVENT_TABLES):
+        if path in h5f:
+            h5f.get_node(path).flush()
 
-    if "/Run" in h5out:
-        evtrow_out = h5out.root.Run.events.row
 
-    if "/pmtrd" in h5out:
-        pmtrd_out = h5out.root.pmtrd
-        sipmrd_out = h5out.root.sipmrd
+def merge_file(filename, h5out, h5dis, filters, first_out=0, first_dis=0,
+               **options):
+    """
+    Apply the filters to the events of an input file and append them to the
+    output file (selected) and to the discarded file, if given.
 
-    if "/RD" in h5out:
-        pmtrwf_out = h5out.root.RD.pmtrwf
-        pmtblr_out = h5out.root.RD.pmtblr
-        sipmrwf_out = h5out.root.RD.sipmrwf
-        if "/RD/pmtcwf" in h5out:
-            pmtcwf_out = h5out.root.RD.pmtcwf
+    Returns
+    -------
+    counts : tuple of ints
+        Number of events read, selected and discarded.
+    """
+    n_out = n_dis = 0
+    with tb.open_file(filename, "r") as h5in:
+        NEVT = tbl.get_nevents(h5in)
+        ranges = get_event_ranges(h5in, NEVT)
+        chunk = chunk_size(h5in, **options)
+        for start in range(0, NEVT, chunk):
+            stop = min(start + chunk, NEVT)
+            selection = select_events(filters, h5in, start, stop)
+            n_out += copy_events(h5in, h5out, start, stop, selection,
+                                 ranges, first_out + n_out)
+            if h5dis is not None:
+                n_dis += copy_events(h5in, h5dis, start, stop, ~selection,
+                                     ranges, first_dis + n_dis)
+    flush_tables(h5out)
+    if h5dis is not None:
+        flush_tables(h5dis)
+    return NEVT, n_out, n_dis
+
+
+def append_shard(shardname, h5out, first, **options):
+    """
+    Append all the events of a shard (see filter_shard) to the output file,
+    renumbering them from *first*.
 
-    if "/TWF" in h5out:
-        pmttwf_out = h5out.root.TWF.PMT
-        sipmtwf_out = h5out.root.TWF.SiPM
+    Returns
+    -------
+    nevt : int
+        Number of events appended.
+    """
+    with tb.open_file(shardname, "r") as h5in:
+        NEVT = tbl.get_nevents(h5in)
+        ranges = get_event_ranges(h5in, NEVT)
+        chunk = chunk_size(h5in, **options)
+        for start in range(0, NEVT, chunk):
+            stop = min(start + chunk, NEVT)
+            copy_events(h5in, h5out, start, stop,
+                        np.ones(stop - start, dtype=bool), ranges,
+                        first + start)
+    flush_tables(h5out)
+    return NEVT
+
+
+def filter_shard(args):
+    """
+    Worker of the parallel file_merger: filter one input file into its own
+    temporary output (and discarded) file, with the same structure as the
+    final output.
+
+    Parameters
+    ----------
+    args : tuple
+        Input file name, shard file name, discarded shard file name (or
+        None), template file name and options.
+
+    Returns
+    -------
+    counts : tuple of ints or None
+        As given by merge_file. None if the file could not be processed.
+    """
+    filename, shardname, disname, template, options = args
+    filters = batch_filters([init_filter(f, **options)
+                             for f in options["FILTERS"]])
+    h5out = create_new_file(shardname, template, **options)
+    h5dis = create_new_file(disname, template, **options) if disname else None
+    try:
+        return merge_file(filename, h5out, h5dis, filters, **options)
+    except Exception:
+        if options["RAISE_ERRORS"]:
+            print("\n" + "-"*80 + "\n- TRACEBACK ({}):\n".format(filename) +
+                  "-"*80)
+            traceback.print_exc()
+            print("-"*80)
+            raise
+        return None
+    finally:
+        h5out.close()
+        if h5dis is not None:
+            h5dis.close()
+
+
+def merge_shards(filename, shards, template, **options):
+    """
+    Concatenate the shards in order into a file. The first shard becomes
+    the output file as is, so its data are neither read nor recompressed;
+    the rest are appended in bulk. Missing shards (None) are skipped.
 
-    if "/BLR" in h5out:
-        mau_out = h5out.root.BLR.mau
-        pulse_on_out = h5out.root.BLR.pulse_on
-        wait_over_out = h5out.root.BLR.wait_over
+    Returns
+    -------
+    h5out : tb.File
+        The (open) output file.
+    """
+    shards = [shard for shard in shards if shard is not None]
+    if not shards:
+        return create_new_file(filename, template, **options)
+
+    shutil.move(shards[0], filename)
+    h5out = tb.open_file(filename, "a")
+    nevt = tbl.get_nevents(h5out)
+    for shard in shards[1:]:
+        nevt += append_shard(shard, h5out, nevt, **options)
+    return h5out
 
-    if "/ZS" in h5out:
-        pmtzs_out = h5out.root.ZS.PMT
-        blrzs_out = h5out.root.ZS.BLR
-        sipmzs_out = h5out.root.ZS.SiPM
 
-    if "/PMAPS" in h5out:
-        pmaps_out = h5out.root.PMAPS.PMaps
-        pmaps_blr_out = h5out.root.PMAPS.PMapsBLR
+def parallel_merger(outputfilename, discardedfilename, inputfilenames,
+                    njobs, **options):
+    """
+    Run the filters on the input files in *njobs* processes and merge the
+    resulting shards in input order.
 
+    Returns
+    -------
+    h5out, h5dis, counts : tb.File, tb.File or None, list
+        The (open) output files and the counts of each input file (None for
+        the files that failed).
+    """
+    tmpdir = tempfile.mkdtemp(prefix=".merger_",
+                              dir=os.path.dirname(
+                                  os.path.abspath(outputfilename)))
+    template = inputfilenames[0]
     dump_unselected = discardedfilename is not None
-    if dump_unselected:
-        h5dis = create_new_file(discardedfilename, inputfilenames[0],
-                                **options)
-
-        if "/Run" in h5out:
-            evtrow_dis = h5dis.root.Run.events.row
-
-        if "/pmtrd" in h5dis:
-            pmtrd_dis = h5dis.root.pmtrd
-            sipmrd_dis = h5dis.root.sipmrd
-
-        if "/RD" in h5dis:
-            pmtrwf_dis = h5dis.root.RD.pmtrwf
-            pmtblr_dis = h5dis.root.RD.pmtblr
-            sipmrwf_dis = h5dis.root.RD.sipmrwf
-            if "/RD/pmtcwf" in h5dis:
-                pmtcwf_dis = h5dis.root.RD.pmtcwf
-
-        if "/TWF" in h5dis:
-            pmttwf_dis = h5dis.root.TWF.PMT
-            sipmtwf_dis = h5dis.root.TWF.SiPM
-
-        if "/BLR" in h5dis:
-            mau_dis = h5dis.root.BLR.mau
-            pulse_on_dis = h5dis.root.BLR.pulse_on
-            wait_over_dis = h5dis.root.BLR.wait_over
-
-        if "/ZS" in h5dis:
-            pmtzs_dis = h5dis.root.ZS.PMT
-            blrzs_dis = h5dis.root.ZS.BLR
-            sipmzs_dis = h5dis.root.ZS.SiPM
-
-        if "/PMAPS" in h5dis:
-            pmaps_dis = h5dis.root.PMAPS.PMaps
-            pmaps_blr_dis = h5dis.root.PMAPS.PMapsBLR
+    jobs = []
+    for i, filename in enumerate(inputfilenames):
+        shard = os.path.join(tmpdir, "out_{:05d}.h5".format(i))
+        dis = (os.path.join(tmpdir, "dis_{:05d}.h5".format(i))
+               if dump_unselected else None)
+        jobs.append((filename, shard, dis, template, options))
+
+    pool = multiprocessing.Pool(njobs)
+    try:
+        counts = []
+        for job, count in zip(jobs, pool.imap(filter_shard, jobs)):
+            print("Filtering", job[0], end="... ")
+            print("Error" if count is None else "OK")
+            counts.append(count)
+        pool.close()
+
+        ok = [count is not None for count in counts]
+        h5out = merge_shards(outputfilename,
+                             [job[1] if good else None
+                              for job, good in zip(jobs, ok)],
+                             template, **options)
+        h5dis = None
+        if dump_unselected:
+            h5dis = merge_shards(discardedfilename,
+                                 [job[2] if good else None
+                                  for job, good in zip(jobs, ok)],
+                                 template, **options)
+    finally:
+        pool.terminate()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return h5out, h5dis, counts
+
+
+def file_merger(outputfilename, discardedfilename, *inputfilenames, **options):
+    options["nfiles"] = len(inputfilenames)
+
+    filters = options.get("FILTERS", [])
+    if not isinstance(filters, list):
+        filters = [filters]
+    options["FILTERS"] = filters
 
     n_events_in = 0
     n_events_out = 0
     n_events_dis = 0
 
-    for i, filename in enumerate(inputfilenames):
-        print("Opening", filename, end="... ")
-        sys.stdout.flush()
-        try:
-            with tb.open_file(filename, "r") as h5in:
-                if "/Run" in h5in:
-                    run = h5in.root.Run.events.cols
-                    NEVT = run.evt_number[:].size
-                elif "/RD" in h5in:
-                    NEVT = h5in.root.RD.pmtrwf.shape[0]
+    njobs = options.get("NJOBS", 1)
+    if njobs > 1:
+        h5out, h5dis, counts = parallel_merger(outputfilename,
+                                               discardedfilename,
+                                               inputfilenames, njobs,
+                                               **options)
+        for count in counts:
+            if count is not None:
+                n_events_in += count[0]
+                n_events_out += count[1]
+                n_events_dis += count[2]
+    else:
+        filters = batch_filters([init_filter(f, **options) for f in filters])
+
+        h5out = create_new_file(outputfilename, inputfilenames[0], **options)
+        h5dis = None
+        if discardedfilename is not None:
+            h5dis = create_new_file(discardedfilename, inputfilenames[0],
+                                    **options)
+
+        for i, filename in enumerate(inputfilenames):
+            print("Opening", filename, end="... ")
+            sys.stdout.flush()
+            try:
+                nin, nout, ndis = merge_file(filename, h5out, h5dis, filters,
+                                             n_events_out, n_events_dis,
+                                             **options)
+                n_events_in += nin
+                n_events_out += nout
+                n_events_dis += ndis
+                print("OK")
+            except Exception as e:
+                if options["RAISE_ERRORS"]:
+                    print("\n" + "-"*80 + "\n- TRACEBACK:\n" + "-"*80)
+                    traceback.print_tb(sys.exc_info()[2])
+                    print("-"*80)
+                    raise e
                 else:
-                    NEVT = tbl.get_nofevents(h5in.root.TWF.PMT, "event")
-
-                n_events_in += NEVT
-
-                if "/pmtrd" in h5in:
-                    pmtrd_in = h5in.root.pmtrd
-                    sipmrd_in = h5in.root.sipmrd
-
-                if "/RD" in h5in:
-                    pmtrwf_in = h5in.root.RD.pmtrwf
-                    pmtblr_in = h5in.root.RD.pmtblr
-                    sipmrwf_in = h5in.root.RD.sipmrwf
-                    if "/RD/pmtcwf" in h5in:
-                        pmtcwf_in = h5in.root.RD.pmtcwf
-
-                if "/TWF" in h5in:
-                    pmttwf_in = h5in.root.TWF.PMT
-                    sipmtwf_in = h5in.root.TWF.SiPM
-
-                if "/BLR" in h5in:
-                    mau_in = h5in.root.BLR.mau
-                    pulse_on_in = h5in.root.BLR.pulse_on
-                    wait_over_in = h5in.root.BLR.wait_over
-
-                if "/ZS" in h5in:
-                    pmtzs_in = h5in.root.ZS.PMT
-                    blrzs_in = h5in.root.ZS.BLR
-                    sipmzs_in = h5in.root.ZS.SiPM
-
-                if "/PMAPS" in h5in:
-                    pmaps_in = h5in.root.PMAPS.PMaps
-                    pmaps_blr_in = h5in.root.PMAPS.PMapsBLR
-
-                for evt in range(NEVT):
-                    if all([filter_(h5in, evt) for filter_ in filters]):
-                        if "/Run" in h5out:
-                            evtrow_out["evt_number"] = run.evt_number[evt]
-                            evtrow_out["timestamp"] = run.timestamp[evt]
-                            evtrow_out.append()
-
-                        if "/pmtrd" in h5out:
-                            pmtrd_out.append(pmtrd_in[evt][np.newaxis])
-                            sipmrd_out.append(sipmrd_in[evt][np.newaxis])
-
-                        if "/RD" in h5out:
-                            pmtrwf_out.append(pmtrwf_in[evt][np.newaxis])
-                            pmtblr_out.append(pmtblr_in[evt][np.newaxis])
-                            sipmrwf_out.append(sipmrwf_in[evt][np.newaxis])
-                            if "/RD/pmtcwf" in h5out:
-                                pmtcwf_out.append(pmtcwf_in[evt][np.newaxis])
-
-                        if "/TWF" in h5out:
-                            wf = tbl.read_wf_table(pmttwf_in, evt)
-                            tbl.store_wf_table(n_events_out, pmttwf_out, wf)
-                            wf = tbl.read_wf_table(sipmtwf_in, evt)
-                            tbl.store_wf_table(n_events_out, sipmtwf_out, wf)
-
-                        if "/BLR" in h5out:
-                            mau_out.append(mau_in[evt][np.newaxis])
-                            pulse_on_out.append(pulse_on_in[evt][np.newaxis])
-                            wait_over_out.append(wait_over_in[evt][np.newaxis])
-
-                        if "/ZS" in h5out:
-                            pmtzs_out.append(pmtzs_in[evt][np.newaxis])
-                            blrzs_out.append(blrzs_in[evt][np.newaxis])
-                            sipmzs_out.append(sipmzs_in[evt][np.newaxis])
-
-                        if "/PMAPS" in h5in:
-                            pmap = tbl.read_pmap(pmaps_in, evt)
-                            tbl.store_pmap(pmap, pmaps_out,
-                                           n_events_out, False)
-                            pmap = tbl.read_pmap(pmaps_blr_in, n_events_out)
-                            tbl.store_pmap(pmap, pmaps_blr_out,
-                                           n_events_out, False)
-                            if not evt % 20:
-                                pmaps_out.flush()
-                                pmaps_blr_out.flush()
-
-                        n_events_out += 1
-                    elif dump_unselected:
-                        if "/Run" in h5dis:
-                            evtrow_dis["evt_number"] = run.evt_number[evt]
-                            evtrow_dis["timestamp"] = run.timestamp[evt]
-                            evtrow_dis.append()
-
-                        if "/pmtrd" in h5dis:
-                            pmtrd_dis.append(pmtrd_in[evt][np.newaxis])
-                            sipmrd_dis.append(sipmrd_in[evt][np.newaxis])
-
-                        if "/RD" in h5dis:
-                            pmtrwf_dis.append(pmtrwf_in[evt][np.newaxis])
-                            pmtblr_dis.append(pmtblr_in[evt][np.newaxis])
-                            sipmrwf_dis.append(sipmrwf_in[evt][np.newaxis])
-                            if "/RD/pmtcwf" in h5dis:
-                                pmtcwf_dis.append(pmtcwf_in[evt][np.newaxis])
-
-                        if "/TWF" in h5dis:
-                            wf = tbl.read_wf_table(pmttwf_in, evt)
-                            tbl.store_wf_table(n_events_dis, pmttwf_dis, wf)
-                            wf = tbl.read_wf_table(sipmtwf_in, evt)
-                            tbl.store_wf_table(n_events_dis, sipmtwf_dis, wf)
-
-                        if "/BLR" in h5dis:
-                            mau_dis.append(mau_in[evt][np.newaxis])
-                            pulse_on_dis.append(pulse_on_in[evt][np.newaxis])
-                            wait_over_dis.append(wait_over_in[evt][np.newaxis])
-
-                        if "/ZS" in h5dis:
-                            pmtzs_dis.append(pmtzs_in[evt][np.newaxis])
-                            blrzs_dis.append(blrzs_in[evt][np.newaxis])
-                            sipmzs_dis.append(sipmzs_in[evt][np.newaxis])
-
-                        if "/PMAPS" in h5in:
-                            pmap = tbl.read_pmap(pmaps_in, evt)
-                            tbl.store_pmap(pmap, pmaps_dis,
-                                           n_events_dis, False)
-                            pmap = tbl.read_pmap(pmaps_blr_in, evt)
-                            tbl.store_pmap(pmap, pmaps_blr_dis,
-                                           n_events_dis, False)
-                            if not evt % 20:
-                                pmaps_dis.flush()
-                                pmaps_blr_dis.flush()
-
-                        n_events_dis += 1
-                if "/Run" in h5in:
-                    h5out.root.Run.events.flush()
-                    if dump_unselected:
-                        h5dis.root.Run.events.flush()
-            print("OK")
-        except Exception as e:
-            if options["RAISE_ERRORS"]:
-                print("\n" + "-"*80 + "\n- TRACEBACK:\n" + "-"*80)
-                traceback.print_tb(sys.exc_info()[2])
-                print("-"*80)
-                raise e
-            else:
-                print("Error")
+                    print("Error")
+
     ratio_out = n_events_out * 100. / n_events_in
     ratio_dis = n_events_dis * 100. / n_events_in
     print("# events in = {}".format(n_events_in))
     print("# events accepted = {} ({:.2f}%)".format(n_events_out, ratio_out))
     print("# events discarded = {} ({:.2f}%)".format(n_events_dis, ratio_dis))
+    tbl.build_catalog(h5out)
     h5out.flush()
     h5out.close()
-    if dump_unselected:
+    if h5dis is not None:
+        tbl.build_catalog(h5dis)
         h5dis.flush()
         h5dis.close()
 
@@ -466,10 +561,18 @@ if __name__ == "__main__":
                         help="output file with discarded events")
     parser.add_argument("-c", metavar="cfile", type=str,
                         help="configuration file")
+    parser.add_argument("--chunk", metavar="nevt", type=int,
+                        help="number of events read at once")
+    parser.add_argument("-j", metavar="njobs", type=int,
+                        help="number of files filtered in parallel")
     parser.add_argument("--raise-errors", action="store_true",
                         help="raise errors if present")
 
     args = parser.parse_args()
     options = read_config_file(args.c) if args.c else {}
     options["RAISE_ERRORS"] = args.raise_errors
+    if args.chunk is not None:
+        options["CHUNK_SIZE"] = args.chunk
+    if args.j is not None:
+        options["NJOBS"] = args.j
     file_merger(args.o, args.d, *args.i, **options)
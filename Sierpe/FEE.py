@@ -8,9 +8,7 @@ VH, JJGC, November, 2016
 from __future__ import print_function
 
 import numpy as np
-from scipy import signal
 import Core.system_of_units as units
-import Database.loadDB as DB
 
 # globals describing FEE
 PMT_GAIN = 1.7e6
@@ -36,6 +34,15 @@ OFFSET = 2500  # offset adc
 CEILING = 4096  # ceiling of adc
 
 
+def _signal():
+    """
+    scipy.signal, imported on first use as it is slow to import and only
+    needed by the simulation of the electronics.
+    """
+    from scipy import signal
+    return signal
+
+
 def i_to_adc():
     """
     current to adc counts
@@ -110,6 +117,7 @@ def spe_pulse(spe, t0=100*units.ns, tmax=200*units.ns,
     with baseline extending in steps of time_step from 0 to tmax
     determined by DELTA_L
     """
+    signal = _signal()
     n = int(t0/time_step)
     nmax = int(tmax/time_step)
 
@@ -131,6 +139,7 @@ def spe_pulse_train(spe,
     Returns a train of SPE pulses between signal_start
     and start+length in daq_window separated by tstep
     """
+    signal = _signal()
     nmin = int(signal_start/time_step)
     nmax = int((signal_start + signal_length)/time_step)
     NMAX = int(daq_window/time_step)
@@ -149,6 +158,7 @@ def spe_pulse_from_vector(spe, cnt):
     input: an instance of spe
     Returns a train of SPE pulses corresponding to vector cnt
     """
+    signal = _signal()
 
     spe_pulse = signal.convolve(cnt[0:-len(spe.spe)+1], spe.spe)
     return spe_pulse
@@ -189,6 +199,7 @@ class FEE:
         self.freq_zero = 1./(self.R1*self.C1)
         self.coeff_c = self.freq_zero/(self.f_sample*np.pi)
 
+        import Database.loadDB as DB
         DataPMT = DB.DataPMT()
 
         self.coeff_blr_pmt = DataPMT.coeff_blr.values
@@ -293,6 +304,7 @@ def filter_sfee_lpf(sfe):
     input: an instance of class Fee
     output: buttersworth parameters of the equivalent LPT FEE filter
     """
+    signal = _signal()
     # LPF order 1
     b1, a1 = signal.butter(1, sfe.freq_LPF1d, 'low', analog=False)
     # LPF order 4
@@ -310,6 +322,7 @@ def filter_fee(feep, ipmt):
            ipmt = pmt number
     output: buttersworth parameters of the equivalent FEE filter
     """
+    signal = _signal()
 
     # print(feep.freq_LHPFd_pmt)
     # print('ipmt = {}, freq_LHPFd_pmt = {}'.format(ipmt,
@@ -353,6 +366,7 @@ def filter_cleaner(feep, ipmt):
     """
     cleans the input signal
     """
+    signal = _signal()
     coef = feep.coeff_c_pmt[ipmt]
     if ipmt == -1:
         coef = feep.coeff_c
@@ -375,6 +389,7 @@ def signal_v_fee(feep, signal_i, ipmt):
     ++++++++++++++++++++++++++++++++++++++++++++++++
 
     """
+    signal = _signal()
     if (feep.noise_FEEPMB_rms == 0.0):
         noise_FEEin = np.zeros(len(signal_i))
     else:
@@ -395,6 +410,7 @@ def signal_v_lpf(feep, signal_in):
     input: instance of class sfe and a current signal
     outputs: signal convolved with LPF in voltage
     """
+    signal = _signal()
     b, a = filter_sfee_lpf(feep)
     return signal.lfilter(b, a, signal_in)
 
@@ -410,6 +426,7 @@ def signal_clean(feep, signal_fee, ipmt):
     ++++++++++++++++++++++++++++++++++++++++++++++++
 
     """
+    signal = _signal()
     b, a = filter_cleaner(feep, ipmt)
     return signal.lfilter(b, a, signal_fee)
 
@@ -421,6 +438,7 @@ def daq_decimator(f_sample1, f_sample2, signal_in):
     f_sample2 (40 Mhz).
     Includes anti-aliasing filter
     """
+    signal = _signal()
 
     scale = int(f_sample1/f_sample2)
     return signal.decimate(signal_in, scale, ftype='fir')
@@ -0,0 +1,172 @@
+import math
+import sqlite3
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import Calib.calib as cal
+import Database.loadDB as DB
+from Benchmarks.stubdb import make_stub_db
+
+XS = np.arange(-20., 120., 0.5)
+
+
+def poissongauss_loop(ps, xs, ngauss=7):
+    """
+    Poisson + gaussian peaks computed one peak at a time
+    """
+    nn, x0, pe, mu, s0, s1 = ps
+    ys = np.zeros_like(xs)
+    for i in range(ngauss):
+        s2 = s0*s0 + i*s1*s1
+        gauss = (np.exp(-(xs - x0 - i*pe)**2/(2.*s2)) /
+                 math.sqrt(2.*math.pi*s2))
+        ys += gauss * mu**i / math.factorial(i)
+    return nn * math.exp(-mu) * ys
+
+
+def ngauss_loop(ps, xs):
+    """
+    Gaussian peaks computed one peak at a time
+    """
+    x0, pe, s0, s1, ns = ps[0], ps[1], ps[2], ps[3], ps[4:]
+    ys = np.zeros_like(xs)
+    for i, n in enumerate(ns):
+        s2 = s0*s0 + i*s1*s1
+        ys += n * np.exp(-(xs - x0 - i*pe)**2/(2.*s2)) / math.sqrt(
+              2.*math.pi*s2)
+    return ys
+
+
+def numerical_jacobian(fun, ps, xs, eps=1e-6):
+    jac = []
+    for i in range(len(ps)):
+        step = eps * max(1., abs(ps[i]))
+        up, down = np.array(ps, dtype=float), np.array(ps, dtype=float)
+        up[i] += step
+        down[i] -= step
+        jac.append((fun(up, xs) - fun(down, xs)) / (2. * step))
+    return np.array(jac).T
+
+
+def test_models_and_jacobians():
+    """
+    Check the vectorized models against a peak by peak computation and
+    their jacobians against finite differences
+    """
+    pg = np.array([20000., 0.5, 16., 1.2, 2., 2.5])
+    ng = np.array([0.5, 16., 2., 2.5, 8000., 5000., 2000., 600., 100.])
+    np.testing.assert_allclose(cal.ffun_poissongauss(pg, XS),
+                               poissongauss_loop(pg, XS), rtol=1e-10)
+    np.testing.assert_allclose(cal.ffun_ngauss(ng, XS), ngauss_loop(ng, XS),
+                               rtol=1e-10)
+    for fun, jac, ps in ((cal.ffun_poissongauss, cal.jfun_poissongauss, pg),
+                         (cal.ffun_ngauss, cal.jfun_ngauss, ng)):
+        expected = numerical_jacobian(fun, ps, XS)
+        np.testing.assert_allclose(jac(ps, XS), expected, rtol=1e-5,
+                                   atol=1e-6 * np.abs(expected).max())
+
+
+def test_fit_with_jacobian():
+    """
+    Check the fit with the analytic jacobian finds the parameters the
+    numerical one does
+    """
+    true = np.array([20000., 0., 17., 1., 2., 2.])
+    ys = np.random.RandomState(1).poisson(
+         cal.ffun_poissongauss(true, XS)).astype(float)
+    numerical = cal.cal_fit_(cal.SIPMS_PGFIT_PS0, XS, ys,
+                             cal.ffun_poissongauss, cal.SIPMS_PGFIT_BOUNDS)
+    analytic = cal.cal_fit_(cal.SIPMS_PGFIT_PS0, XS, ys,
+                            cal.ffun_poissongauss, cal.SIPMS_PGFIT_BOUNDS,
+                            jac=cal.jfun_poissongauss)
+    assert analytic.success
+    np.testing.assert_allclose(analytic.x, numerical.x, rtol=1e-4)
+    assert abs(analytic.x[2] - true[2]) < 0.1
+
+
+def test_warm_start():
+    """
+    Check fits started from a previous calibration give the same results,
+    and restart from the seed when they fail
+    """
+    rng = np.random.RandomState(2)
+    data = cal.CalData(nsensors=4)
+    data.xbins, data.indexes = np.arange(-20., 130., 0.5), [0, 1, 2, 3]
+    data.values = np.array([rng.poisson(cal.ffun_poissongauss(
+                            [20000., 0., gain, 1., 2., 2.], data.xbins))
+                            for gain in (14., 17., 20., 25.)]).astype(float)
+
+    chi2, pss, covs = cal.cal_fit_poissongauss(data)
+    names = ['ntot', 'pedestal', 'gain', 'pes', 'noise', 'noisepe']
+    previous = pd.DataFrame(dict([('indexes', data.indexes), ('chi2', chi2)] +
+                                 [(name, [ps[i] for ps in pss])
+                                  for i, name in enumerate(names)]))
+    pss0 = cal.cal_pss0_from_panda(previous, data.indexes,
+                                   cal.SIPMS_PGFIT_PS0)
+    pss0[3] = np.nan
+    chi2_warm, pss_warm, _ = cal.cal_fit_poissongauss(data, pss0=pss0)
+    np.testing.assert_allclose(chi2_warm, chi2, rtol=1e-4)
+    np.testing.assert_allclose(pss_warm, pss, rtol=1e-3)
+
+
+def test_pss0_from_db(monkeypatch):
+    """
+    Check the gains taken from the database are positive, PMT ones being
+    stored negative, and sensors not in it keep the seed
+    """
+    tmpdir = tempfile.mkdtemp()
+    dbfile = make_stub_db(tmpdir)
+    monkeypatch.setenv("ICDIR", tmpdir)
+    conn = sqlite3.connect(dbfile)
+    conn.execute("update PmtGain set adc_to_pes = -adc_to_pes "
+                 "where SensorID = 1")
+    conn.commit()
+    conn.close()
+    gains = DB.DataPMT()["adc_to_pes"].values
+    assert gains[1] < 0
+
+    pss0 = cal.cal_pss0_from_db([0, 1, 40], cal.SIPMS_PGFIT_PS0, pmts=True)
+    np.testing.assert_allclose(pss0[:2, 2], np.abs(gains[:2]))
+    np.testing.assert_allclose(pss0[2], cal.SIPMS_PGFIT_PS0)
+    np.testing.assert_allclose(np.delete(pss0[:2], 2, axis=1),
+                               np.delete(pss0[2:], 2, axis=1).repeat(2, 0))
+
+
+def test_estimators():
+    """
+    Check the array-wide estimates of the gain and the mean number of pes
+    """
+    rng = np.random.RandomState(3)
+    gains, mus = np.array([13., 17.5, 22., 28.]), np.array([0.5, 1., 2., 3.])
+    data = cal.CalData(nsensors=4)
+    data.xbins, data.indexes = np.arange(-20., 130., 0.5), [0, 1, 2, 3]
+    data.values = np.array([rng.poisson(cal.ffun_poissongauss(
+                            [20000., 0., gain, mu, 2., 2.], data.xbins))
+                            for gain, mu in zip(gains, mus)])
+    np.testing.assert_allclose(cal.cal_est_gain(data), gains, atol=0.3)
+    np.testing.assert_allclose(cal.cal_est_pes(data), mus, rtol=0.1)
+
+
+def test_peaks():
+    """
+    Check the array-wide peak search finds the peaks the wavelet one does,
+    and nothing in empty histograms
+    """
+    rng = np.random.RandomState(4)
+    gains = np.array([14., 19., 24.])
+    data = cal.CalData(nsensors=4)
+    data.xbins, data.indexes = np.arange(-20., 130., 1.), [0, 1, 2, 3]
+    data.values = np.zeros((4, len(data.xbins)), dtype=int)
+    data.values[:3] = [rng.poisson(cal.ffun_poissongauss(
+                       [20000., 0., gain, 1.5, 2., 1.5], data.xbins))
+                       for gain in gains]
+    xpeaks, xrmss = cal.cal_est_peaks(data)
+    xpeaks_cwt, xrmss_cwt = cal.cal_est_peaks_cwt(data, indexes=[0, 1, 2])
+    for i, gain in enumerate(gains):
+        np.testing.assert_allclose(xpeaks[i][:3], gain * np.arange(3),
+                                   atol=0.5)
+        np.testing.assert_allclose(xpeaks[i][:3], xpeaks_cwt[i][:3], atol=1.)
+        np.testing.assert_allclose(xrmss[i][:3], xrmss_cwt[i][:3], atol=0.1)
+    assert len(xpeaks[3]) == len(xrmss[3]) == 0
@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+import numpy as np
+import tables as tb
+import pytest
+
+import Core.tblFunctions as tbl
+from Core.Chain import Chain, read_pmap
+from Core.Nh5 import MCTrack, RunInfo
+
+from test_tbl import write_pmaps
+
+
+def write_files(tmpdir, nevts):
+    """
+    Files with nevt events each: waveforms holding the global event number,
+    MC tracks (two hits per event), run info and pmaps.
+    """
+    filenames, first = [], 0
+    for i, nevt in enumerate(nevts):
+        filenames.append(os.path.join(tmpdir, "file{}.h5".format(i)))
+        with tb.open_file(filenames[-1], "w") as h5f:
+            group = h5f.create_group(h5f.root, "RD")
+            wfs = np.tile(first + np.arange(nevt)[:, None, None], (1, 2, 5))
+            h5f.create_earray(group, "pmtrwf", tb.Int16Atom(),
+                              (0, 2, 5)).append(wfs)
+            group = h5f.create_group(h5f.root, "MC")
+            tracks = h5f.create_table(group, "MCTracks", MCTrack)
+            rows = np.zeros(2 * nevt, dtype=tracks.dtype)
+            rows["event_indx"] = np.repeat(np.arange(nevt), 2)
+            rows["hit_indx"] = np.tile(np.arange(2), nevt)
+            tracks.append(rows)
+            group = h5f.create_group(h5f.root, "Run")
+            info = h5f.create_table(group, "runInfo", RunInfo)
+            info.append([(1000,)])
+            write_pmaps(h5f, nevt, empty=(1,))
+            tbl.build_catalog(h5f)
+        first += nevt
+    return filenames
+
+
+def test_chain_offsets():
+    """
+    Check the global event numbering and the least recently used file
+    handles
+    """
+    tmpdir = tempfile.mkdtemp()
+    with Chain(write_files(tmpdir, (3, 4, 2)), max_open=2) as chain:
+        np.testing.assert_array_equal(chain.offsets, [0, 3, 7, 9])
+        assert len(chain) == 9
+        assert chain.locate(0) == (0, 0)
+        assert chain.locate(3) == (1, 0)
+        assert chain.locate(8) == (2, 1)
+        assert chain.locate(-1) == (2, 1)
+        with pytest.raises(IndexError):
+            chain.locate(9)
+
+        pmtrwf = chain.root.RD.pmtrwf
+        assert pmtrwf.shape == (9, 2, 5)
+        np.testing.assert_array_equal(pmtrwf[:, 0, 0], np.arange(9))
+        np.testing.assert_array_equal(pmtrwf[2:8:2, 1, 0], [2, 4, 6])
+        for evt in (8, 0, 4, 8):
+            assert pmtrwf[evt][0, 0] == evt
+            assert len(chain._handles) <= 2
+        assert list(chain._handles) == [1, 2]
+
+        events = [(local, evt) for _, local, evt in chain.events(2, 5)]
+        assert events == [(2, 2), (0, 3), (1, 4)]
+
+
+def test_chain_tables():
+    """
+    Check event columns are made global and run tables are not repeated
+    """
+    tmpdir = tempfile.mkdtemp()
+    with Chain(write_files(tmpdir, (3, 4, 2)), max_open=1) as chain:
+        tracks = chain.root.MC.MCTracks.read()
+        np.testing.assert_array_equal(tracks["event_indx"],
+                                      np.repeat(np.arange(9), 2))
+        assert chain.root.Run.runInfo.nrows == 1
+
+        pmaps = chain.root.PMAPS.PMaps.read()
+        assert np.all(np.diff(pmaps["event"]) >= 0)
+        assert set(pmaps["event"]) == set(range(9)) - {1, 4, 8}
+
+        with tb.open_file(os.path.join(tmpdir, "copy.h5"), "w") as h5out:
+            group = h5out.create_group(h5out.root, "MC")
+            copy = chain.root.MC.MCTracks.copy(group)
+            np.testing.assert_array_equal(copy.read(), tracks)
+            group = h5out.create_group(h5out.root, "Run")
+            copy = chain.root.Run.runInfo.copy(group)
+            assert copy.read()["run_number"].tolist() == [1000]
+
+        for evt in range(9):
+            h5f, local = chain.event(evt)
+            pmap = read_pmap(chain, evt)
+            assert len(pmap.peaks) == len(read_pmap(h5f, local).peaks)
+            assert len(pmap.peaks) == (0 if evt in (1, 4, 8) else
+                                       local % 2 + 1)
+
+
+def test_chain_event_overflow():
+    """
+    Check global event numbers too large for the column raise an error
+    """
+    tmpdir = tempfile.mkdtemp()
+    with Chain(write_files(tmpdir, (3, 2))) as chain:
+        chain.offsets[1:] += 40000
+        with pytest.raises(ValueError):
+            chain.root.MC.MCTracks.read()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+import numpy as np
+import tables as tb
+import pytest
+
+import Core.system_of_units as units
+import Core.tblFunctions as tbl
+from Benchmarks.stubdb import make_stub_db, NPMT, NSIPM
+from Benchmarks.synthetic import write_mcrd
+from Cities.DIOMIRA import Diomira
+from Cities.DOROTHEA import Dorothea
+
+NEVT = 4
+WINDOW = 100  # mus
+
+
+def run(city, **options):
+    city(dict({"SKIP": 0, "NEVENTS": NEVT, "RUN_ALL": False,
+               "COMPRESSION": "ZLIB4"}, **options)).run()
+
+
+def test_diomira_to_dorothea(monkeypatch):
+    """
+    Run the chain of cities over a synthetic MCRD file and check the shapes
+    of the nodes and the catalog of the RWF and PMAPS files
+    """
+    tmpdir = tempfile.mkdtemp()
+    make_stub_db(tmpdir)
+    monkeypatch.setenv("ICDIR", tmpdir)
+    mcrd = os.path.join(tmpdir, "mcrd.h5")
+    rwf = os.path.join(tmpdir, "rwf.h5")
+    pmaps = os.path.join(tmpdir, "pmaps.h5")
+    write_mcrd(mcrd, NEVT, "kr", WINDOW * units.mus)
+    pmtwl = int(WINDOW * units.mus / (25 * units.ns))
+
+    run(Diomira, FILE_IN=mcrd, FILE_OUT=rwf, NOISE_CUT=0.9)
+    with tb.open_file(rwf) as h5f:
+        assert h5f.root.RD.pmtrwf.shape == (NEVT, NPMT, pmtwl)
+        assert h5f.root.RD.pmtblr.shape == (NEVT, NPMT, pmtwl)
+        assert h5f.root.RD.sipmrwf.shape == (NEVT, NSIPM, WINDOW)
+        assert tbl.get_nevents(h5f) == NEVT
+        catalog = tbl.read_catalog(h5f)
+        np.testing.assert_array_equal(catalog["event"], np.arange(NEVT))
+        for name, path in tbl.CATALOG_TABLES:
+            if path in h5f:
+                ranges = catalog[name]
+                assert ranges[0, 0] == 0
+                assert ranges[-1, 1] == h5f.get_node(path).nrows
+                np.testing.assert_array_equal(ranges[1:, 0], ranges[:-1, 1])
+        events = np.unique(h5f.root.MC.MCTracks.cols.event_indx[:])
+        np.testing.assert_array_equal(events, np.arange(NEVT))
+        assert set(np.unique(h5f.root.TWF.PMT.cols.event[:])) <= \
+            set(range(NEVT))
+
+    # ISIDORA (the deconvolution) needs the compiled cython modules
+    pytest.importorskip("ICython.Sierpe.cBLR")
+    from Cities.ISIDORA import Isidora
+    from Cities.ANASTASIA import Anastasia
+    run(Isidora, FILE_IN=rwf, N_BASELINE=pmtwl // 10, THR_TRIGGER=10,
+        ACUM_DISCHARGE_LENGTH=5000, ACUM_TAU=2500, ACUM_COMPRESS=0.01)
+    run(Anastasia, FILE_IN=rwf, SIPM_ZS_METHOD="FRACTION",
+        PMT_NOISE_CUT_RAW=0.4, PMT_NOISE_CUT_BLR=0.4, SIPM_NOISE_CUT=0.99999)
+    run(Dorothea, FILE_IN=rwf, FILE_OUT=pmaps, WRITE_DST=True)
+
+    with tb.open_file(rwf) as h5f:
+        assert h5f.root.RD.pmtcwf.shape == (NEVT, NPMT, pmtwl)
+        assert h5f.root.ZS.PMT.shape == (NEVT, NPMT, pmtwl)
+        assert h5f.root.ZS.BLR.shape == (NEVT, NPMT, pmtwl)
+        assert h5f.root.ZS.SiPM.shape == (NEVT, NSIPM, WINDOW)
+
+    with tb.open_file(pmaps) as h5f:
+        assert tbl.get_nevents(h5f) == NEVT
+        catalog = tbl.read_catalog(h5f)
+        np.testing.assert_array_equal(catalog["event"], np.arange(NEVT))
+        dst = h5f.root.DST.Events.read()
+        np.testing.assert_array_equal(dst["event"], np.arange(NEVT))
+        np.testing.assert_array_equal(catalog["dst"],
+                                      np.column_stack((np.arange(NEVT),
+                                                       np.arange(1, NEVT + 1))))
+        pmap_table = h5f.root.PMAPS.PMaps
+        assert catalog["pmaps"][-1, 1] == pmap_table.nrows
+        assert pmap_table.nrows
+        assert pmap_table.coldescrs["anode"].shape == (NSIPM,)
+        for evt in range(NEVT):
+            start, stop = tbl.get_event_rows(h5f, "pmaps", evt)
+            assert np.all(pmap_table.read(start, stop)["event"] == evt)
+            pmap = tbl.read_pmap(pmap_table, evt, (start, stop))
+            nS2 = sum(1 for peak in pmap.peaks if peak.signal == "S2")
+            assert dst["nS2"][evt] == nS2
+        # krypton events: one S2 each
+        assert np.all(dst["nS2"] >= 1)
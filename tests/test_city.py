@@ -0,0 +1,201 @@
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+import tables as tb
+
+from Core.City import City
+
+
+class Doubler(City):
+    """
+    Toy city: doubles the waveforms and stores their sum.
+    """
+    name = "DOUBLER"
+    input_nodes = {"wf": "/RD/pmtrwf"}
+    output_arrays = {"wf2": "/OUT/wf2", "total": "/OUT/total"}
+    batch_stages = ("double",)
+    stages = ("integrate",)
+
+    def create_output(self, h5in, h5out):
+        group = h5out.create_group(h5out.root, "OUT")
+        h5out.create_earray(group, "wf2", tb.Int32Atom(),
+                            (0,) + h5in.root.RD.pmtrwf.shape[1:])
+        h5out.create_earray(group, "total", tb.Int64Atom(), (0,))
+
+    def double(self, start, stop, batch):
+        batch["wf2"] = 2 * batch["wf"].astype(np.int32)
+
+    def integrate(self, evt, event):
+        event["total"] = event["wf2"].sum()
+
+
+class SUMS(tb.IsDescription):
+    event = tb.Int32Col(pos=0)
+    total = tb.Int64Col(pos=1)
+
+
+class TableDoubler(Doubler):
+    """
+    Doubler with a table written at creation and one filled per event.
+    """
+    def create_output(self, h5in, h5out):
+        Doubler.create_output(self, h5in, h5out)
+        h5out.create_table(h5out.root.OUT, "info", SUMS).append([(-1, 7)])
+        h5out.create_table(h5out.root.OUT, "sums", SUMS)
+
+    def write(self, h5out, evt, event):
+        h5out.root.OUT.sums.append([(evt, event["total"])])
+
+
+class InPlaceDoubler(Doubler):
+    """
+    Doubler writing into its input file.
+    """
+    in_place = True
+
+    def create_output(self, h5in, h5out):
+        if "/OUT" in h5out:
+            h5out.remove_node("/OUT", recursive=True)
+        Doubler.create_output(self, h5in, h5out)
+
+
+class NoisyDoubler(TableDoubler):
+    """
+    TableDoubler with some noise on the total, which crashes when writing
+    event *crash*.
+    """
+    stages = ("integrate", "noise")
+    crash = None
+
+    def noise(self, evt, event):
+        event["total"] += np.random.randint(100)
+
+    def write(self, h5out, evt, event):
+        if evt == self.crash:
+            raise RuntimeError("crash")
+        TableDoubler.write(self, h5out, evt, event)
+
+
+def write_input(filename, nevt):
+    with tb.open_file(filename, "w") as h5f:
+        group = h5f.create_group(h5f.root, "RD")
+        array = h5f.create_earray(group, "pmtrwf", tb.Int16Atom(), (0, 3, 5))
+        array.append(np.arange(nevt * 15, dtype=np.int16).reshape(nevt, 3, 5))
+
+
+def test_city_batches_and_jobs():
+    """
+    Check the output does not depend on the batch size nor on the number of
+    processes, and that events cross file boundaries in a chain
+    """
+    tmpdir = tempfile.mkdtemp()
+    inputs = [os.path.join(tmpdir, "in{}.h5".format(i)) for i in range(2)]
+    write_input(inputs[0], 4)
+    write_input(inputs[1], 3)
+    expected = np.concatenate([np.arange(60).reshape(4, 3, 5),
+                               np.arange(45).reshape(3, 3, 5)])[1:6] * 2
+
+    for njobs, batch in ((1, 1), (1, 4), (2, 3)):
+        output = os.path.join(tmpdir, "out{}{}.h5".format(njobs, batch))
+        Doubler({"FILE_IN": inputs, "FILE_OUT": output, "SKIP": 1,
+                 "NEVENTS": 6, "RUN_ALL": False, "COMPRESSION": "ZLIB4",
+                 "NJOBS": njobs, "BATCH_SIZE": batch}).run()
+        with tb.open_file(output) as h5out:
+            np.testing.assert_array_equal(h5out.root.OUT.wf2[:], expected)
+            np.testing.assert_array_equal(h5out.root.OUT.total[:],
+                                          expected.sum(axis=(1, 2)))
+
+
+def test_timing_report():
+    """
+    Check the JSON timing report has the stages and the data volumes
+    """
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, "in.h5")
+    write_input(filename, 10)
+    output = os.path.join(tmpdir, "out.h5")
+    Doubler({"FILE_IN": filename, "FILE_OUT": output, "SKIP": 0,
+             "NEVENTS": 10, "RUN_ALL": False, "COMPRESSION": "ZLIB4",
+             "TIMING": ""}).run()
+
+    with open(os.path.join(tmpdir, "out.timing.json")) as sidecar:
+        report = json.load(sidecar)
+    assert report["events"] == 10
+    assert set(report["stages"]) == {"read", "double", "integrate", "write",
+                                     "write_wait"}
+    assert report["mb_read"] * 2**20 == 10 * 3 * 5 * 2
+    assert report["mb_written"] * 2**20 == 10 * 3 * 5 * 4 + 10 * 8
+
+
+def test_shards():
+    """
+    Check a sharded run produces the same output as a single process, both
+    for a new output file and in place
+    """
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, "in.h5")
+    write_input(filename, 10)
+    for name in ("serial", "sharded"):
+        shutil.copy(filename, os.path.join(tmpdir, name + ".h5"))
+
+    outputs = []
+    for name, shards in (("serial", 1), ("sharded", 3)):
+        CFP = {"SKIP": 1, "NEVENTS": 9, "RUN_ALL": False,
+               "COMPRESSION": "ZLIB4", "SHARDS": shards}
+        TableDoubler(dict(CFP, FILE_IN=filename,
+                          FILE_OUT=os.path.join(tmpdir, name + "_out.h5"))
+                     ).run()
+        InPlaceDoubler(dict(CFP, FILE_IN=os.path.join(tmpdir, name + ".h5"))
+                       ).run()
+        outputs.append([os.path.join(tmpdir, name + suffix)
+                        for suffix in ("_out.h5", ".h5")])
+
+    for serial, sharded in zip(*outputs):
+        with tb.open_file(serial) as h5s, tb.open_file(sharded) as h5p:
+            for node in h5s.walk_nodes("/OUT", "Leaf"):
+                np.testing.assert_array_equal(
+                    h5p.get_node(node._v_pathname).read(), node.read())
+    with tb.open_file(outputs[1][0]) as h5out:
+        assert h5out.root.OUT.info.nrows == 1
+        np.testing.assert_array_equal(h5out.root.OUT.sums.cols.event[:],
+                                      np.arange(1, 9))
+    assert not [f for f in os.listdir(tmpdir) if f.startswith(".shards_")]
+
+
+def test_resume():
+    """
+    Check a run resumed after a crash gives the same output as a run without
+    interruption, with and without per-event seeds
+    """
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, "in.h5")
+    write_input(filename, 10)
+
+    for seed in (None, 1):
+        CFP = {"FILE_IN": filename, "SKIP": 0, "NEVENTS": 10,
+               "RUN_ALL": False, "COMPRESSION": "ZLIB4", "BATCH_SIZE": 3,
+               "SEED": seed}
+        full = os.path.join(tmpdir, "full.h5")
+        np.random.seed(2)
+        NoisyDoubler(dict(CFP, FILE_OUT=full)).run()
+
+        output = os.path.join(tmpdir, "resumed.h5")
+        np.random.seed(2)
+        city = NoisyDoubler(dict(CFP, FILE_OUT=output))
+        city.crash = 7
+        try:
+            city.run()
+        except RuntimeError:
+            pass
+        with tb.open_file(output) as h5out:
+            assert h5out.root.OUT.total.nrows == 9
+        np.random.seed(3)
+        NoisyDoubler(dict(CFP, FILE_OUT=output, RESUME=True)).run()
+
+        with tb.open_file(full) as h5f, tb.open_file(output) as h5r:
+            for node in h5f.walk_nodes("/OUT", "Leaf"):
+                np.testing.assert_array_equal(
+                    h5r.get_node(node._v_pathname).read(), node.read())
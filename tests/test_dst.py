@@ -0,0 +1,80 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import tables as tb
+
+import Core.tblFunctions as tbl
+from Core.Bridges import Peak, PMap, Signal
+from Core.Nh5 import PMAP, PMAP_DST
+from Cities.DOROTHEA import pmap_summary
+
+NSIPM = 1792
+
+
+def peak(times, cathode, signal, anode=None):
+    """
+    Peak with one time over threshold sample per slice and, by default, no
+    anode signal
+    """
+    times = np.asarray(times, dtype=float)
+    if anode is None:
+        anode = np.zeros((times.size, NSIPM))
+    return Peak(times, np.asarray(cathode, dtype=float), anode,
+                np.ones(times.size), signal)
+
+
+def test_pmap_summary():
+    """
+    Check the summary of pmaps with known peaks, including events without
+    S1, without S2 and without peaks, after a round trip through the
+    PMaps and DST tables
+    """
+    sipmdf = pd.DataFrame({"X": np.arange(NSIPM) * 10.,
+                           "Y": np.arange(NSIPM) * -5.})
+    anode = np.zeros((3, NSIPM))
+    anode[1, 4] = 30.
+    anode[2, 6] = 10.
+    anode[0, 100] = 1.  # below the baricenter threshold
+    s1_small = peak([100., 101.], [1., 2.], Signal.S1)
+    s1 = peak([200., 201., 202.], [3., 6., 4.], Signal.S1)
+    s2 = peak([500., 501., 502.], [100., 400., 300.], Signal.S2, anode)
+    s2_small = peak([700.], [50.], Signal.S2)
+    unknown = peak([900.], [1000.], Signal.UNKNOWN)
+    pmaps = [PMap(peaks=[s1_small, s2, s1, s2_small, unknown]),
+             PMap(peaks=[s2, unknown]),
+             PMap(peaks=[s1]),
+             PMap(peaks=[])]
+
+    filename = os.path.join(tempfile.mkdtemp(), "dst.h5")
+    with tb.open_file(filename, "w") as h5f:
+        pmap_table = h5f.create_table(h5f.root, "PMaps", PMAP)
+        dst_table = h5f.create_table(h5f.root, "Events", PMAP_DST)
+        for evt, pmap in enumerate(pmaps):
+            tbl.store_pmap(pmap, pmap_table, evt)
+        for evt in range(len(pmaps)):
+            pmap = tbl.read_pmap(pmap_table, evt)
+            tbl.store_dst(pmap_summary(pmap, sipmdf), dst_table, evt)
+        dst = tbl.read_dst(dst_table)
+        columns = dst_table.colnames
+
+    x = (30. * 40. + 10. * 60.) / 40.
+    y = -x / 2.
+    no_s1 = {"nS1": 0, "S1e": -1., "S1w": -1., "S1h": -1., "S1t": -1.,
+             "DT": -1.}
+    no_s2 = {"nS2": 0, "S2e": -1., "S2w": -1., "S2h": -1., "S2t": -1.,
+             "S2q": -1., "DT": -1., "X": 1e4, "Y": 1e4}
+    both = {"nS1": 2, "nS2": 2, "S1e": 13., "S1w": 3., "S1h": 6.,
+            "S1t": 201., "S2e": 800., "S2w": 3., "S2h": 400., "S2t": 501.,
+            "S2q": 41., "DT": 300., "X": x, "Y": y}
+    expected = pd.DataFrame([both,
+                             dict(both, nS2=1, **no_s1),
+                             dict(both, nS1=1, **no_s2),
+                             dict(both, **dict(no_s1, **no_s2))])
+    expected.insert(0, "event", np.arange(len(pmaps)))
+
+    assert list(dst.columns) == columns
+    for column in expected:
+        np.testing.assert_allclose(dst[column], expected[column], rtol=1e-6,
+                                   err_msg=column)
@@ -0,0 +1,172 @@
+import os
+import tempfile
+
+import numpy as np
+import tables as tb
+
+import Core.tblFunctions as tbl
+from Core.Chain import Chain
+from Core.Bridges import Peak, PMap, Signal
+from Core.Nh5 import PMAP
+from Filters.Baseline import Baseline
+from Filters.Min_charge import Min_charge
+from Filters.Min_energy import Min_energy
+from Filters.NumberS1S2 import NumberS1S2
+from Filters.PerEvent import PerEvent, batch_filters
+
+NEVT, NPMT, PMTWL, NSIPM, SIPMWL = 12, 3, 800, 8, 400
+
+
+def write_events(filename, nevt=NEVT, catalog=True, seed=1):
+    """
+    File with the nodes read by the filters: pulses of random size in the
+    PMTs and SiPMs, waveforms lifted at the end in some events and pmaps
+    with 0-2 S1 and 0-2 S2 peaks
+    """
+    rng = np.random.RandomState(seed)
+    pmtcwf = rng.normal(0., 2., (nevt, NPMT, PMTWL))
+    pmtcwf[..., 300:340] += rng.uniform(0., 20., (nevt, NPMT, 1))
+    pmtcwf[rng.rand(nevt) < 0.3, :, -20:] += 30
+    pmtblr = np.round(3000 + rng.normal(0., 2., pmtcwf.shape))
+    pmtblr[rng.rand(nevt) < 0.3, :, -30:] += 40
+    sipmrwf = np.round(50 + rng.normal(0., 1., (nevt, NSIPM, SIPMWL)))
+    sipmrwf[:, :, 200:203] += rng.uniform(0., 15., (nevt, NSIPM, 1))
+    with tb.open_file(filename, "w") as h5f:
+        group = h5f.create_group(h5f.root, "RD")
+        for name, data in (("pmtrwf", 2500 - pmtcwf), ("pmtcwf", pmtcwf),
+                           ("pmtblr", pmtblr), ("sipmrwf", sipmrwf)):
+            h5f.create_earray(group, name, tb.Int16Atom(),
+                              (0,) + data.shape[1:]).append(data)
+        group = h5f.create_group(h5f.root, "ZS")
+        for name, data in (("PMT", pmtcwf), ("BLR", pmtcwf),
+                           ("SiPM", sipmrwf - 50)):
+            zs = np.where(data > 5, data, 0)
+            h5f.create_earray(group, name, tb.Int16Atom(),
+                              (0,) + zs.shape[1:]).append(zs)
+
+        group = h5f.create_group(h5f.root, "PMAPS")
+        table = h5f.create_table(group, "PMaps", PMAP)
+        for evt in range(nevt):
+            peaks = []
+            for signal, n in ((Signal.S1, rng.randint(3)),
+                              (Signal.S2, rng.randint(3)),
+                              (Signal.UNKNOWN, rng.randint(2))):
+                for _ in range(n):
+                    peaks.append(Peak(np.arange(2.), np.ones(2),
+                                      np.ones((2, 1792)), np.ones(2),
+                                      signal))
+            tbl.store_pmap(PMap(peaks=peaks), table, evt)
+        if catalog:
+            tbl.build_catalog(h5f)
+
+
+FILTERS = (Baseline(max_adc=10),
+           Baseline(max_adc=20, apply_on="BLR"),
+           Min_charge(min_signal=14.5),
+           Min_charge(min_signal=13, sipm_selection=[1, 3, 5]),
+           Min_charge(min_signal=50, integrate_wf=True),
+           Min_energy(min_signal=1500),
+           Min_energy(min_signal=1500, apply_on="CWF"),
+           Min_energy(min_signal=NPMT * PMTWL * 2500 - 2700,
+                      apply_on="RWF"),
+           NumberS1S2(nS1=2, nS2=1),
+           NumberS1S2(nS1=0, nS2=2))
+
+
+def test_select_matches_call():
+    """
+    Check the batch selection of every filter against the per-event one,
+    on blocks of events with and without a previous selection (only the
+    selected events must match), with and without an event catalog
+    """
+    tmpdir = tempfile.mkdtemp()
+    selection = np.random.RandomState(2).rand(NEVT) < 0.6
+    for catalog in (True, False):
+        filename = os.path.join(tmpdir, "events{}.h5".format(catalog))
+        write_events(filename, catalog=catalog)
+        with tb.open_file(filename) as h5f:
+            for filter_ in FILTERS:
+                expected = np.array([filter_(h5f, i) for i in range(NEVT)])
+                assert 0 < expected.sum() < NEVT
+                np.testing.assert_array_equal(
+                    filter_.select(h5f, 0, NEVT), expected)
+                for start, stop in ((0, 5), (5, NEVT), (3, 4)):
+                    mask = filter_.select(h5f, start, stop,
+                                          selection[start:stop])
+                    sel = selection[start:stop]
+                    assert mask.shape == (stop - start,)
+                    np.testing.assert_array_equal(mask[sel],
+                                                  expected[start:stop][sel])
+
+
+def test_per_event():
+    """
+    Check PerEvent evaluates a per-event filter on the selected events only
+    """
+    calls = []
+
+    def even(f, i):
+        calls.append(i)
+        return i % 2 == 0
+
+    filter_ = PerEvent(even)
+    assert filter_.cost == 100
+    assert PerEvent(even, cost=3).cost == 3
+    np.testing.assert_array_equal(filter_.select(None, 10, 15),
+                                  [True, False, True, False, True])
+    assert calls == list(range(10, 15))
+
+    del calls[:]
+    selection = np.array([False, True, True, False, False])
+    np.testing.assert_array_equal(filter_.select(None, 10, 15, selection),
+                                  [False, False, True, False, False])
+    assert calls == [11, 12]
+
+
+def test_batch_filters():
+    """
+    Check filters are sorted by cost, equal costs keeping their order, and
+    per-event ones are wrapped
+    """
+    def any_event(f, i):
+        return True
+
+    class Costly:
+        cost = 50
+
+        def __call__(self, f, i):
+            return True
+
+    min_charge = Min_charge(min_signal=1)
+    blr = Baseline(max_adc=1, apply_on="BLR")
+    cwf = Baseline(max_adc=1)
+    energy = Min_energy(min_signal=1)
+    costly = Costly()
+    filters = batch_filters([any_event, min_charge, blr, costly, cwf,
+                             energy])
+    assert all(hasattr(f, "select") for f in filters)
+    assert [f.cost for f in filters] == [1, 1, 5, 10, 50, 100]
+    assert filters[:4] == [cwf, energy, blr, min_charge]
+    assert filters[4].filter_ is costly
+    assert filters[5].filter_ is any_event
+
+
+def test_select_chain():
+    """
+    Check the batch selection on a chain of files, with blocks spanning
+    both files and empty ones, against the per-event one
+    """
+    tmpdir = tempfile.mkdtemp()
+    filenames = [os.path.join(tmpdir, "chain{}.h5".format(i))
+                 for i in range(2)]
+    for i, filename in enumerate(filenames):
+        write_events(filename, catalog=i == 0, seed=i + 3)
+    with Chain(filenames, max_open=1) as chain:
+        for filter_ in FILTERS:
+            expected = np.array([filter_(chain, i)
+                                 for i in range(2 * NEVT)])
+            for start, stop in ((0, 2 * NEVT), (NEVT - 3, NEVT + 2),
+                                (NEVT + 1, 2 * NEVT), (4, 4)):
+                np.testing.assert_array_equal(
+                    filter_.select(chain, start, stop),
+                    expected[start:stop])
@@ -0,0 +1,85 @@
+import numpy as np
+
+import Core.fitFunctions as fitf
+
+
+def profile_loop(xdata, ydata, edges):
+    """
+    Mean and error of ydata in each closed bin of xdata, one bin at a time.
+    """
+    means, errs = [], []
+    for x0, x1 in zip(edges[:-1], edges[1:]):
+        bin_data = ydata[fitf.in_range(xdata, x0, x1)]
+        means.append(bin_data.mean() if bin_data.size else np.nan)
+        errs.append(bin_data.std() / bin_data.size**0.5
+                    if bin_data.size else np.nan)
+    return np.array(means), np.array(errs)
+
+
+def test_profiles():
+    """
+    Check the single pass profiles against a bin by bin computation, with
+    values lying on the bin edges
+    """
+    rng = np.random.RandomState(1)
+    x = rng.randint(0, 20, 5000).astype(float)
+    y = rng.randint(-5, 5, 5000).astype(float)
+    z = rng.normal(1e4, 3., 5000)
+
+    xs, ys, errs = fitf.profileX(x, z, 9, drop_nan=False)
+    edges = np.linspace(0., 19., 10)
+    np.testing.assert_allclose(xs, edges[:-1] + np.diff(edges) / 2.)
+    np.testing.assert_allclose((ys, errs), profile_loop(x, z, edges),
+                               rtol=1e-12)
+
+    xs, ys, errs = fitf.profileY(z, y, 5, yrange=(-2, 2), drop_nan=False)
+    np.testing.assert_allclose((ys, errs),
+                               profile_loop(y, z, np.linspace(-2., 2., 6)),
+                               rtol=1e-12)
+
+    xs, ys, zs, errs = fitf.profileXY(x, y, z, 9, 4, yrange=(-2, 2))
+    yedges = np.linspace(-2., 2., 5)
+    for j, (y0, y1) in enumerate(zip(yedges[:-1], yedges[1:])):
+        selection = fitf.in_range(y, y0, y1)
+        np.testing.assert_allclose((zs[:, j], errs[:, j]),
+                                   profile_loop(x[selection], z[selection],
+                                                edges),
+                                   rtol=1e-12)
+
+    xs, counts = fitf.projectionX(x, y, 9, yrange=(-2, 2))
+    selection = fitf.in_range(y, -2, 2)
+    np.testing.assert_array_equal(
+        counts, [fitf.in_range(x[selection], x0, x1).sum()
+                 for x0, x1 in zip(edges[:-1], edges[1:])])
+
+
+def test_zero_width_range():
+    """
+    Check the profiles and projections of a range of zero width (constant
+    data or equal limits), where the values in range fall in every bin
+    """
+    rng = np.random.RandomState(2)
+    x = np.ones(10)
+    y = rng.normal(5., 1., 10)
+
+    xs, counts = fitf.projectionX(x, y, 4)
+    np.testing.assert_array_equal(counts, [10, 10, 10, 10])
+    xs, counts = fitf.projectionY(y, x, 3)
+    np.testing.assert_array_equal(counts, [10, 10, 10])
+
+    edges = np.ones(5)
+    xs, ys, errs = fitf.profileX(x, y, 4, drop_nan=False)
+    np.testing.assert_allclose((ys, errs), profile_loop(x, y, edges),
+                               rtol=1e-12)
+    np.testing.assert_allclose(ys, y.mean())
+
+    x = rng.randint(0, 3, 10).astype(float)
+    xs, ys, errs = fitf.profileX(x, y, 2, xrange=(1, 1), drop_nan=False)
+    np.testing.assert_allclose((ys, errs),
+                               profile_loop(x, y, np.ones(3)), rtol=1e-12)
+
+    xs, ys, zs, errs = fitf.profileXY(x, np.ones(10), y, 2, 3)
+    for j in range(3):
+        np.testing.assert_allclose((zs[:, j], errs[:, j]),
+                                   profile_loop(x, y, np.linspace(0, 2, 3)),
+                                   rtol=1e-12)
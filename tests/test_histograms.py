@@ -0,0 +1,96 @@
+import os
+import tempfile
+
+import numpy as np
+import tables as tb
+
+import Core.fitFunctions as fitf
+import Core.Histograms as hst
+
+
+def data(n=20000, seed=1):
+    rng = np.random.RandomState(seed)
+    x = rng.randint(-50, 50, n) * 2.
+    y = rng.normal(0., 40., n)
+    z = rng.normal(1e4 - x, 30.)
+    return x, y, z
+
+
+def test_chunks_and_merge():
+    """
+    Check accumulators filled in chunks and merged give the results of the
+    functions over the whole dataset
+    """
+    x, y, z = data()
+    half = len(x) // 2
+    accumulators = []
+    for part in (slice(None, half), slice(half, None)):
+        accumulators.append((
+            hst.fill_chunks(hst.Histogram1D(40, (-100, 100)), (x[part],),
+                            chunksize=3000),
+            hst.fill_chunks(hst.Histogram2D(20, 10, (-100, 100), (-50, 50)),
+                            (x[part], y[part]), weights=z[part],
+                            chunksize=3000),
+            hst.fill_chunks(hst.Profile1D(40, (-100, 100), (9000, 11000)),
+                            (x[part], z[part]), chunksize=3000),
+            hst.fill_chunks(hst.Profile2D(20, 10, (-100, 100), (-50, 50)),
+                            (x[part], y[part], z[part]), chunksize=3000)))
+    h1, h2, p1, p2 = [sum(parts) for parts in zip(*accumulators)]
+
+    assert h1.entries == len(x)
+    np.testing.assert_array_equal(h1.counts,
+                                  np.histogram(x, 40, (-100, 100))[0])
+    counts, _, _ = np.histogram2d(x, y, (20, 10), ((-100, 100), (-50, 50)),
+                                  weights=z)
+    np.testing.assert_allclose(h2.counts, counts, rtol=1e-12)
+    np.testing.assert_allclose(h2.projection(0).counts, counts.sum(axis=1),
+                               rtol=1e-12)
+
+    for profile, expected in ((p1.profile(),
+                               fitf.profileX(x, z, 40, (-100, 100),
+                                             (9000, 11000))),
+                              (p2.profile(),
+                               fitf.profileXY(x, y, z, 20, 10, (-100, 100),
+                                              (-50, 50)))):
+        for values, expected_values in zip(profile, expected):
+            np.testing.assert_allclose(values, expected_values, rtol=1e-9)
+
+    _, vals, _ = p1.fit("polynom", (1e4, 0.))
+    np.testing.assert_allclose(vals, (1e4, -1.), rtol=1e-2)
+
+    try:
+        h1 + hst.Histogram1D(20, (-100, 100))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Added histograms with different binnings")
+
+
+def test_store_and_read():
+    """
+    Check the accumulators are read back as they were written
+    """
+    x, y, z = data(2000)
+    h1 = hst.Histogram1D(30, (-60, 60))
+    h1.fill(x)
+    p2 = hst.Profile2D(10, 10, (-100, 100), (-50, 50), (9800, 1e4))
+    p2.fill(x, y, z)
+    fd, filename = tempfile.mkstemp(suffix=".h5")
+    os.close(fd)
+    try:
+        with tb.open_file(filename, "w") as h5out:
+            h1.store(h5out.root, "h1")
+            p2.store(h5out.root, "p2", filters=tb.Filters(complevel=1))
+        with tb.open_file(filename) as h5in:
+            for name, accumulator in (("h1", h1), ("p2", p2)):
+                read = hst.read(h5in.get_node("/", name))
+                assert type(read) is type(accumulator)
+                assert read.nbins == accumulator.nbins
+                assert read.ranges == accumulator.ranges
+                assert read.entries == accumulator.entries
+                assert read.attributes == accumulator.attributes
+                for name in accumulator.attributes + accumulator.fields:
+                    np.testing.assert_array_equal(getattr(read, name),
+                                                  getattr(accumulator, name))
+    finally:
+        os.remove(filename)
@@ -0,0 +1,132 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import tables as tb
+import pytest
+
+from Core.Chain import Chain
+from Core.Nh5 import MCTrack
+import Core.mcFunctions as mcf
+
+
+def write_tracks(filename, nevt=5, seed=1):
+    """
+    MCTracks table with a few tracks per event, the last events first
+    """
+    rng = np.random.RandomState(seed)
+    with tb.open_file(filename, "w") as h5f:
+        table = h5f.create_table(h5f.create_group(h5f.root, "MC"),
+                                 "MCTracks", MCTrack, "MC tracks")
+        rows = []
+        for evt in range(nevt):
+            for trk in range(rng.randint(1, 4)):
+                nhits = rng.randint(1, 6)
+                for hit in range(nhits):
+                    rows.append((evt, trk, "e-", 11, rng.normal(size=3),
+                                 rng.normal(size=3), rng.normal(size=3),
+                                 rng.uniform(), nhits, hit,
+                                 rng.normal(size=3), rng.uniform(),
+                                 rng.uniform()))
+        rows = rows[len(rows) // 2:] + rows[:len(rows) // 2]
+        table.append(rows)
+
+
+def hits_loop(table, event_number, particle_number):
+    """
+    Hits of a track found scanning the table
+    """
+    rows = [row.fetch_all_fields() for row in table.iterrows()
+            if row["event_indx"] == event_number and
+            row["mctrk_indx"] == particle_number]
+    return pd.DataFrame({"x": [row["hit_position"][0] for row in rows],
+                         "y": [row["hit_position"][1] for row in rows],
+                         "z": [row["hit_position"][2] for row in rows],
+                         "time": [row["hit_time"] for row in rows],
+                         "energy": [row["hit_energy"] for row in rows]})
+
+
+def test_mctruth():
+    """
+    Check the tracks and hits of the columnar accessor against a scan of
+    the table, that they are views of its columns, and the copy of a
+    range of events
+    """
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, "mc.h5")
+    write_tracks(filename)
+    with tb.open_file(filename) as h5f:
+        table = h5f.root.MC.MCTracks
+        truth = mcf.MCTruth(table, chunksize=7)
+        assert len(truth) == table.nrows
+        np.testing.assert_array_equal(truth.events, np.arange(5))
+        for evt in range(6):
+            tracks = mcf.get_mctrks(truth, evt)
+            first_hits = table.read_where("(event_indx == evt) & "
+                                          "(hit_indx == 0)")
+            first_hits.sort(order="mctrk_indx")
+            np.testing.assert_array_equal(tracks["energy"],
+                                          first_hits["energy"])
+            np.testing.assert_array_equal(np.array(list(tracks["vxi"])).
+                                          reshape(-1, 3),
+                                          first_hits["initial_vertex"])
+            for trk in range(4):
+                hits = mcf.get_mchits(truth, evt, trk)
+                pd.testing.assert_frame_equal(
+                    hits[["x", "y", "z", "time", "energy"]],
+                    hits_loop(table, evt, trk), check_dtype=False)
+        pd.testing.assert_frame_equal(mcf.get_mchits(table, 2, 1),
+                                      mcf.get_mchits(truth, 2, 1))
+        hits = truth.hits(2, 0)
+        assert np.shares_memory(hits["hit_energy"],
+                                truth.columns["hit_energy"])
+
+        with tb.open_file(os.path.join(tmpdir, "copy.h5"), "w") as h5out:
+            copy = truth.copy(h5out.root, events=[3, 1, 2])
+            expected = np.sort(table.read_where("(event_indx >= 1) & "
+                                                "(event_indx <= 3)"),
+                               order=["event_indx", "mctrk_indx",
+                                      "hit_indx"])
+            np.testing.assert_array_equal(copy.read(), expected)
+
+
+def test_mctruth_chain():
+    """
+    Check a MCTruth built from a chain numbers the events globally and
+    holds the tracks of each file, and that a copy refuses event numbers
+    that do not fit in the table
+    """
+    tmpdir = tempfile.mkdtemp()
+    filenames = [os.path.join(tmpdir, "mc{}.h5".format(i)) for i in range(3)]
+    for i, filename in enumerate(filenames):
+        write_tracks(filename, nevt=4, seed=i)
+        with tb.open_file(filename, "a") as h5f:
+            h5f.create_array(h5f.root, "pmtrd", np.zeros((4, 1, 1), np.int16))
+
+    with Chain(filenames, max_open=1) as chain:
+        np.testing.assert_array_equal(chain.offsets, [0, 4, 8, 12])
+        truth = mcf.MCTruth(chain.root.MC.MCTracks, chunksize=5)
+        np.testing.assert_array_equal(truth.events, np.arange(12))
+        assert len(truth) == chain.root.MC.MCTracks.nrows
+        for i, filename in enumerate(filenames):
+            with tb.open_file(filename) as h5f:
+                local = mcf.MCTruth(h5f.root.MC.MCTracks)
+            for evt in range(4):
+                for trk in range(4):
+                    pd.testing.assert_frame_equal(
+                        mcf.get_mchits(truth, 4 * i + evt, trk),
+                        mcf.get_mchits(local, evt, trk))
+
+        with tb.open_file(os.path.join(tmpdir, "copy.h5"), "w") as h5out:
+            copy = truth.copy(h5out.root, events=np.arange(2, 10))
+            np.testing.assert_array_equal(np.unique(copy.cols.event_indx[:]),
+                                          np.arange(2, 10))
+
+            chain.offsets[1:] += 40000
+            truth = mcf.MCTruth(chain.root.MC.MCTracks)
+            assert truth.events[-1] == 40011
+            copy = truth.copy(h5out.root, events=[0, 1], newname="first")
+            assert copy.nrows
+            with pytest.raises(ValueError):
+                truth.copy(h5out.root, newname="overflow")
@@ -0,0 +1,237 @@
+import os
+import tempfile
+
+import numpy as np
+import tables as tb
+
+import Core.tblFunctions as tbl
+from Core.Nh5 import SENSOR_WF
+from Filters.file_merger import file_merger
+from Filters.Baseline import Baseline
+from Filters.Min_charge import Min_charge
+from Filters.Min_energy import Min_energy
+from Filters.NumberS1S2 import NumberS1S2
+from Filters.PerEvent import batch_filters
+
+from test_filters import NEVT as FILTER_NEVT, write_events
+
+NPMT, PMTWL, NSIPM, SIPMWL = 3, 600, 16, 40
+
+
+def write_rd(filename, nevt, encoding=None, seed=1):
+    """
+    RD file with a pulse in the PMTs of every event, a SiPM signal in the
+    odd events and the BLR waveform lifted at the end in every third event
+    """
+    rng = np.random.RandomState(seed)
+    pmtrwf = np.round(2500 + rng.normal(0., 2., (nevt, NPMT, PMTWL)))
+    pmtrwf[..., 300:320] -= 500
+    pmtblr = np.round(3000 + rng.normal(0., 2., (nevt, NPMT, PMTWL)))
+    pmtblr[::3, :, -20:] += 50
+    sipmrwf = np.round(50 + rng.normal(0., 1., (nevt, NSIPM, SIPMWL)))
+    sipmrwf[1::2, 3, 20] += 100
+    with tb.open_file(filename, "w") as h5f:
+        group = h5f.create_group(h5f.root, "RD")
+        for name, data in (("pmtrwf", pmtrwf), ("pmtblr", pmtblr),
+                           ("sipmrwf", sipmrwf)):
+            tbl.create_wf_array(group, name, data.shape[1:],
+                                encoding=encoding).append(data)
+
+
+def read_nodes(filename):
+    """
+    Contents of every array and table of a file, indexed by path.
+    """
+    with tb.open_file(filename) as h5f:
+        return {node._v_pathname: node.read()
+                for node in h5f.walk_nodes("/", "Leaf")}
+
+
+def read_rd(filename):
+    with tb.open_file(filename) as h5f:
+        encodings = {name: tbl.get_wf_encoding(h5f, "/RD/" + name)
+                     for name in ("pmtrwf", "pmtblr", "sipmrwf")}
+        data = {name: tbl.get_wf_array(h5f, "/RD/" + name).read()
+                for name in encodings}
+    return data, encodings
+
+
+def test_merger_encoded():
+    """
+    Check that filtering and merging an encoded file gives the same
+    waveforms as the plain one, and that the output stays encoded
+    """
+    tmpdir = tempfile.mkdtemp()
+    options = {"FILTERS": ["Min_charge", "Baseline"], "RAISE_ERRORS": True,
+               "CHUNK_SIZE": 3, "Min_charge:min_signal": 20,
+               "Baseline:max_adc": 20, "Baseline:apply_on": "BLR"}
+    outputs = {}
+    for encoding in (None, "diff"):
+        name = encoding or "plain"
+        inputs = []
+        for i in range(2):
+            inputs.append(os.path.join(tmpdir, "{}{}.h5".format(name, i)))
+            write_rd(inputs[-1], 7, encoding, seed=i)
+        outputs[name] = (os.path.join(tmpdir, name + "_out.h5"),
+                         os.path.join(tmpdir, name + "_dis.h5"))
+        file_merger(outputs[name][0], outputs[name][1], *inputs,
+                    **dict(options))
+
+    for plain, encoded in zip(outputs["plain"], outputs["diff"]):
+        plain_data, plain_encodings = read_rd(plain)
+        encoded_data, encoded_encodings = read_rd(encoded)
+        assert set(plain_encodings.values()) == {None}
+        assert set(encoded_encodings.values()) == {"diff"}
+        for name, data in plain_data.items():
+            np.testing.assert_array_equal(encoded_data[name], data)
+
+    # odd events have SiPM signal, every third one a lifted BLR
+    selected = [i for i in range(7) if i % 2 and i % 3]
+    data, _ = read_rd(outputs["diff"][0])
+    assert len(data["pmtrwf"]) == 2 * len(selected)
+    data, _ = read_rd(outputs["diff"][1])
+    assert len(data["pmtrwf"]) == 2 * (7 - len(selected))
+
+
+def test_filter_encoded():
+    """
+    Check the filters give the same selection on an encoded file
+    """
+    tmpdir = tempfile.mkdtemp()
+    filters = (Min_charge(min_signal=20),
+               Min_energy(min_signal=NPMT * PMTWL * 2400, apply_on="RWF"))
+    selections = []
+    for encoding in (None, "diff"):
+        filename = os.path.join(tmpdir, "{}.h5".format(encoding))
+        write_rd(filename, 6, encoding)
+        with tb.open_file(filename) as h5f:
+            selections.append([filter_.select(h5f, 0, 6)
+                               for filter_ in filters])
+            for filter_, selection in zip(filters, selections[-1]):
+                np.testing.assert_array_equal(
+                    [filter_(h5f, i) for i in range(6)], selection)
+    np.testing.assert_array_equal(selections[0], selections[1])
+    np.testing.assert_array_equal(selections[0][0], np.arange(6) % 2 == 1)
+    assert selections[0][1].all()
+
+
+def test_merger_chunks():
+    """
+    Check the merged file does not depend on the chunk size and holds the
+    events selected one by one, renumbered, with their pmaps
+    """
+    tmpdir = tempfile.mkdtemp()
+    inputs = [os.path.join(tmpdir, "in{}.h5".format(i)) for i in range(3)]
+    for i, filename in enumerate(inputs):
+        write_events(filename, seed=i)
+    options = {"FILTERS": ["Baseline", "NumberS1S2"], "RAISE_ERRORS": True,
+               "Baseline:max_adc": 10, "NumberS1S2:nS1": 2,
+               "NumberS1S2:nS2": 1}
+
+    filters = batch_filters([Baseline(max_adc=10), NumberS1S2(nS1=2, nS2=1)])
+    wfs, pmaps, nsel = [], [], 0
+    for filename in inputs:
+        with tb.open_file(filename) as h5f:
+            nevt = tbl.get_nevents(h5f)
+            selected = [i for i in range(nevt)
+                        if all(filter_(h5f, i) for filter_ in filters)]
+            wfs.append(h5f.root.RD.pmtrwf.read()[selected])
+            for i in selected:
+                rows = h5f.root.PMAPS.PMaps.read_where("event == i")
+                rows["event"] = nsel
+                pmaps.append(rows)
+                nsel += 1
+    assert 0 < nsel < 3 * nevt
+
+    outputs = []
+    for chunk in (1, 4, None):
+        output = os.path.join(tmpdir, "out{}.h5".format(chunk))
+        chunk_options = dict(options)
+        if chunk is not None:
+            chunk_options["CHUNK_SIZE"] = chunk
+        file_merger(output, None, *inputs, **chunk_options)
+        outputs.append(read_nodes(output))
+
+    for nodes in outputs[1:]:
+        assert sorted(nodes) == sorted(outputs[0])
+        for path, data in outputs[0].items():
+            np.testing.assert_array_equal(nodes[path], data)
+    np.testing.assert_array_equal(outputs[0]["/RD/pmtrwf"],
+                                  np.concatenate(wfs))
+    np.testing.assert_array_equal(outputs[0]["/PMAPS/PMaps"],
+                                  np.concatenate(pmaps))
+    assert len(outputs[0]["/Catalog/Events"]) == nsel
+
+
+def test_merger_parallel():
+    """
+    Check the parallel merger writes the same selected and discarded files
+    as the serial one and leaves no shards behind
+    """
+    tmpdir = tempfile.mkdtemp()
+    inputs = [os.path.join(tmpdir, "in{}.h5".format(i)) for i in range(3)]
+    for i, filename in enumerate(inputs):
+        write_events(filename, seed=i)
+    options = {"FILTERS": ["Min_charge", "NumberS1S2"], "RAISE_ERRORS": True,
+               "CHUNK_SIZE": 5, "Min_charge:min_signal": 13,
+               "NumberS1S2:nS1": 2, "NumberS1S2:nS2": 1}
+
+    outputs = {}
+    for njobs in (1, 2):
+        outdir = os.path.join(tmpdir, "j{}".format(njobs))
+        os.mkdir(outdir)
+        output = os.path.join(outdir, "out.h5")
+        discarded = os.path.join(outdir, "dis.h5")
+        file_merger(output, discarded, *inputs,
+                    **dict(options, NJOBS=njobs))
+        assert sorted(os.listdir(outdir)) == ["dis.h5", "out.h5"]
+        outputs[njobs] = read_nodes(output), read_nodes(discarded)
+
+    for serial, parallel in zip(outputs[1], outputs[2]):
+        assert sorted(parallel) == sorted(serial)
+        for path, data in serial.items():
+            assert parallel[path].dtype == data.dtype
+            assert parallel[path].tobytes() == data.tobytes()
+    assert 0 < len(outputs[1][0]["/RD/pmtrwf"]) < 3 * FILTER_NEVT
+
+
+def test_merger_skip():
+    """
+    Check a file whose events are numbered from SKIP in the tables (as
+    DIOMIRA writes them), with a trailing event without true waveforms and
+    without catalog, is merged as the same file with a catalog
+    """
+    tmpdir = tempfile.mkdtemp()
+    skip, nevt = 3, 5
+    filenames = [os.path.join(tmpdir, name + ".h5")
+                 for name in ("plain", "catalog")]
+    for filename in filenames:
+        write_rd(filename, nevt)
+        with tb.open_file(filename, "a") as h5f:
+            group = h5f.create_group(h5f.root, "TWF")
+            for name in ("PMT", "SiPM"):
+                table = h5f.create_table(group, name, SENSOR_WF)
+                rows = np.zeros(2 * (nevt - 1), dtype=table.dtype)
+                rows["event"] = skip + np.repeat(np.arange(nevt - 1), 2)
+                rows["ID"] = np.tile(np.arange(2), nevt - 1)
+                rows["ene_pes"] = np.arange(rows.size)
+                table.append(rows)
+            if filename.endswith("catalog.h5"):
+                tbl.build_catalog(h5f, skip + np.arange(nevt))
+            else:
+                assert tbl.get_nevents(h5f) == nevt
+                assert tbl.first_event(h5f) == skip
+
+    outputs = []
+    for filename in filenames:
+        output = filename.replace(".h5", "_out.h5")
+        file_merger(output, None, filename, RAISE_ERRORS=True)
+        outputs.append(read_nodes(output))
+    for path, data in outputs[1].items():
+        np.testing.assert_array_equal(outputs[0][path], data)
+    twf = outputs[0]["/TWF/PMT"]
+    np.testing.assert_array_equal(twf["event"],
+                                  np.repeat(np.arange(nevt - 1), 2))
+    np.testing.assert_array_equal(twf["ene_pes"], np.arange(twf.size))
+    np.testing.assert_array_equal(outputs[0]["/Catalog/Events"]["twf_pmt"],
+                                  [[0, 2], [2, 4], [4, 6], [6, 8], [8, 8]])
@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+
+import Core.mplFunctions as mpl
+
+
+def slices_with_nans(seed=1):
+    """
+    Slices of 30 SiPMs with NaNs scattered, a slice all NaN, an empty one
+    and one with negative signals only
+    """
+    rng = np.random.RandomState(seed)
+    slices = rng.exponential(5., (8, 30))
+    slices[rng.rand(*slices.shape) < 0.2] = np.nan
+    slices[2] = np.nan
+    slices[3] = 0.
+    slices[4] = -rng.uniform(1., 2., 30)
+    return slices
+
+
+def test_slice_selections():
+    """
+    Check the selection of all slices at once against the cut applied to
+    each slice in turn
+    """
+    slices = slices_with_nans()
+    for thrs in (0., 0.1, 0.5):
+        expected = []
+        for slice_ in slices:
+            with np.errstate(invalid="ignore"):
+                if np.isnan(slice_).all():
+                    maximum = np.nan
+                else:
+                    maximum = np.nanmax(slice_)
+                expected.append(slice_ > maximum * thrs)
+        selections = mpl.slice_selections(slices, thrs)
+        assert selections.dtype == bool
+        np.testing.assert_array_equal(selections, expected)
+    assert not selections[2:4].any()
+    assert selections[0].any()
+
+
+def test_save_movie_frames():
+    """
+    Check the frames of each event are written with the expected names
+    """
+    tmpdir = tempfile.mkdtemp()
+    slices = slices_with_nans()
+    sipmdf = pd.DataFrame({"X": np.arange(30) % 6 * 10.,
+                           "Y": np.arange(30) // 6 * 10.})
+    events = {7: slices[:3], 2: slices[3:5]}
+    filenames = mpl.save_movie_frames(events, sipmdf, tmpdir)
+
+    expected = [["event2_0000.png", "event2_0001.png"],
+                ["event7_0000.png", "event7_0001.png", "event7_0002.png"]]
+    assert [[os.path.basename(f) for f in event] for event in filenames] == \
+        expected
+    assert sorted(os.listdir(tmpdir)) == sorted(sum(expected, []))
+    for filename in sum(filenames, []):
+        assert os.path.getsize(filename) > 0
@@ -0,0 +1,102 @@
+import os
+import tempfile
+
+import numpy as np
+import tables as tb
+
+import Core.tblFunctions as tbl
+from Core.Chain import Chain
+from Core.Nh5 import PMAP
+from Core.Bridges import Peak, PMap, Signal
+
+
+def write_pmaps(h5f, nevt, empty=(0, 3)):
+    """
+    Fill a PMaps table with random pmaps. Events in *empty* have no peaks.
+    """
+    group = h5f.create_group(h5f.root, "PMAPS")
+    table = h5f.create_table(group, "PMaps", PMAP)
+    pmaps = {}
+    for evt in range(nevt):
+        peaks = []
+        if evt not in empty:
+            for _ in range(evt % 2 + 1):
+                n = evt % 3 + 1
+                peaks.append(Peak(np.arange(n, dtype=float), np.random.rand(n),
+                                  np.random.rand(n, 1792), np.ones(n),
+                                  Signal.S2))
+        pmaps[evt] = PMap(peaks=peaks)
+        tbl.store_pmap(pmaps[evt], table, evt)
+    return table, pmaps
+
+
+def test_catalog_ranges():
+    """
+    Check the catalog row ranges cover each event, empty ones included
+    """
+    filename = os.path.join(tempfile.mkdtemp(), "catalog.h5")
+    with tb.open_file(filename, "w") as h5f:
+        table, pmaps = write_pmaps(h5f, 6)
+        tbl.build_catalog(h5f)
+
+        catalog = tbl.read_catalog(h5f)
+        assert tbl.get_nevents(h5f) == 6
+        assert catalog.size == 6
+        assert np.all(catalog["pmaps"][1:, 0] == catalog["pmaps"][:-1, 1])
+        assert catalog["pmaps"][-1, 1] == table.nrows
+        for evt in (0, 3):
+            start, stop = tbl.get_event_rows(h5f, "pmaps", evt)
+            assert start == stop
+
+
+def test_read_pmap_with_rows():
+    """
+    Check that reading a pmap through the catalog gives the same pmap
+    """
+    filename = os.path.join(tempfile.mkdtemp(), "catalog.h5")
+    with tb.open_file(filename, "w") as h5f:
+        table, pmaps = write_pmaps(h5f, 6)
+        tbl.build_catalog(h5f)
+
+        for evt, pmap in pmaps.items():
+            rows = tbl.get_event_rows(h5f, "pmaps", evt)
+            read = tbl.read_pmap(table, evt, rows)
+            assert len(read.peaks) == len(pmap.peaks)
+            for peak, peak_read in zip(pmap.peaks, read.peaks):
+                np.testing.assert_allclose(peak.times, peak_read.times)
+                np.testing.assert_allclose(peak.cathode, peak_read.cathode,
+                                           rtol=1e-6)
+                np.testing.assert_allclose(peak.anode, peak_read.anode,
+                                           rtol=1e-6)
+
+
+def test_encoded_wf_array():
+    """
+    Check encoded waveforms (with pulses escaping the Int8 range) read back
+    unchanged, directly and through a chain, and can be truncated
+    """
+    wfs = np.random.normal(2500, 2, size=(7, 3, 200)).astype(np.int16)
+    wfs[:, 1, 50:60] -= 1000
+    wfs[2, 2, 100] = 32767
+    filename = os.path.join(tempfile.mkdtemp(), "rwf.h5")
+    for encoding in ("baseline", "diff"):
+        with tb.open_file(filename, "w") as h5f:
+            group = h5f.create_group(h5f.root, "RD")
+            array = tbl.create_wf_array(group, "pmtrwf", (3, 200),
+                                        filters=tbl.filters("ZLIB4"),
+                                        encoding=encoding)
+            array.append(wfs[:3])
+            array.append(wfs[3:])
+            assert h5f.root.RD.pmtrwf.dtype == np.int8
+
+        with Chain(filename) as chain:
+            np.testing.assert_array_equal(chain.root.RD.pmtrwf[1:6], wfs[1:6])
+        with tb.open_file(filename, "a") as h5f:
+            array = tbl.get_wf_array(h5f, "/RD/pmtrwf")
+            assert array.shape == wfs.shape
+            np.testing.assert_array_equal(array[2], wfs[2])
+            np.testing.assert_array_equal(array[-3:, 1], wfs[-3:, 1])
+            array.truncate(3)
+            array.append(wfs[5:])
+            np.testing.assert_array_equal(array.read(),
+                                          np.concatenate((wfs[:3], wfs[5:])))
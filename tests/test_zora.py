@@ -0,0 +1,108 @@
+import os
+import tempfile
+
+import numpy as np
+import tables as tb
+
+from Benchmarks.stubdb import make_stub_db, NPMT, NSIPM
+import Core.wfmFunctions as wfm
+import Database.loadDB as DB
+import Sierpe.FEE as FE
+from Cities.ZORA import Zora, read_summary
+
+
+def write_run(filename, nevt, seed=1, zs=False):
+    """
+    RWF file with a pulse in every PMT and in one SiPM per event, the BLR
+    waveform matching the CWF and a saturated PMT sample in event 1.
+    With zs, the SiPMs are zero suppressed as DIOMIRA writes them and one
+    of them is saturated in event 2.
+    """
+    rng = np.random.RandomState(seed)
+    pulse = np.zeros(1000)
+    pulse[600:650] = 200.
+    pmtcwf = np.tile(pulse, (nevt, NPMT, 1))
+    pmtrwf = np.round(FE.OFFSET - pmtcwf +
+                      rng.normal(0., 2., pmtcwf.shape)).astype(np.int16)
+    pmtrwf[1, 0, 700] = 0
+    pmtblr = (FE.CEILING - 100 - pmtcwf).astype(np.int16)
+    sipmrwf = np.round(50 + rng.normal(0., 1., (nevt, NSIPM, 40)))
+    sipmrwf[np.arange(nevt), np.arange(nevt), 20] += 300
+    if zs:
+        sipmrwf = np.array([wfm.noise_suppression(wfs - 50, 10)
+                            for wfs in sipmrwf])
+        sipmrwf[2, 5, 30:33] = FE.CEILING - 1
+    with tb.open_file(filename, "w") as h5f:
+        group = h5f.create_group(h5f.root, "RD")
+        for name, data in (("pmtrwf", pmtrwf), ("pmtcwf", pmtcwf),
+                           ("pmtblr", pmtblr), ("sipmrwf", sipmrwf)):
+            h5f.create_earray(group, name, tb.Int16Atom(),
+                              (0,) + data.shape[1:]).append(data)
+
+
+def test_zora(monkeypatch):
+    """
+    Check the monitoring quantities of a synthetic run, and that they do
+    not depend on the batches or the shards the run is split in
+    """
+    tmpdir = tempfile.mkdtemp()
+    make_stub_db(tmpdir)
+    monkeypatch.setenv("ICDIR", tmpdir)
+    filename = os.path.join(tmpdir, "run.h5")
+    write_run(filename, 6)
+
+    summaries = []
+    for name, options in (("serial", {}), ("sharded", {"SHARDS": 2,
+                                                        "BATCH_SIZE": 2})):
+        output = os.path.join(tmpdir, name + ".h5")
+        Zora(dict({"FILE_IN": filename, "FILE_OUT": output, "SKIP": 0,
+                   "NEVENTS": 6, "RUN_ALL": False, "COMPRESSION": "ZLIB4"},
+                  **options)).run()
+        summaries.append(read_summary(output))
+
+    (events, sipms), (sharded_events, sharded_sipms) = summaries
+    assert sorted(events) == sorted(sharded_events)
+    for name, values in events.items():
+        np.testing.assert_array_equal(sharded_events[name], values)
+    for name, values in sipms.items():
+        np.testing.assert_allclose(sharded_sipms[name], values, rtol=1e-6)
+
+    np.testing.assert_array_equal(events["event"], np.arange(6))
+    np.testing.assert_allclose(events["pmt_baseline"], FE.OFFSET, atol=0.5)
+    np.testing.assert_allclose(events["pmt_noise"], 2., rtol=0.2)
+    assert events["pmt_saturated"].sum() == events["pmt_saturated"][1, 0] == 1
+    pes = 50 * 200. / np.abs(DB.DataPMT()["adc_to_pes"].values)
+    np.testing.assert_allclose(events["pmt_energy"], np.tile(pes, (6, 1)),
+                               rtol=1e-6)
+    np.testing.assert_allclose(events["blr_energy"], events["pmt_energy"],
+                               rtol=1e-6)
+    np.testing.assert_allclose(events["blr_residual"], 0., atol=1e-6)
+
+    sipm_pes = 300. / DB.DataSiPM()["adc_to_pes"].values[:6]
+    np.testing.assert_allclose(events["sipm_energy"], sipm_pes, rtol=0.1)
+    assert not events["sipm_saturated"].any()
+    index, baselines, errors = sipms["baseline"]
+    np.testing.assert_array_equal(index, np.arange(NSIPM))
+    np.testing.assert_allclose(baselines, 50., atol=1.)
+    np.testing.assert_allclose(sipms["noise"][1], 1., atol=0.5)
+
+
+def test_zora_zero_suppressed(monkeypatch):
+    """
+    Check that the zeros of zero suppressed SiPM waveforms are not taken
+    as saturated samples
+    """
+    tmpdir = tempfile.mkdtemp()
+    make_stub_db(tmpdir)
+    monkeypatch.setenv("ICDIR", tmpdir)
+    filename = os.path.join(tmpdir, "run.h5")
+    output = os.path.join(tmpdir, "zs.h5")
+    write_run(filename, 4, zs=True)
+    Zora({"FILE_IN": filename, "FILE_OUT": output, "SKIP": 0, "NEVENTS": 4,
+          "RUN_ALL": False, "COMPRESSION": "ZLIB4"}).run()
+    events, sipms = read_summary(output)
+
+    np.testing.assert_array_equal(events["sipm_saturated"], [0, 0, 3, 0])
+    index, counts = sipms["saturated"]
+    np.testing.assert_array_equal(counts, np.where(index == 5, 3, 0))
+    assert events["pmt_saturated"].sum() == 1